@@ -9,3 +9,6 @@ __version__ = '.'.join(str(i) for i in version_info)
 # make everything available in root package for convenience
 from .mman import *
 from .buf import *
+from .stream import *
+from .table import *
+from .trace import *
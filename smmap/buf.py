@@ -1,9 +1,7 @@
 """Module with a simple buffer implementation using the memory manager"""
 import sys
 
-__all__ = ["SlidingWindowMapBuffer"]
-
-import sys
+__all__ = ["SlidingWindowMapBuffer", "ChainedView"]
 
 try:
     bytes
@@ -11,6 +9,86 @@ except NameError:
     bytes = str
 
 
+class ChainedView(object):
+
+    """A read-only view on data spanning multiple windows, without copying it.
+    It holds a memoryview per window, and keeps all windows mapped until it is released.
+
+    Iterating it yields the views on each window in order, which allows consumers taking multiple buffers,
+    like socket.sendmsg() or file.writelines(), to use the data without copying it.
+
+    **Note:** release the view as soon as possible, or use it as context manager, as the windows it
+    uses cannot be unmapped while it exists. Segments must not be used after release."""
+    __slots__ = (
+        '_regions',     # regions whose client count we incremented
+        '_views',       # memoryview for each segment
+        '_size',        # total amount of bytes
+    )
+
+    def __init__(self, regions, views):
+        """Initialize the instance with the given regions, which must have had their client count incremented
+        on our behalf already, and the views into them"""
+        self._regions = regions
+        self._views = views
+        self._size = sum(len(v) for v in views)
+
+    def __del__(self):
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self._views)
+
+    #{ Interface
+
+    def segments(self):
+        """:return: list of memoryviews, one per window"""
+        return list(self._views)
+
+    def readinto(self, b):
+        """Copy our data into the writable buffer b
+        :return: amount of bytes copied, which is limited by the size of b"""
+        dst = memoryview(b)
+        pos = 0
+        for view in self._views:
+            nbytes = min(len(view), len(dst) - pos)
+            dst[pos:pos + nbytes] = view[:nbytes]
+            pos += nbytes
+            if pos == len(dst):
+                break
+            # END handle full buffer
+        # END for each view
+        return pos
+
+    def tobytes(self):
+        """:return: a copy of all our data as bytes"""
+        return bytes().join(v.tobytes() for v in self._views)
+
+    def release(self):
+        """Release all views and allow the windows to be unmapped. Can be called multiple times"""
+        for view in self._views:
+            if hasattr(view, 'release'):
+                view.release()
+            # END release view explicitly if possible
+        # END for each view
+        self._views = list()
+        self._size = 0
+        for region in self._regions:
+            region.increment_client_count(-1)
+        # END for each region
+        self._regions = list()
+
+    #} END interface
+
+
 class SlidingWindowMapBuffer(object):
 
     """A buffer like object which allows direct byte-wise object and slicing into
@@ -25,9 +103,10 @@ class SlidingWindowMapBuffer(object):
     __slots__ = (
         '_c',           # our cursor
         '_size',        # our supposed size
+        '_chained',     # if True, slices spanning multiple windows are returned as ChainedView
     )
 
-    def __init__(self, cursor=None, offset=0, size=sys.maxsize, flags=0):
+    def __init__(self, cursor=None, offset=0, size=sys.maxsize, flags=0, chained=False):
         """Initalize the instance to operate on the given cursor.
         :param cursor: if not None, the associated cursor to the file you want to access
             If None, you have call begin_access before using the buffer and provide a cursor
@@ -38,8 +117,11 @@ class SlidingWindowMapBuffer(object):
             area, although the length of the buffer is reported to be your given size.
             Hence it is in your own interest to provide a proper size !
         :param flags: Additional flags to be passed to os.open
+        :param chained: if True, slices spanning multiple windows are returned as ChainedView instead
+            of bytes, which doesn't copy the data
         :raise ValueError: if the buffer could not achieve a valid state"""
         self._c = cursor
+        self._chained = chained
         if cursor and not self.begin_access(cursor, offset, size, flags):
             raise ValueError("Failed to allocate the buffer - probably the given offset is out of bounds")
         # END handle offset
@@ -82,6 +164,39 @@ class SlidingWindowMapBuffer(object):
         if (c.ofs_begin() <= i) and (j < c.ofs_end()):
             b = c.ofs_begin()
             return c.buffer()[i - b:j - b]
+        # END fast path
+
+        if i < j and c._manager._overlap:
+            # move our window to the slice. Managers with overlapping windows provide a window containing
+            # all of it if it is small, even if it crosses the boundary of our previous window
+            c.use_region(i, self._size - i)
+            if c.is_valid() and j <= c.ofs_end():
+                # copy it like the slow path does, as a view would keep the window from being unmapped
+                d = c.buffer()[:j - i]
+                if hasattr(d, 'tobytes'):
+                    d = d.tobytes()
+                return d
+            # END handle slice in new window
+        # END handle non-empty slice of overlapping windows
+
+        if self._chained:
+            l = j - i
+            ofs = i
+            regions = list()
+            views = list()
+            while l:
+                c.use_region(ofs, l)
+                assert c.is_valid()
+                # keep the region alive while our view uses it
+                region = c.region()
+                region.increment_client_count()
+                regions.append(region)
+                d = c.buffer()[:l]
+                ofs += len(d)
+                l -= len(d)
+                views.append(d)
+            # END while there are bytes to read
+            return ChainedView(regions, views)
         else:
             l = j - i                 # total length
             ofs = i
@@ -117,7 +232,7 @@ class SlidingWindowMapBuffer(object):
                     md.append(d)
                 # END while there are bytes to read
                 return bytes().join(md)
-        # END fast or slow path
+        # END chained or copied slices
     #{ Interface
 
     def begin_access(self, cursor=None, offset=0, size=sys.maxsize, flags=0):
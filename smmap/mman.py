@@ -2,18 +2,53 @@
 from .util import (
     MapWindow,
     MapRegion,
+    PreadRegion,
     MapRegionList,
+    GridRegionList,
+    LatencyHistogram,
+    align_to_mmap,
     is_64_bit,
+    clock,
     string_types,
     buffer,
+    file_descriptor,
+    advise_file,
+    advise_map,
+    touch_pages,
+    read_pages,
+    MAP_POPULATE,
 )
 
+import os
 import sys
+import errno
+import select
+import socket
+import json
+import time
+import threading
+import weakref
+from mmap import ACCESS_READ, ACCESS_WRITE, ACCESS_COPY
+from bisect import bisect_right
 from functools import reduce
-
-__all__ = ["StaticWindowMapManager", "SlidingWindowMapManager", "WindowCursor"]
+from collections import OrderedDict
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+# END handle python 2
+
+__all__ = ["StaticWindowMapManager", "SlidingWindowMapManager", "GridWindowMapManager",
+           "HybridWindowMapManager", "WindowCursor",
+           "ConcatWindowCursor", "MultiWindowCursor"]
 #{ Utilities
 
+# mapping of access mode names accepted by make_cursor() -> mmap access modes
+_access_modes = dict(read=ACCESS_READ, write=ACCESS_WRITE, copy=ACCESS_COPY)
+
+# names of the backends accepted by make_cursor() and set_backend()
+_backends = ('mmap', 'pread')
+
 #}END utilities
 
 
@@ -33,15 +68,19 @@ class WindowCursor(object):
         '_rlist',   # a regions list with regions for our file
         '_region',  # our current class:`MapRegion` or None
         '_ofs',     # relative offset from the actually mapped area to our start area
-        '_size'     # maximum size we should provide
+        '_size',    # maximum size we should provide
+        '_path_or_fd',  # path or file descriptor we were created for, or None to use the one of _rlist
+        '_attached',    # tuple of region lists counting us as live cursor, see StaticWindowMapManager._set_access()
     )
 
-    def __init__(self, manager=None, regions=None):
+    def __init__(self, manager=None, regions=None, path_or_fd=None):
         self._manager = manager
         self._rlist = regions
         self._region = None
         self._ofs = 0
         self._size = 0
+        self._path_or_fd = path_or_fd
+        self._attached = tuple()
 
     def __del__(self):
         self._destroy()
@@ -55,14 +94,17 @@ class WindowCursor(object):
     def _destroy(self):
         """Destruction code to decrement counters"""
         self.unuse_region()
+        self._detach()
 
         if self._rlist is not None:
             # Actual client count, which doesn't include the reference kept by the manager, nor ours
             # as we are about to be deleted
             try:
-                if len(self._rlist) == 0:
+                if len(self._rlist) == 0 and not self._rlist._num_cursors:
                     # Free all resources associated with the mapped file
-                    self._manager._fdict.pop(self._rlist.path_or_fd())
+                    with self._manager._lock:
+                        self._manager._drop_region_list(self._rlist)
+                    # END with lock
                 # END remove regions list from manager
             except (TypeError, KeyError):
                 # sometimes, during shutdown, getrefcount is None. Its possible
@@ -73,16 +115,27 @@ class WindowCursor(object):
             # END exception handling
         # END handle regions
 
+    def _detach(self):
+        """Stop counting us as live cursor of our files"""
+        if self._attached:
+            with self._manager._lock:
+                self._manager._detach_cursor(self._attached)
+            # END with lock
+            self._attached = tuple()
+        # END handle attached cursor
+
     def _copy_from(self, rhs):
         """Copy all data from rhs into this instance, handles usage count"""
         self._manager = rhs._manager
-        self._rlist = type(rhs._rlist)(rhs._rlist)
+        self._rlist = rhs._rlist
         self._region = rhs._region
         self._ofs = rhs._ofs
         self._size = rhs._size
-
-        for region in self._rlist:
-            region.increment_client_count()
+        self._path_or_fd = rhs._path_or_fd
+        self._attached = rhs._attached
+        for rlist in self._attached:
+            rlist._num_cursors += 1
+        # END for each attached list
 
         if self._region is not None:
             self._region.increment_client_count()
@@ -115,11 +168,20 @@ class WindowCursor(object):
         either the file has reached its end, or the map was created between two existing regions"""
         need_region = True
         man = self._manager
+        histograms = man._histograms
+        if histograms is not None:
+            st = clock()
+        # END measure latency
+        if man._validate_interval is not None:
+            with man._lock:
+                man._validate_region_list(self._rlist)
+            # END with lock
+        # END check for changed files
         fsize = self._rlist.file_size()
         size = min(size or fsize, man.window_size() or fsize)   # clamp size to window size
 
         if self._region is not None:
-            if self._region.includes_ofs(offset):
+            if self._region_fits(self._region, offset, size, fsize):
                 need_region = False
             else:
                 self.unuse_region()
@@ -131,16 +193,356 @@ class WindowCursor(object):
             return self
         # END handle offset
 
+        num_maps = man._num_maps
         if need_region:
-            self._region = man._obtain_region(self._rlist, offset, size, flags, False)
-            self._region.increment_client_count()
+            with man._lock:
+                self._region = man._obtain_region(self._rlist, offset, size, flags, False)
+                self._region.increment_client_count()
+            # END with lock
         # END need region handling
 
+        if man._tracer is not None:
+            man._tracer.record(self._rlist.path_or_fd(), fsize, offset, size, num_maps == man._num_maps)
+        # END trace access
+        self._region._hc += 1
         self._ofs = offset - self._region._b
         self._size = min(size, self._region.ofs_end() - offset)
 
+        if histograms is not None:
+            histograms[num_maps == man._num_maps and 'use_region_hit' or 'use_region_miss'].record(clock() - st)
+        # END record latency
         return self
 
+    def _region_fits(self, region, offset, size, fsize):
+        """:return: True if the given region may serve an access of size bytes at offset, which is the case
+            if it includes the offset, and all bytes an overlapping sliding window manager guarantees"""
+        if not region.includes_ofs(offset) or region._stale:
+            return False
+        # END handle offset
+        overlap = self._manager._overlap
+        return not overlap or region.includes_ofs(min(offset + min(size, overlap), fsize) - 1)
+
+    def read_at(self, offset, size):
+        """Read bytes from the file, moving the cursor to another window only if needed.
+        This is the fastest way to read small amounts of data, as reads within the current window
+        take a single bounds check. Windows of replaced files are left once they are known to be stale.
+
+        :param offset: absolute offset into the file
+        :param size: amount of bytes to read
+        :return: bytes at the given offset. Fewer bytes than requested are returned if the file
+            ends before, and no bytes if the offset is at or beyond the end of the file
+        :raise ValueError: if the offset is negative"""
+        r = self._region
+        if r is not None and not r._stale:
+            rofs = offset - r._b
+            if 0 <= rofs and rofs + size <= r._size:
+                return r._mf[rofs:rofs + size]
+            # END fast path
+        # END handle region
+        return self._read_slow(offset, size, False)
+
+    def view_at(self, offset, size):
+        """Like read_at(), but return a memoryview of the window, which doesn't copy the data if
+        all of it is contained in a single window. Otherwise a view on a copy is returned.
+
+        **Note:** views should not be kept beyond the duration of your access, they prevent the window
+        from being unmapped, see buffer()"""
+        r = self._region
+        if r is not None and not r._stale:
+            rofs = offset - r._b
+            if 0 <= rofs and rofs + size <= r._size:
+                return memoryview(r._mf)[rofs:rofs + size]
+            # END fast path
+        # END handle region
+        return self._read_slow(offset, size, True)
+
+    def _read_slow(self, offset, size, as_view):
+        """Implements read_at() and view_at() if the requested data is not in our current window"""
+        if offset < 0:
+            raise ValueError("Cannot read at negative offset %i" % offset)
+        # END handle offset
+        size = max(0, min(size, self.file_size() - offset))
+        if not size or not self.use_region(offset, size).is_valid():
+            if as_view:
+                return memoryview(bytes())
+            return bytes()
+        # END handle end of file
+
+        # after use_region(), our window starts at offset, and _size bytes are available
+        r = self._region
+        if self._size >= size:
+            if as_view:
+                return memoryview(r._mf)[self._ofs:self._ofs + size]
+            return r._mf[self._ofs:self._ofs + size]
+        # END read from single window
+
+        # the data crosses windows
+        chunks = list()
+        while size:
+            r = self.use_region(offset, size)._region
+            nbytes = min(size, self._size)
+            chunks.append(r._mf[self._ofs:self._ofs + nbytes])
+            offset += nbytes
+            size -= nbytes
+        # END while there is data
+        data = bytes().join(chunks)
+        if as_view:
+            return memoryview(data)
+        return data
+
+    def gather(self, ranges, out=None):
+        """Read many ranges of the file at once. The ranges are visited in the order of their offsets,
+        so each window has to be obtained only once, no matter the order in which the ranges are given.
+
+        :param ranges: sequence of (offset, size) tuples with absolute offsets into the file
+        :param out: if not None, a writable bytes-like object large enough to hold the data of all ranges,
+            which will be written back to back in the order of the given ranges.
+        :return: out if it was given, otherwise a list of memoryviews with the data of each range,
+            in the order of the given ranges. All views share a single bytearray.
+        :raise ValueError: if a range is out of bounds or out is too small
+
+        **Note:** the cursor will point to the window containing the last byte read afterwards"""
+        ranges = list(ranges)
+        positions = list()
+        total = 0
+        for ofs, size in ranges:
+            positions.append(total)
+            total += size
+        # END for each range
+
+        return_views = out is None
+        if return_views:
+            out = bytearray(total)
+        elif len(out) < total:
+            raise ValueError("Output buffer needs to hold at least %i bytes" % total)
+        # END handle output
+        dst = memoryview(out)
+
+        fsize = self.file_size()
+        src = src_region = None
+        for i in sorted(range(len(ranges)), key=lambda i: ranges[i][0]):
+            ofs, size = ranges[i]
+            if ofs < 0 or ofs + size > fsize:
+                raise ValueError("Range (%i, %i) is out of bounds of file with size %i" % (ofs, size, fsize))
+            # END check bounds
+            pos = positions[i]
+            while size:
+                if self._region is None or not self.includes_ofs(ofs):
+                    # don't keep the old map exported, it may be collected now
+                    src = src_region = None
+                    self.use_region(ofs)
+                # END obtain window
+                r = self._region
+                if r is not src_region:
+                    src = memoryview(r.buffer())
+                    src_region = r
+                # END get view on window
+                rofs = self._ofs + ofs - self.ofs_begin()
+                nbytes = min(size, self.ofs_end() - ofs)
+                dst[pos:pos + nbytes] = src[rofs:rofs + nbytes]
+                pos += nbytes
+                ofs += nbytes
+                size -= nbytes
+            # END while range is not read
+        # END for each range in offset order
+        src = None
+
+        if return_views:
+            return [dst[p:p + size] for p, (_, size) in zip(positions, ranges)]
+        # END handle views
+        return out
+
+    def send_range(self, dst, offset, size):
+        """Write a range of our file to a socket, file object or file descriptor without copying it through
+        user space if possible.
+
+        The data is transferred by the kernel using os.sendfile or os.copy_file_range if available.
+        Otherwise, views on the mapped windows are sent with socket.sendmsg, or written to the destination.
+        Copy-on-write files are always sent from their windows, as the kernel would send the bytes on disk.
+
+        :param dst: a socket, a file object, or a file descriptor. File objects are flushed before writing
+            as their buffers are bypassed, and their position is adjusted afterwards.
+        :param offset: absolute offset into our file
+        :param size: amount of bytes to send. It is clamped to the end of the file
+        :return: amount of bytes sent"""
+        size = max(0, min(size, self.file_size() - offset))
+        if not size:
+            return 0
+        # END handle empty range
+
+        fileno = getattr(dst, 'fileno', None)
+        out_fd = dst
+        pos = None
+        if fileno is not None:
+            try:
+                out_fd = fileno()
+            except (IOError, OSError, ValueError):
+                # in-memory files have a fileno() method, which raises
+                fileno = None
+            # END handle objects without file descriptor
+        # END get file descriptor
+        if fileno is not None and hasattr(dst, 'flush'):
+            dst.flush()
+            try:
+                pos = dst.tell()
+            except (IOError, OSError):
+                pass
+            # END handle unseekable files
+        # END handle file objects
+
+        rlist = self._rlist
+        kernel_copy = fileno is not None or isinstance(dst, int)
+        if rlist._access == ACCESS_COPY:
+            # private modifications are not in the file
+            kernel_copy = False
+        elif kernel_copy and rlist._access == ACCESS_WRITE and rlist._backend == 'pread':
+            # modifications are only in our buffers until they are written back
+            self.flush(offset, size)
+        # END handle modifications the kernel can't see
+
+        if kernel_copy:
+            for name in ('sendfile', 'copy_file_range'):
+                func = getattr(os, name, None)
+                if func is None:
+                    continue
+                # END skip unsupported functions
+                sent = 0
+                try:
+                    with file_descriptor(self.path_or_fd()) as in_fd:
+                        while sent < size:
+                            try:
+                                if name == 'sendfile':
+                                    nbytes = func(out_fd, in_fd, offset + sent, size - sent)
+                                else:
+                                    nbytes = func(in_fd, out_fd, size - sent, offset + sent)
+                                # END call function
+                            except OSError as e:
+                                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                                    raise
+                                # END handle genuine errors
+                                self._wait_writable(dst, out_fd)
+                                continue
+                            # END handle non-blocking destinations
+                            if not nbytes:
+                                break
+                            # END handle end of file
+                            sent += nbytes
+                        # END while there is data to send
+                    # END with input file
+                except OSError:
+                    # the kind of files is not supported by this call. If some bytes were sent already,
+                    # the error is genuine though
+                    if sent:
+                        raise
+                    # END handle partial sends
+                    continue
+                # END handle unsupported files
+                if pos is not None:
+                    dst.seek(pos + sent)
+                # END keep file position in sync
+                return sent
+            # END for each kernel copy function
+        # END handle file descriptors
+
+        # fall back to sending views on our windows
+        sent = 0
+        sendmsg = getattr(dst, 'sendmsg', None)
+        while sent < size:
+            view = self.use_region(offset + sent, size - sent).buffer()
+            if sendmsg is not None:
+                nbytes = sendmsg([view])
+            elif isinstance(dst, int):
+                nbytes = os.write(dst, view)
+            else:
+                nbytes = dst.write(view)
+                if nbytes is None:
+                    nbytes = len(view)
+                # END handle write without return value
+            # END send view
+            # don't keep the window exported, it may have to be unmapped
+            del(view)
+            sent += nbytes
+        # END while there is data to send
+        return sent
+
+    @staticmethod
+    def _wait_writable(dst, fd):
+        """Wait until the non-blocking file descriptor fd of dst accepts more data. Sockets with a timeout are
+        non-blocking, which is why we wait at most as long as their timeout
+        :raise socket.timeout: if the timeout of the socket expired"""
+        gettimeout = getattr(dst, 'gettimeout', None)
+        timeout = gettimeout and gettimeout()
+        if not select.select([], [fd], [], timeout)[1]:
+            raise socket.timeout("timed out")
+        # END handle timeout
+
+    def write_at(self, offset, data):
+        """Write the given bytes to the file at the given absolute offset, moving the cursor to other windows
+        as needed. The file must be mapped for writing or copy-on-write, see make_cursor(). Files mapped for
+        writing grow as needed. Modified regions are written back when flush() is called, or once they
+        are unmapped. Modified copy-on-write regions are never collected, as this would lose the modifications.
+
+        :param data: bytes or any other object supporting the buffer protocol
+        :return: amount of written bytes
+        :raise ValueError: if the file is mapped read-only, or if a copy-on-write file would have to grow"""
+        access = self._rlist._access
+        if access == ACCESS_READ:
+            raise ValueError("Cannot write to a file mapped read-only, create the cursor with access='write'")
+        # END handle read-only files
+        src = memoryview(data)
+        if src.format != 'B':
+            src = src.cast('B')
+        # END handle typed buffers
+        size = len(src)
+        if offset + size > self.file_size():
+            if access != ACCESS_WRITE:
+                raise ValueError("Cannot grow a file mapped copy-on-write")
+            # END handle copy-on-write files
+            with self._manager._lock:
+                self._manager._grow_region_list(self._rlist, offset + size)
+            # END with lock
+        # END grow file
+
+        pos = 0
+        while pos < size:
+            ofs = offset + pos
+            r = self._region
+            if r is None or r._stale or not self.includes_ofs(ofs):
+                if not self.use_region(ofs, size - pos).is_valid():
+                    break
+                # END handle end of file
+                r = self._region
+            # END assure window
+            begin = self._ofs + ofs - self.ofs_begin()
+            count = min(size - pos, self.ofs_end() - ofs)
+            r._mf[begin:begin + count] = src[pos:pos + count]
+            r.mark_dirty(begin, count)
+            pos += count
+        # END while there is data to write
+        return pos
+
+    def flush(self, offset=0, size=0):
+        """Write modified bytes of our file back to disk, using one msync call per modified region
+        :param offset: absolute offset of the first byte to flush
+        :param size: amount of bytes to flush. If 0, everything up to the end of the file is flushed
+        :return: amount of flushed regions. Copy-on-write files are never flushed"""
+        if self._rlist._access == ACCESS_COPY:
+            return 0
+        # END handle private modifications
+        end = size and offset + size or sys.maxsize
+        regions = list(self._rlist)
+        if self._region is not None and self._region not in regions:
+            regions.append(self._region)
+        # END handle replaced current region
+        num_flushed = 0
+        for region in regions:
+            if region.is_dirty() and region.ofs_begin() < end and offset < region.ofs_end():
+                region.flush()
+                num_flushed += 1
+            # END handle dirty region in range
+        # END for each region
+        return num_flushed
+
     def unuse_region(self):
         """Unuse the current region. Does nothing if we have no current region
 
@@ -153,6 +555,30 @@ class WindowCursor(object):
         # note: should reset ofs and size, but we spare that for performance. Its not
         # allowed to query information if we are not valid !
 
+    def discard_region(self):
+        """Unuse the current region like unuse_region(), but unmap it right away if no other cursor uses it,
+        and advise the system to drop the file's pages in its range from the page cache. This prevents
+        one-time sequential scans from evicting the data other clients of the system work with.
+        :return: True if the region was unmapped"""
+        region = self._region
+        if region is None:
+            return False
+        # END handle no region
+        man = self._manager
+        a = self._rlist
+        self.unuse_region()
+        with man._lock:
+            if region.client_count() != 1 or region not in a or man._is_pinned(a, region):
+                return False
+            # END handle shared region
+            man._unmap_region(a, region)
+            man._resident_size = None
+        # END with lock
+        with file_descriptor(man._map_key(a)) as fd:
+            advise_file(fd, region.ofs_begin(), region.size(), 'DONTNEED')
+        # END with file
+        return True
+
     def buffer(self):
         """Return a buffer object which allows access to our memory region from our offset
         to the window size. Please note that it might be smaller than you requested when calling use_region()
@@ -211,26 +637,283 @@ class WindowCursor(object):
         return self._rlist.file_size()
 
     def path_or_fd(self):
-        """:return: path or file descriptor of the underlying mapped file"""
-        return self._rlist.path_or_fd()
+        """:return: path or file descriptor of the underlying mapped file, as given to make_cursor()"""
+        if self._path_or_fd is None:
+            return self._rlist.path_or_fd()
+        return self._path_or_fd
 
     def path(self):
         """:return: path of the underlying mapped file
         :raise ValueError: if attached path is not a path"""
-        if isinstance(self._rlist.path_or_fd(), int):
+        path_or_fd = self.path_or_fd()
+        if isinstance(path_or_fd, int):
             raise ValueError("Path queried although mapping was applied to a file descriptor")
         # END handle type
-        return self._rlist.path_or_fd()
+        return path_or_fd
 
     def fd(self):
         """:return: file descriptor used to create the underlying mapping.
 
         **Note:** it is not required to be valid anymore
         :raise ValueError: if the mapping was not created by a file descriptor"""
-        if isinstance(self._rlist.path_or_fd(), string_types()):
+        path_or_fd = self.path_or_fd()
+        if isinstance(path_or_fd, string_types()):
             raise ValueError("File descriptor queried although mapping was generated from path")
         # END handle type
-        return self._rlist.path_or_fd()
+        return path_or_fd
+
+    #} END interface
+
+
+class ConcatWindowCursor(WindowCursor):
+
+    """A cursor into a logical file made of multiple files, like the numbered parts of a split archive,
+    which are concatenated into one contiguous address space.
+
+    Each part is mapped on demand by the manager like any other file, sharing its memory budget.
+    All offsets are absolute offsets into the logical file. Windows never span multiple parts,
+    but reads crossing part boundaries are handled like reads crossing windows.
+
+    Cursors should not be created manually, but are returned by the manager's make_cursor()
+    if it is given a list of paths or file descriptors."""
+    __slots__ = (
+        '_rlists',  # region list of each part
+        '_bases',   # absolute offset at which each part begins, followed by the total size
+        '_base',    # absolute offset of the part our current region belongs to
+        '_part',    # index of the part our current region belongs to
+    )
+
+    def __init__(self, manager=None, regions=None, path_or_fd=None):
+        """Initialize the instance
+        :param regions: list of region lists, one for each part
+        :param path_or_fd: tuple of the paths or file descriptors of all parts, or None"""
+        regions = regions or list()
+        super(ConcatWindowCursor, self).__init__(manager, regions[0] if regions else None, path_or_fd)
+        self._rlists = regions
+        self._bases = [0] * (len(regions) + 1)
+        self._base = 0
+        self._part = 0
+        self._refresh_bases()
+
+    def _refresh_bases(self):
+        """Compute the absolute offsets of all parts from their current sizes, which change once a replaced
+        or modified part was validated
+        :return: True if any offset changed"""
+        bases = self._bases
+        changed = False
+        ofs = 0
+        for i, rlist in enumerate(self._rlists):
+            ofs += rlist.file_size()
+            if bases[i + 1] != ofs:
+                bases[i + 1] = ofs
+                changed = True
+            # END handle changed part
+        # END for each part
+        return changed
+
+    def _destroy(self):
+        self.unuse_region()
+        self._detach()
+        for rlist in self._rlists:
+            try:
+                if len(rlist) == 0 and not rlist._num_cursors:
+                    with self._manager._lock:
+                        self._manager._drop_region_list(rlist)
+                    # END with lock
+                # END remove regions list from manager
+            except (TypeError, KeyError):
+                # another cursor may have removed it already, or we are shutting down
+                pass
+            # END exception handling
+        # END for each part
+
+    def _copy_from(self, rhs):
+        super(ConcatWindowCursor, self)._copy_from(rhs)
+        self._rlist = rhs._rlist
+        self._rlists = list(rhs._rlists)
+        self._bases = list(rhs._bases)
+        self._base = rhs._base
+        self._part = rhs._part
+
+    #{ Interface
+
+    def use_region(self, offset=0, size=0, flags=0):
+        """Assure we point to a window of the part containing the given absolute offset.
+        See WindowCursor.use_region() for more information"""
+        self._refresh_bases()
+        part = bisect_right(self._bases, offset) - 1
+        if part < 0 or part >= len(self._rlists):
+            self.unuse_region()
+            return self
+        # END handle out of bounds
+        if part != self._part or self._rlists[part] is not self._rlist:
+            self.unuse_region()
+            self._part = part
+            self._rlist = self._rlists[part]
+        # END switch part
+        self._base = self._bases[part]
+        super(ConcatWindowCursor, self).use_region(offset - self._base, size, flags)
+        if self._refresh_bases():
+            # validation noticed a changed part, which moves all parts following it
+            return self.use_region(offset, size, flags)
+        # END handle changed part
+        return self
+
+    def read_at(self, offset, size):
+        r = self._region
+        if r is not None and not r._stale:
+            rofs = offset - self._base - r._b
+            if 0 <= rofs and rofs + size <= r._size:
+                return r._mf[rofs:rofs + size]
+            # END fast path
+        # END handle region
+        return self._read_slow(offset, size, False)
+
+    def view_at(self, offset, size):
+        r = self._region
+        if r is not None and not r._stale:
+            rofs = offset - self._base - r._b
+            if 0 <= rofs and rofs + size <= r._size:
+                return memoryview(r._mf)[rofs:rofs + size]
+            # END fast path
+        # END handle region
+        return self._read_slow(offset, size, True)
+
+    def send_range(self, dst, offset, size):
+        sent = 0
+        size = max(0, min(size, self.file_size() - offset))
+        while sent < size:
+            part = bisect_right(self._bases, offset + sent) - 1
+            base = self._bases[part]
+            nbytes = min(size - sent, self._bases[part + 1] - offset - sent)
+            c = self._manager.WindowCursorCls(self._manager, self._rlists[part])
+            sent += c.send_range(dst, offset + sent - base, nbytes)
+            c._destroy()
+        # END for each part
+        return sent
+
+    def ofs_begin(self):
+        return self._base + self._region._b + self._ofs
+
+    def ofs_end(self):
+        return self._base + self._region._b + self._ofs + self._size
+
+    def includes_ofs(self, ofs):
+        return super(ConcatWindowCursor, self).includes_ofs(ofs - self._base)
+
+    def file_size(self):
+        """:return: total size of all parts, as known since their last validation"""
+        self._refresh_bases()
+        return self._bases[-1]
+
+    def parts(self):
+        """:return: list of tuples of (path_or_fd, offset) of each part, offset being the absolute offset
+            of its first byte"""
+        return list(zip(self.path_or_fd(), self._bases))
+
+    def path_or_fd(self):
+        """:return: tuple of the paths or file descriptors of all parts"""
+        if self._path_or_fd is None:
+            return tuple(rlist.path_or_fd() for rlist in self._rlists)
+        return self._path_or_fd
+
+    def path(self):
+        """:return: tuple of the paths of all parts
+        :raise ValueError: if a part was given as file descriptor"""
+        paths = self.path_or_fd()
+        if any(isinstance(p, int) for p in paths):
+            raise ValueError("Path queried although a part was mapped using a file descriptor")
+        # END handle type
+        return paths
+
+    def fd(self):
+        """:return: tuple of the file descriptors of all parts
+        :raise ValueError: if a part was given as path"""
+        fds = self.path_or_fd()
+        if any(isinstance(p, string_types()) for p in fds):
+            raise ValueError("File descriptor queried although a part was mapped using a path")
+        # END handle type
+        return fds
+
+    #} END interface
+
+
+class MultiWindowCursor(WindowCursor):
+
+    """A cursor which keeps multiple windows of its file active at once, like the windows of a delta and
+    of its base object which are read alternately. Windows which were active recently are kept in a small
+    least-recently-used list of slots, which is checked before asking the manager for another window.
+
+    The cursor only points to one of its windows at a time, the current one, which is the one used by
+    buffer(), map() and all other methods of WindowCursor. All windows are kept alive until they are evicted
+    from their slot, or until unuse_region() is called.
+
+    Cursors should not be created manually, but are returned by the manager's make_cursor() if more
+    than one window is requested."""
+    __slots__ = (
+        '_slots',       # list of inactive regions we keep alive, most recently used first
+        '_num_slots',   # maximum amount of inactive regions
+    )
+
+    def __init__(self, manager=None, regions=None, path_or_fd=None, num_windows=4):
+        """Initialize the instance
+        :param num_windows: amount of windows to keep active at once, including the current one"""
+        super(MultiWindowCursor, self).__init__(manager, regions, path_or_fd)
+        self._slots = list()
+        self._num_slots = max(num_windows - 1, 0)
+
+    def _copy_from(self, rhs):
+        super(MultiWindowCursor, self)._copy_from(rhs)
+        self._slots = list(rhs._slots)
+        self._num_slots = rhs._num_slots
+        for region in self._slots:
+            region.increment_client_count()
+        # END for each slot
+
+    #{ Interface
+
+    def use_region(self, offset=0, size=0, flags=0):
+        """Assure we point to a window which allows access to the given offset into the file, preferring
+        windows we keep active already. See WindowCursor.use_region() for more information"""
+        r = self._region
+        if r is not None:
+            fsize = self._rlist.file_size()
+            csize = min(size or fsize, self._manager.window_size() or fsize)
+            if self._region_fits(r, offset, csize, fsize):
+                return super(MultiWindowCursor, self).use_region(offset, size, flags)
+            # END handle current window
+
+            # make the current window inactive, and look for one which fits in our slots
+            slots = self._slots
+            self._region = None
+            for i, region in enumerate(slots):
+                if self._region_fits(region, offset, csize, fsize):
+                    del(slots[i])
+                    self._region = region
+                    break
+                # END found window
+            # END for each slot
+            slots.insert(0, r)
+            if len(slots) > self._num_slots:
+                slots.pop().increment_client_count(-1)
+            # END evict least recently used window
+        # END handle current window
+        return super(MultiWindowCursor, self).use_region(offset, size, flags)
+
+    def unuse_region(self):
+        """Unuse the current region and all other active ones. See WindowCursor.unuse_region()"""
+        for region in self._slots:
+            region.increment_client_count(-1)
+        # END for each slot
+        del(self._slots[:])
+        super(MultiWindowCursor, self).unuse_region()
+
+    def active_regions(self):
+        """:return: list of all regions we keep active, the current one first, followed by the others
+            from most to least recently used"""
+        if self._region is None:
+            return list(self._slots)
+        return [self._region] + self._slots
 
     #} END interface
 
@@ -250,23 +933,51 @@ class StaticWindowMapManager(object):
 
     __slots__ = [
         '_fdict',           # mapping of path -> StorageHelper (of some kind
+        '_aliases',         # mapping of other paths or file descriptors of the same file -> region list in _fdict
+        '_idict',           # mapping of (st_dev, st_ino) -> region list in _fdict
         '_window_size',     # maximum size of a window
         '_max_memory_size',  # maximum amount of memory we may allocate
         '_max_handle_count',        # maximum amount of handles to keep open
         '_memory_size',     # currently allocated memory size
         '_handle_count',        # amount of currently allocated file handles
+        '_residency_interval',  # if not None, seconds after which the resident memory size is sampled again
+        '_resident_size',   # last sampled amount of resident bytes, or None
+        '_resident_time',   # time at which _resident_size was sampled
+        '_num_maps',        # total amount of regions mapped so far
+        '_tracer',          # AccessTracer recording all region accesses, or None
+        '_histograms',      # dict of LatencyHistograms by name, or None
+        '_validate_interval',  # if not None, seconds after which mapped files are checked for changes again
+        '_populate_size',   # if not 0, regions of at most this size are populated when they are mapped
+        '_prefault_queue',  # queue of (region, fd or None) to fault in on the prefault thread, or None
+        '_overlap',         # amount of bytes by which sliding windows overlap their neighbours
+        '_collect_budget',  # if not None, maximum amount of regions to unmap when mapping a new one
+        '_collect_time_budget',  # if not None, seconds after which to stop unmapping regions when mapping a new one
+        '_backend',         # name of the backend used for files which didn't choose one
+        '_blocks',          # OrderedDict of (file identity, offset, kind) -> cached block, least recently used first
+        '_block_memory_size',   # total size of all cached blocks in bytes
+        '_lock',            # lock serializing changes to our regions with the reaper thread
+        '_reaper',          # tuple of (thread, stop event) of the running reaper, or None
+        '_idle',            # mapping of region -> (hit count, time it was first seen idle with this hit count)
+        '__weakref__',
     ]
 
     #{ Configuration
     MapRegionListCls = MapRegionList
     MapWindowCls = MapWindow
     MapRegionCls = MapRegion
+    PreadRegionCls = PreadRegion
     WindowCursorCls = WindowCursor
+    ConcatWindowCursorCls = ConcatWindowCursor
+    MultiWindowCursorCls = MultiWindowCursor
     #} END configuration
 
     _MB_in_bytes = 1024 * 1024
+    _prefault_threaded = not MAP_POPULATE   # if True, populate regions on a background thread
+    _warm_chunk_size = 4 * _MB_in_bytes     # amount of bytes a warm-up thread touches at once
 
-    def __init__(self, window_size=0, max_memory_size=0, max_open_handles=sys.maxsize):
+    def __init__(self, window_size=0, max_memory_size=0, max_open_handles=sys.maxsize,
+                 residency_interval=None, validate_interval=None, collect_budget=None, collect_time_budget=None,
+                 populate_size=0):
         """initialize the manager with the given parameters.
         :param window_size: if -1, a default window size will be chosen depending on
             the operating system's architecture. It will internally be quantified to a multiple of the page size
@@ -276,13 +987,50 @@ class StaticWindowMapManager(object):
             It is a soft limit that is tried to be kept, but nothing bad happens if we have to over-allocate
         :param max_open_handles: if not maxint, limit the amount of open file handles to the given number.
             Otherwise the amount is only limited by the system itself. If a system or soft limit is hit,
-            the manager will free as many handles as possible"""
+            the manager will free as many handles as possible
+        :param residency_interval: if not None, max_memory_size limits the amount of mapped bytes which are
+            actually resident in memory instead of the amount of mapped bytes, and regions with the most
+            resident bytes are collected first. The residency is sampled using mincore at most every
+            residency_interval seconds. On systems without mincore, the mapped size is used instead.
+        :param validate_interval: if not None, cursors check whether their file was replaced or changed on disk,
+            for instance by a git gc rewriting a pack at the same path, at most every validate_interval seconds.
+            If so, only the regions of this file are unmapped, and its new size is used from now on.
+            If 0, files are checked whenever a cursor is pointed to a new region.
+        :param collect_budget: if not None, a new mapping unmaps at most this amount of unused regions to stay
+            within max_memory_size, which bounds the latency of use_region(). Until later mappings, collect()
+            or reap() caught up, we may exceed max_memory_size
+        :param collect_time_budget: if not None, a new mapping stops unmapping unused regions after this amount
+            of seconds, see collect_budget. At least one region is unmapped if needed though
+        :param populate_size: if not 0, regions of at most this amount of bytes are populated when they are mapped,
+            which is cheaper than faulting in their pages one by one on first access if most of them are used.
+            Larger windows stay lazy. MAP_POPULATE is used where available, otherwise the pages are faulted in
+            on a background thread"""
         self._fdict = dict()
+        self._aliases = dict()
+        self._idict = dict()
         self._window_size = window_size
         self._max_memory_size = max_memory_size
         self._max_handle_count = max_open_handles
         self._memory_size = 0
         self._handle_count = 0
+        self._residency_interval = residency_interval
+        self._resident_size = None
+        self._resident_time = 0
+        self._num_maps = 0
+        self._tracer = None
+        self._histograms = None
+        self._validate_interval = validate_interval
+        self._populate_size = populate_size
+        self._prefault_queue = None
+        self._overlap = 0
+        self._collect_budget = collect_budget
+        self._collect_time_budget = collect_time_budget
+        self._backend = 'mmap'
+        self._blocks = OrderedDict()
+        self._block_memory_size = 0
+        self._lock = threading.RLock()
+        self._reaper = None
+        self._idle = dict()
 
         if window_size < 0:
             coeff = 64
@@ -302,10 +1050,12 @@ class StaticWindowMapManager(object):
 
     #{ Internal Methods
 
-    def _collect_lru_region(self, size):
+    def _collect_lru_region(self, size, bounded=False):
         """Unmap the region which was least-recently used and has no client
         :param size: size of the region we want to map next (assuming its not already mapped partially or full
             if 0, we try to free any available region
+        :param bounded: if True, stop once our collection budget is exhausted, even if this means
+            over-allocating until the next collection
         :return: Amount of freed regions
 
         .. Note::
@@ -316,15 +1066,47 @@ class StaticWindowMapManager(object):
             implement a case where all unusued regions are discarded efficiently.
             Currently its only brute force
         """
+        histograms = self._histograms
+        if histograms is not None:
+            st = clock()
+        # END measure latency
         num_found = 0
-        while (size == 0) or (self._memory_size + size > self._max_memory_size):
+        max_found = sys.maxsize
+        deadline = None
+        if bounded:
+            if self._collect_budget is not None:
+                max_found = self._collect_budget
+            # END handle count budget
+            if self._collect_time_budget is not None:
+                deadline = clock() + self._collect_time_budget
+            # END handle time budget
+        # END handle budget
+        resident = None
+        if self._residency_interval is not None:
+            # region -> resident bytes, sampled at most once per collection
+            resident = dict()
+        # END handle residency
+        while (size == 0) or (self._used_memory_size() + size > self._max_memory_size):
+            # always free at least one region to make progress
+            if num_found and (num_found >= max_found or (deadline is not None and clock() >= deadline)):
+                break
+            # END handle exhausted budget
             lru_region = None
             lru_list = None
             for regions in self._fdict.values():
                 for region in regions:
                     # check client count - if it's 1, it's just us
-                    if (region.client_count() == 1 and
-                            (lru_region is None or region._uc < lru_region._uc)):
+                    if region.client_count() != 1 or self._is_pinned(regions, region):
+                        continue
+                    if resident is not None:
+                        # prefer the regions which actually free most memory
+                        if region not in resident:
+                            resident[region] = region.resident_size()
+                        if lru_region is None or resident[region] > resident[lru_region]:
+                            lru_region = region
+                            lru_list = regions
+                        # END update lru_region
+                    elif lru_region is None or region._uc < lru_region._uc:
                         lru_region = region
                         lru_list = regions
                     # END update lru_region
@@ -332,24 +1114,96 @@ class StaticWindowMapManager(object):
             # END for each regions list
 
             if lru_region is None:
+                if size and self._blocks:
+                    # cached blocks share our budget, and go once no idle region is left
+                    self._evict_block()
+                    continue
+                # END handle blocks
                 break
             # END handle region not found
 
             num_found += 1
-            del(lru_list[lru_list.index(lru_region)])
-            lru_region.increment_client_count(-1)
-            self._memory_size -= lru_region.size()
-            self._handle_count -= 1
+            if resident is not None and self._resident_size is not None:
+                self._resident_size -= resident[lru_region]
+            # END adjust resident size
+            self._unmap_region(lru_list, lru_region)
         # END while there is more memory to free
+        if histograms is not None:
+            histograms['collect'].record(clock() - st)
+        # END record latency
         return num_found
 
+    @staticmethod
+    def _is_pinned(a, region):
+        """:return: True if region of region list a holds private modifications, which would be lost if it was
+            unmapped. Such regions are only unmapped once their file is, and stay counted in our memory usage"""
+        return a._access == ACCESS_COPY and region._dirty is not None
+
+    def _unmap_region(self, a, region):
+        """Remove the given region from the region list a, and release our reference to it.
+        It is unmapped right away, unless a cursor still uses it"""
+        a.remove(region)
+        region.increment_client_count(-1)
+        self._memory_size -= region.size()
+        self._handle_count -= 1
+
+    def _invalidate_region_list(self, a):
+        """Mark all regions of the region list a stale and unmap them, and make it forget the file's size
+        and identity, which are obtained from disk again on the next access.
+        :return: amount of unmapped regions"""
+        num_regions = len(a)
+        self._unindex_region_list(a)
+        for region in list(a):
+            region._stale = True
+            self._unmap_region(a, region)
+        # END for each region
+        a.reset()
+        if num_regions:
+            self._resident_size = None
+        # END resample residency
+        return num_regions
+
+    def _validate_region_list(self, a):
+        """Invalidate the region list a if its file changed on disk since it was last checked, which
+        happens at most every validate_interval seconds
+        :return: True if the region list was invalidated"""
+        now = time.time()
+        if now - a._checked < self._validate_interval:
+            return False
+        # END handle interval
+        a._checked = now
+        if not a.is_stale():
+            return False
+        # END handle unchanged file
+        self._invalidate_region_list(a)
+        self._index_region_list(a)
+        return True
+
+    def _used_memory_size(self):
+        """:return: amount of memory counted against our max_memory_size. It is the mapped memory size,
+            or the sampled resident size if residency is taken into account, plus the size of all cached blocks"""
+        if self._residency_interval is None:
+            return self._memory_size + self._block_memory_size
+        # END handle virtual memory accounting
+        now = time.time()
+        if self._resident_size is None or now - self._resident_time >= self._residency_interval:
+            self._resident_size = self.resident_memory_size()
+            self._resident_time = now
+        # END sample resident size
+        return self._resident_size + self._block_memory_size
+
+    def _evict_block(self):
+        """Drop the least recently used block from our block cache"""
+        _, block = self._blocks.popitem(last=False)
+        self._block_memory_size -= len(block)
+
     def _obtain_region(self, a, offset, size, flags, is_recursive):
         """Utilty to create a new region - for more information on the parameters,
         see MapCursor.use_region.
         :param a: A regions (a)rray
         :return: The newly created region"""
-        if self._memory_size + size > self._max_memory_size:
-            self._collect_lru_region(size)
+        if self._memory_size + self._block_memory_size + size > self._max_memory_size:
+            self._collect_lru_region(size, True)
         # END handle collection
 
         r = None
@@ -358,7 +1212,7 @@ class StaticWindowMapManager(object):
             r = a[0]
         else:
             try:
-                r = self.MapRegionCls(a.path_or_fd(), 0, sys.maxsize, flags)
+                r = self._make_region(a, 0, sys.maxsize, flags)
             except Exception:
                 # apparently we are out of system resources or hit a limit
                 # As many more operations are likely to fail in that condition (
@@ -369,11 +1223,12 @@ class StaticWindowMapManager(object):
                     # a mapping. This is an exception, so we propagate it
                     raise
                 # END handle existing recursion
-                self._collect_lru_region(0)
+                self._collect_lru_region(0, True)
                 return self._obtain_region(a, offset, size, flags, True)
             # END handle exceptions
 
             self._handle_count += 1
+            self._num_maps += 1
             self._memory_size += r.size()
             a.append(r)
         # END handle array
@@ -381,13 +1236,340 @@ class StaticWindowMapManager(object):
         assert r.includes_ofs(offset)
         return r
 
+    def _make_region(self, a, offset, size, flags):
+        """:return: a new region of the file of region list a, see MapRegion for the parameters"""
+        populate = self._populate_size and min(size, a.file_size() - offset) <= self._populate_size
+        histograms = self._histograms
+        cls = a._backend == 'pread' and self.PreadRegionCls or self.MapRegionCls
+        if histograms is None and not populate:
+            return cls(self._map_key(a), offset, size, flags, a._access)
+        # END fast path
+
+        st = histograms is not None and clock()
+        key = self._map_key(a)
+        r = cls(key, offset, size, flags, a._access, populate and not self._prefault_threaded)
+        if histograms is not None:
+            histograms['map_region'].record(clock() - st)
+            if r.size():
+                # sample the cost of faulting in a page
+                st = clock()
+                r.map()[0]
+                histograms['first_touch'].record(clock() - st)
+            # END handle empty regions
+        # END record latency
+        if populate and self._prefault_threaded:
+            self._prefault(r, key if a._backend != 'pread' else None)
+        # END prefault in background
+        return r
+
+    def _prefault(self, region, path_or_fd):
+        """Fault in all pages of the given region on our prefault thread, which is started if needed
+        :param path_or_fd: the file of the region, which is read into the page cache first so that the thread
+            doesn't hold the GIL while waiting for the disk, or None to only touch the pages"""
+        if self._prefault_queue is None:
+            self._prefault_queue = Queue()
+            thread = threading.Thread(target=self._prefault_loop, name="smmap-prefault",
+                                      args=(self._prefault_queue, self._warm_chunk_size))
+            thread.daemon = True
+            thread.start()
+        # END start thread
+        fd = None
+        try:
+            # a descriptor of our own can't be closed or reused while the thread reads it
+            if isinstance(path_or_fd, int):
+                fd = os.dup(path_or_fd)
+            elif path_or_fd is not None:
+                fd = os.open(path_or_fd, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            # END handle file type
+        except OSError:
+            pass
+        # END ignore inaccessible files, touching the pages still works
+        self._prefault_queue.put((region, fd))
+
+    @staticmethod
+    def _prefault_loop(queue, chunk_size):
+        """Body of the prefault thread"""
+        scratch = bytearray(chunk_size)
+        while True:
+            region, fd = queue.get()
+            try:
+                if fd is not None:
+                    read_pages(fd, region.ofs_begin(), region.size(), scratch)
+                # END read into the page cache
+                touch_pages(region.map(), 0, region.size())
+            except (OSError, ValueError):
+                # the file couldn't be read, or the region was unmapped in the meanwhile
+                pass
+            finally:
+                if fd is not None:
+                    os.close(fd)
+                # END close our descriptor
+            # END handle errors
+            del(region)
+            queue.task_done()
+        # END for each region
+
+    @staticmethod
+    def _file_key(a):
+        """:return: tuple of (st_dev, st_ino) identifying the file of region list a independently of the
+            path or file descriptor used to reach it, or None if it is unknown"""
+        try:
+            identity = a.identity()
+        except OSError:
+            return None
+        # END handle inaccessible files
+        if not identity or not identity[1]:
+            # some systems don't provide inode numbers
+            return None
+        # END handle unknown identity
+        return identity[:2]
+
+    def _map_key(self, a):
+        """:return: the path or file descriptor to map or modify the file of region list a through.
+            Lists are keyed by a path whenever one is known. Descriptors are checked to still refer to the file,
+            as their number may have been closed and reused for another file in the meanwhile. Paths of files
+            which are known by descriptors as well are checked to still refer to the file, as it may have been
+            replaced, in which case a descriptor is used instead
+        :raise OSError: if the file is only known by a descriptor which doesn't refer to it anymore"""
+        path_or_fd = a._path_or_fd
+        if not isinstance(path_or_fd, int):
+            fds = [p for p in a._aliases if isinstance(p, int)]
+            key = fds and self._file_key(a)
+            if key:
+                try:
+                    st = os.stat(path_or_fd)
+                    replaced = (st.st_dev, st.st_ino) != key
+                except OSError:
+                    replaced = True
+                # END handle removed files
+                for fd in replaced and fds or ():
+                    try:
+                        st = os.fstat(fd)
+                    except OSError:
+                        continue
+                    # END skip closed descriptors
+                    if (st.st_dev, st.st_ino) == key:
+                        return fd
+                    # END handle descriptor of our file
+                # END for each descriptor
+            # END check path of files known by descriptors
+            return path_or_fd
+        # END handle paths
+        key = self._file_key(a)
+        if key is not None:
+            st = os.fstat(path_or_fd)
+            if (st.st_dev, st.st_ino) != key:
+                raise OSError(errno.EBADF, "File descriptor %i doesn't refer to the mapped file anymore" % path_or_fd)
+            # END handle reused descriptor
+        # END check descriptor
+        return path_or_fd
+
+    def _rekey_region_list(self, a, path_or_fd):
+        """Make the alias path_or_fd the key of region list a, and its previous key an alias"""
+        a._aliases.remove(path_or_fd)
+        del(self._aliases[path_or_fd])
+        if self._fdict.get(a._path_or_fd) is a:
+            del(self._fdict[a._path_or_fd])
+        # END remove previous key
+        a._aliases.append(a._path_or_fd)
+        self._aliases[a._path_or_fd] = a
+        a._path_or_fd = path_or_fd
+        self._fdict[path_or_fd] = a
+
+    def _lookup_region_list(self, path_or_fd):
+        """:return: the existing region list for the given path or file descriptor, or None"""
+        regions = self._fdict.get(path_or_fd)
+        if regions is None:
+            regions = self._aliases.get(path_or_fd)
+        # END handle alias
+        return regions
+
+    def _region_list(self, path_or_fd):
+        """:return: the region list for the given path or file descriptor, which is created if needed.
+            All paths and file descriptors of the same file share one region list"""
+        regions = self._lookup_region_list(path_or_fd)
+        if regions is not None and isinstance(path_or_fd, int) and regions._identity is not None:
+            # descriptors may have been closed and their number reused for another file
+            st = os.fstat(path_or_fd)
+            if (st.st_dev, st.st_ino) != regions._identity[:2]:
+                self._forget_key(regions, path_or_fd)
+                regions = None
+            # END handle reused descriptor
+        # END check descriptor
+
+        if regions is None:
+            regions = self.MapRegionListCls(path_or_fd)
+            key = self._file_key(regions)
+            shared = self._idict.get(key) if key is not None else None
+            if shared is not None and self._file_key(shared) == key:
+                shared._aliases.append(path_or_fd)
+                self._aliases[path_or_fd] = shared
+                regions = shared
+                if isinstance(shared._path_or_fd, int) and not isinstance(path_or_fd, int):
+                    # descriptors may be closed by their owner, paths stay valid
+                    self._rekey_region_list(shared, path_or_fd)
+                # END prefer paths
+            else:
+                self._fdict[path_or_fd] = regions
+                if key is not None:
+                    self._idict[key] = regions
+                # END index file
+            # END handle known file
+        elif self._validate_interval is not None:
+            self._validate_region_list(regions)
+        # END obtain region for path
+        return regions
+
+    def _set_access(self, a, access):
+        """Assure region list a maps its file with at least the given mmap access mode.
+        Writable files may be read, and read-only files are remapped writable once written. Copy-on-write
+        maps can't be shared with cursors of other modes, as they would see private modifications, or
+        write to private maps
+        :raise ValueError: if live cursors use the file in an incompatible mode"""
+        if access == a._access or (access == ACCESS_READ and a._access == ACCESS_WRITE):
+            return
+        # END handle compatible modes
+        if a._num_cursors and (access == ACCESS_COPY or a._access == ACCESS_COPY):
+            raise ValueError("%r is used by cursors with another access mode already" % (a.path_or_fd(), ))
+        # END handle incompatible modes
+        if len(a):
+            # the read-only regions are replaced by writable ones once their clients are done with them
+            self._invalidate_region_list(a)
+            self._index_region_list(a)
+        # END handle read-only regions
+        a._access = access
+
+    def _make_own_cursor(self, path_or_fd):
+        """:return: a cursor for accesses of our own to the given file. It uses the access mode of the file's
+            existing cursors, so that it never conflicts with them"""
+        with self._lock:
+            access = self._region_list(path_or_fd)._access
+            name = [n for n, mode in _access_modes.items() if mode == access][0]
+            return self.make_cursor(path_or_fd, access=name)
+        # END with lock
+
+    def _attach_cursor(self, cursor, lists):
+        """Count cursor as live cursor of all given region lists, until it is destroyed"""
+        for a in lists:
+            a._num_cursors += 1
+        # END for each list
+        cursor._attached = tuple(lists)
+
+    def _detach_cursor(self, lists):
+        """Stop counting a cursor as live cursor of the given region lists. Private modifications of copy-on-write
+        files are unmapped once their last cursor is gone, as nobody may access them anymore"""
+        for a in lists:
+            a._num_cursors -= 1
+            if not a._num_cursors and a._access == ACCESS_COPY and len(a):
+                self._invalidate_region_list(a)
+                self._index_region_list(a)
+            # END release private modifications
+        # END for each list
+
+    def _set_backend(self, a, backend):
+        """Assure region list a uses the given backend to create its regions. Existing regions of another backend
+        are replaced once their clients are done with them
+        :param backend: name of the backend, or None to keep the current one. Files which didn't choose one yet
+            use our default backend"""
+        if backend is None:
+            if a._backend is None:
+                a._backend = self._backend
+            # END handle new file
+            return
+        # END handle no preference
+        if backend != a._backend and len(a):
+            self._invalidate_region_list(a)
+            self._index_region_list(a)
+        # END replace regions
+        a._backend = backend
+
+    def _grow_region_list(self, a, size):
+        """Grow the file of region list a to the given size. Regions which were truncated by the end of the file
+        are replaced once their clients are done with them, all others stay valid"""
+        old_size = a.file_size()
+        with file_descriptor(self._map_key(a), os.O_RDWR) as fd:
+            os.ftruncate(fd, size)
+        # END with file
+        for region in list(a):
+            if region.ofs_end() >= old_size:
+                region._stale = True
+                self._unmap_region(a, region)
+            # END handle truncated region
+        # END for each region
+        a._file_size = None
+        a._identity = None
+        self._resident_size = None
+
+    def _forget_key(self, a, path_or_fd):
+        """Stop resolving the given path or file descriptor to region list a. If a was keyed by it, one of its
+        aliases takes over, or a is invalidated and dropped if there is none"""
+        if path_or_fd in a._aliases:
+            a._aliases.remove(path_or_fd)
+            if self._aliases.get(path_or_fd) is a:
+                del(self._aliases[path_or_fd])
+            # END remove alias
+            return
+        # END handle alias
+        if self._fdict.get(path_or_fd) is a:
+            del(self._fdict[path_or_fd])
+        # END remove key
+        if a._aliases:
+            paths = [p for p in a._aliases if not isinstance(p, int)]
+            a._path_or_fd = (paths or a._aliases)[0]
+            a._aliases.remove(a._path_or_fd)
+            del(self._aliases[a._path_or_fd])
+            self._fdict[a._path_or_fd] = a
+        else:
+            self._invalidate_region_list(a)
+            self._drop_region_list(a)
+        # END handle remaining aliases
+
+    def _drop_region_list(self, a):
+        """Remove region list a and all its aliases from our indices"""
+        for path_or_fd in a._aliases:
+            if self._aliases.get(path_or_fd) is a:
+                del(self._aliases[path_or_fd])
+            # END remove alias
+        # END for each alias
+        if self._fdict.get(a._path_or_fd) is a:
+            del(self._fdict[a._path_or_fd])
+        # END remove list
+        self._unindex_region_list(a)
+
+    def _index_region_list(self, a):
+        """Add region list a to the index of file identities, unless another list represents its file already"""
+        key = self._file_key(a)
+        if key is not None and key not in self._idict:
+            self._idict[key] = a
+        # END index file
+
+    def _unindex_region_list(self, a):
+        """Remove region list a from the index of file identities"""
+        key = a._identity and a._identity[:2]
+        if key and self._idict.get(key) is a:
+            del(self._idict[key])
+        # END remove index
+
     #}END internal methods
 
     #{ Interface
-    def make_cursor(self, path_or_fd):
+    def make_cursor(self, path_or_fd, num_windows=1, access='read', backend=None):
         """
         :return: a cursor pointing to the given path or file descriptor.
-            It can be used to map new regions of the file into memory
+            It can be used to map new regions of the file into memory.
+            If a list or tuple of paths or file descriptors is given, a ConcatWindowCursor into the
+            concatenation of all these files is returned.
+        :param num_windows: if larger than 1, a MultiWindowCursor is returned which keeps up to this
+            amount of windows active at once
+        :param access: 'read' to map the file read-only, 'write' to map it writable, so that modifications
+            done through WindowCursor.write_at() end up in the file, or 'copy' to map it copy-on-write,
+            keeping modifications private to this process. All cursors of a file share its mode, see
+            StaticWindowMapManager._set_access()
+        :param backend: 'mmap' to map the file, or 'pread' to read windows into anonymous memory instead, see
+            PreadRegion. If None, the file keeps its current backend, or uses the default set by set_backend().
+            All cursors of a file share its backend
+        :raise ValueError: if multiple windows or another access mode than 'read' are requested for concatenated
+            files, if the file is mapped in an incompatible access mode already, or if the backend is unknown
 
         **Note:** if a file descriptor is given, it is assumed to be open and valid,
         but may be closed afterwards. To refer to the same file, you may reuse
@@ -400,17 +1582,508 @@ class StaticWindowMapManager(object):
 
         **Note:** Using file descriptors directly is faster once new windows are mapped as it
         prevents the file to be opened again just for the purpose of mapping it."""
-        regions = self._fdict.get(path_or_fd)
-        if regions is None:
-            regions = self.MapRegionListCls(path_or_fd)
-            self._fdict[path_or_fd] = regions
-        # END obtain region for path
-        return self.WindowCursorCls(self, regions)
+        if backend is not None and backend not in _backends:
+            raise ValueError("Invalid backend: %r" % backend)
+        # END check backend
+        with self._lock:
+            if isinstance(path_or_fd, (list, tuple)):
+                if num_windows > 1 or access != 'read':
+                    raise ValueError("Concatenated files support only a single read-only window")
+                # END handle multiple windows
+                lists = [self._region_list(p) for p in path_or_fd]
+                for regions in lists:
+                    self._set_access(regions, ACCESS_READ)
+                    self._set_backend(regions, backend)
+                # END for each file
+                cursor = self.ConcatWindowCursorCls(self, lists, tuple(path_or_fd))
+                self._attach_cursor(cursor, lists)
+                return cursor
+            # END handle concatenated files
+            if access not in _access_modes:
+                raise ValueError("Invalid access mode: %r" % access)
+            # END check access
+            regions = self._region_list(path_or_fd)
+            self._set_access(regions, _access_modes[access])
+            self._set_backend(regions, backend)
+            if num_windows > 1:
+                cursor = self.MultiWindowCursorCls(self, regions, path_or_fd, num_windows)
+            else:
+                cursor = self.WindowCursorCls(self, regions, path_or_fd)
+            # END handle multiple windows
+            self._attach_cursor(cursor, (regions, ))
+            return cursor
+        # END with lock
 
     def collect(self):
         """Collect all available free-to-collect mapped regions
         :return: Amount of freed handles"""
-        return self._collect_lru_region(0)
+        with self._lock:
+            return self._collect_lru_region(0)
+        # END with lock
+
+    def flush(self, path_or_fd=None):
+        """Write modified bytes of files mapped for writing back to disk, using one msync call per modified region.
+        Regions are flushed automatically before they are unmapped.
+        :param path_or_fd: if not None, only the regions of this file are flushed
+        :return: amount of flushed regions"""
+        num_flushed = 0
+        with self._lock:
+            if path_or_fd is None:
+                rlists = list(self._fdict.values())
+            else:
+                rlists = [self._lookup_region_list(path_or_fd) or ()]
+            # END handle path
+            for regions in rlists:
+                if regions and regions._access == ACCESS_COPY:
+                    continue
+                # END skip private modifications
+                for region in regions:
+                    if region.is_dirty():
+                        region.flush()
+                        num_flushed += 1
+                    # END handle dirty region
+                # END for each region
+            # END for each regions list
+        # END with lock
+        return num_flushed
+
+    def reap(self, ttl, idle_memory_size=None):
+        """Unmap regions without clients which were not used for at least ttl seconds, and if idle_memory_size
+        is not None, unmap the longest idle regions until at most idle_memory_size bytes remain in use.
+        Cached blocks, see get_or_compute(), are not counted here, as they can't be reaped.
+        Regions are unmapped the same way if we exceed max_memory_size, as it happens if new mappings
+        deferred collections due to their collect_budget.
+        This is what the reaper thread started by start_reaper() does periodically.
+
+        **Note:** regions are only known to be idle once a reap() call saw them without clients, which is why
+        they are unmapped up to one reaping interval after their ttl expired. Regions used in between are
+        recognized by their hit count, and are considered idle from the next call on.
+        :return: amount of unmapped regions"""
+        now = time.time()
+        num_found = 0
+        target = self._max_memory_size
+        if idle_memory_size is not None:
+            target = min(target, idle_memory_size)
+        # END handle idle target
+        with self._lock:
+            prev = self._idle
+            idle = dict()
+            for regions in self._fdict.values():
+                for region in regions:
+                    if region.client_count() != 1 or self._is_pinned(regions, region):
+                        continue
+                    # END skip regions in use
+                    hit_count, since = prev.get(region, (None, now))
+                    if hit_count != region._hc:
+                        since = now
+                    # END handle regions used in the meanwhile
+                    idle[region] = (region._hc, since)
+                # END for each region
+            # END for each regions list
+
+            # unmap the longest idle regions first
+            for since, region, regions in sorted(((idle[r][1], r, regions) for regions in self._fdict.values()
+                                                  for r in regions if r in idle), key=lambda t: t[0]):
+                # cached blocks can't be reaped, so they don't count towards the target
+                if now - since < ttl and self._used_memory_size() - self._block_memory_size <= target:
+                    break
+                # END handle done
+                del(idle[region])
+                if self._residency_interval is not None and self._resident_size is not None:
+                    # keep our target reachable until the resident size is sampled again
+                    self._resident_size -= region.resident_size()
+                # END adjust resident size
+                self._unmap_region(regions, region)
+                num_found += 1
+            # END for each idle region
+            self._idle = idle
+            if num_found:
+                self._resident_size = None
+            # END resample residency
+        # END with lock
+        return num_found
+
+    def start_reaper(self, ttl, idle_memory_size=None, interval=None):
+        """Start a daemon thread which periodically unmaps idle regions in the background, see reap().
+        This releases address space and page tables of bursts of accesses long before our memory limit
+        forces us to, and keeps this work off the path of use_region().
+        :param ttl: seconds after which regions without clients are unmapped
+        :param idle_memory_size: if not None, amount of mapped bytes to shrink to if regions are idle,
+            regardless of their ttl
+        :param interval: seconds between two reaping passes. If None, it is half the ttl
+        :raise ValueError: if the reaper is already running"""
+        if self._reaper is not None:
+            raise ValueError("Reaper is already running")
+        # END handle running reaper
+        if interval is None:
+            interval = ttl / 2.0
+        # END handle interval
+        stop = threading.Event()
+        thread = threading.Thread(target=self._reaper_loop, name="smmap-reaper",
+                                  args=(weakref.ref(self), stop, max(interval, 0.001), ttl, idle_memory_size))
+        thread.daemon = True
+        self._reaper = (thread, stop)
+        thread.start()
+
+    def stop_reaper(self):
+        """Stop the reaper thread started by start_reaper() and wait for it to finish.
+        Does nothing if it is not running"""
+        if self._reaper is None:
+            return
+        # END handle no reaper
+        thread, stop = self._reaper
+        self._reaper = None
+        stop.set()
+        thread.join()
+
+    @staticmethod
+    def _reaper_loop(manager_ref, stop, interval, ttl, idle_memory_size):
+        """Body of the reaper thread. It only keeps a weak reference to the manager, and ends with it"""
+        while not stop.wait(interval):
+            man = manager_ref()
+            if man is None:
+                break
+            # END handle deleted manager
+            man.reap(ttl, idle_memory_size)
+            del(man)
+        # END while not stopped
+
+    def warm(self, items, mode='fadvise', progress=None, num_threads=4):
+        """Bring the given files or file ranges into the page cache before they are used, for instance
+        right after startup, so that the first accesses don't have to wait for the disk.
+
+        :param items: iterable of paths or file descriptors, which are warmed entirely, or of
+            (path_or_fd, offset, size) tuples. A size of 0 warms everything up to the end of the file.
+        :param mode: one of
+
+            * 'fadvise' - hint the kernel using posix_fadvise(POSIX_FADV_WILLNEED). Nothing gets mapped.
+            * 'madvise' - hint the kernel using MADV_WILLNEED, on regions which are already mapped only
+            * 'touch' - map the ranges, and let num_threads threads read them into the page cache using pread,
+              which doesn't hold the GIL while waiting for the disk, before touching one byte per page.
+              The regions stay mapped afterwards, but are subject to collection like any other unused region.
+
+        :param progress: if not None, a callable(bytes_done, bytes_total) called whenever a range was warmed
+        :param num_threads: amount of threads touching pages, only used in 'touch' mode
+        :return: amount of bytes which were hinted or made resident. It never exceeds the
+            max_mapped_memory_size(), as everything beyond that would be evicted again anyway.
+        :raise ValueError: if the mode is unknown"""
+        if mode not in ('fadvise', 'madvise', 'touch'):
+            raise ValueError("Unknown warm-up mode: %r" % mode)
+        # END check mode
+
+        # normalize items into (path_or_fd, offset, size) ranges, clamped to the file and our budget
+        budget = self._max_memory_size
+        ranges = list()
+        for item in items:
+            if isinstance(item, tuple):
+                path_or_fd, offset, size = item
+            else:
+                path_or_fd, offset, size = item, 0, 0
+            # END handle item type
+            fsize = self._make_own_cursor(path_or_fd).file_size()
+            size = min(size or fsize, fsize - offset, budget)
+            if size <= 0:
+                continue
+            # END skip empty ranges
+            budget -= size
+            ranges.append((path_or_fd, offset, size))
+            if not budget:
+                break
+            # END stop once our memory is exhausted
+        # END for each item
+
+        total = sum(r[2] for r in ranges)
+        done = [0]
+
+        def report(nbytes):
+            done[0] += nbytes
+            if progress is not None:
+                progress(done[0], total)
+            # END call progress
+        # END utility
+
+        if mode == 'fadvise':
+            for path_or_fd, offset, size in ranges:
+                with file_descriptor(path_or_fd) as fd:
+                    if advise_file(fd, offset, size, 'WILLNEED'):
+                        report(size)
+                    # END handle unsupported system
+                # END handle file
+            # END for each range
+            return done[0]
+        # END fadvise mode
+
+        if mode == 'madvise':
+            for path_or_fd, offset, size in ranges:
+                nbytes = 0
+                for region in self._lookup_region_list(path_or_fd) or ():
+                    begin = max(offset, region.ofs_begin())
+                    end = min(offset + size, region.ofs_end())
+                    if begin < end and advise_map(region.map(), begin - region.ofs_begin(), end - begin, 'WILLNEED'):
+                        nbytes += end - begin
+                    # END handle overlap
+                # END for each mapped region
+                report(nbytes)
+            # END for each range
+            return done[0]
+        # END madvise mode
+
+        # touch mode: map all windows in this thread as we are not thread-safe, pin them, and let the
+        # workers fault in the pages
+        jobs = list()
+        pinned = list()
+        opened = list()
+        try:
+            for path_or_fd, offset, size in ranges:
+                c = self._make_own_cursor(path_or_fd)
+                fd = path_or_fd
+                if not isinstance(fd, int):
+                    fd = os.open(path_or_fd, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                    opened.append(fd)
+                # END open file for reading
+                end = offset + size
+                while offset < end:
+                    if not c.use_region(offset, end - offset).is_valid():
+                        break
+                    # END handle end of file
+                    region = c.region()
+                    region.increment_client_count()
+                    pinned.append(region)
+                    cend = c.ofs_end()
+                    while offset < cend:
+                        csize = min(self._warm_chunk_size, cend - offset)
+                        jobs.append((region, fd, offset - region.ofs_begin(), csize))
+                        offset += csize
+                    # END for each chunk
+                # END for each window
+                c._destroy()
+            # END for each range
+
+            lock = threading.Lock()
+            jobs.reverse()
+
+            def touch():
+                scratch = bytearray(self._warm_chunk_size)
+                while True:
+                    with lock:
+                        if not jobs:
+                            return
+                        region, fd, offset, size = jobs.pop()
+                    # END pick a job
+                    if not isinstance(region, self.PreadRegionCls):
+                        read_pages(fd, region.ofs_begin() + offset, size, scratch)
+                    # END read into the page cache
+                    touch_pages(region.map(), offset, size)
+                    with lock:
+                        report(size)
+                # END while there is work
+            # END worker
+
+            threads = [threading.Thread(target=touch) for _ in range(max(1, num_threads))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # END run workers
+        finally:
+            for region in pinned:
+                region.increment_client_count(-1)
+            for fd in opened:
+                os.close(fd)
+        # END unpin regions and close files
+        return done[0]
+
+    def save_profile(self, path):
+        """Write all currently mapped regions of files opened by path, along with their hit counts, to a file
+        at the given path. It can be used to restore our working set later using load_profile()
+
+        **Note:** regions of files which were only mapped through file descriptors are not saved"""
+        entries = list()
+        for path_or_fd, regions in self._fdict.items():
+            paths = [p for p in [path_or_fd] + regions.aliases() if isinstance(p, string_types())]
+            if not paths or not regions:
+                continue
+            # END skip file descriptors
+            st = os.stat(paths[0])
+            for region in regions:
+                entries.append(dict(path=paths[0], offset=region.ofs_begin(), size=region.size(),
+                                    hits=region.hit_count(), file_size=st.st_size, mtime=st.st_mtime))
+            # END for each region
+        # END for each file
+        entries.sort(key=lambda e: e['hits'], reverse=True)
+        with open(path, 'w') as fp:
+            json.dump(dict(version=1, regions=entries), fp)
+        # END write profile
+
+    def load_profile(self, path, prefault=False):
+        """Map the regions of a profile previously written by save_profile(), hottest regions first, until
+        our memory budget is reached. Regions of files which changed in size or modification time since
+        the profile was written, or which don't exist anymore, are skipped.
+        Restored regions are not used by any cursor, and are subject to collection like any other region.
+
+        :param path: path to the profile file
+        :param prefault: if True, a daemon thread will read the restored regions into the page cache and
+            touch all of their pages in the background to fault them in
+        :return: amount of restored regions"""
+        with open(path) as fp:
+            entries = json.load(fp)['regions']
+        # END read profile
+
+        restored = list()
+        stats = dict()
+        for entry in entries:
+            fpath = entry['path']
+            if fpath not in stats:
+                try:
+                    st = os.stat(fpath)
+                    stats[fpath] = st.st_size == entry['file_size'] and st.st_mtime == entry['mtime']
+                except OSError:
+                    stats[fpath] = False
+                # END handle missing files
+            # END cache file validity
+            if not stats[fpath]:
+                continue
+            # END skip changed files
+            if self._memory_size + self._block_memory_size + entry['size'] > self._max_memory_size:
+                break
+            # END handle budget
+
+            c = self._make_own_cursor(fpath)
+            if c.use_region(entry['offset'], entry['size']).is_valid():
+                region = c.region()
+                region._hc += entry['hits']
+                restored.append((region, fpath))
+            # END handle region
+            c._destroy()
+        # END for each entry
+
+        if prefault and restored:
+            chunk_size = self._warm_chunk_size
+
+            def touch():
+                scratch = bytearray(chunk_size)
+                for region, fpath in restored:
+                    try:
+                        with file_descriptor(fpath) as fd:
+                            for ofs in range(0, region.size(), chunk_size):
+                                if not isinstance(region, self.PreadRegionCls):
+                                    read_pages(fd, region.ofs_begin() + ofs, min(chunk_size, region.size() - ofs),
+                                               scratch)
+                                # END read into the page cache
+                                touch_pages(region.map(), ofs, chunk_size)
+                            # END for each chunk
+                        # END handle file
+                    except (OSError, ValueError):
+                        # the file is gone, or the region was collected in the meanwhile
+                        pass
+                    # END handle closed maps
+                # END for each region
+            # END touch utility
+
+            t = threading.Thread(target=touch)
+            t.daemon = True
+            t.start()
+        # END prefault regions
+        return len(restored)
+
+    def set_tracer(self, tracer):
+        """Record all accesses of our cursors' use_region() calls with the given tracer, see smmap.trace
+        :param tracer: an AccessTracer, or None to stop tracing
+        :return: the previously set tracer, or None"""
+        prev = self._tracer
+        self._tracer = tracer
+        return prev
+
+    def get_or_compute(self, path_or_fd, offset, compute, kind=None):
+        """Obtain a block of data derived from the given file at the given offset, like the inflated contents of
+        a zlib stream starting there, from our block cache. If it isn't cached, it is computed and cached.
+
+        Blocks share max_memory_size with our mapped regions. To make room for a new block or region, idle
+        regions are unmapped first, then the least recently used blocks are dropped.
+
+        Blocks are keyed by the identity of the file, that is its device, inode, size and modification time.
+        Files without cursors are queried on each call. Files with cursors use the identity their cursors see,
+        which is only checked for changes on disk if validate_interval is set. Without it, rewritten files keep
+        handing out blocks derived from their old contents, just like their windows keep showing them.
+        :param path_or_fd: path or file descriptor of the file the block is derived from
+        :param offset: offset in the file the block is derived from
+        :param compute: callable without arguments returning the block as bytes-like object. It is called
+            without holding our lock, and must not modify the block afterwards
+        :param kind: any hashable to tell apart different kinds of blocks derived from the same offset
+        :return: the cached or computed block. Blocks larger than max_memory_size are not cached"""
+        with self._lock:
+            a = self._lookup_region_list(path_or_fd)
+            if a is None:
+                # don't track the file just for this, but query its identity
+                a = self.MapRegionListCls(path_or_fd)
+            elif self._validate_interval is not None:
+                self._validate_region_list(a)
+            # END handle unknown file
+            key = (a.identity(), offset, kind)
+            block = self._blocks.pop(key, None)
+            if block is not None:
+                self._blocks[key] = block
+                return block
+            # END handle hit
+        # END with lock
+
+        block = compute()
+        size = len(block)
+        with self._lock:
+            if key not in self._blocks and size <= self._max_memory_size:
+                if self._used_memory_size() + size > self._max_memory_size:
+                    self._collect_lru_region(size, True)
+                # END make room
+                self._blocks[key] = block
+                self._block_memory_size += size
+            # END cache block
+        # END with lock
+        return block
+
+    def set_backend(self, backend):
+        """Set the backend used for files which don't choose one when their first cursor is made, see make_cursor()
+        :param backend: 'mmap' or 'pread'
+        :return: the previous default backend
+        :raise ValueError: if the backend is unknown"""
+        if backend not in _backends:
+            raise ValueError("Invalid backend: %r" % backend)
+        # END check backend
+        prev = self._backend
+        self._backend = backend
+        return prev
+
+    def enable_histograms(self, enable=True):
+        """Enable or disable recording latency histograms of
+
+        * 'use_region_hit' - WindowCursor.use_region() calls which didn't need to map a new region
+        * 'use_region_miss' - WindowCursor.use_region() calls which mapped a new region
+        * 'map_region' - opening, mapping and closing a file to create a region
+        * 'collect' - collecting unused regions
+        * 'first_touch' - the first access to a newly mapped region, which includes a page fault
+
+        Recording is cheap, but reading the first byte of each new region causes a page fault which
+        wouldn't necessarily happen otherwise.
+        Enabling histograms if they are enabled already keeps all values recorded so far."""
+        if not enable:
+            self._histograms = None
+        elif self._histograms is None:
+            self._histograms = dict((name, LatencyHistogram()) for name in
+                                    ('use_region_hit', 'use_region_miss', 'map_region', 'collect', 'first_touch'))
+        # END handle enable
+
+    def histograms(self):
+        """:return: dict mapping names to LatencyHistogram instances, see enable_histograms(). It is
+            empty if histograms are disabled"""
+        return dict(self._histograms or ())
+
+    def latency_percentiles(self, ps=(50, 90, 99, 99.9)):
+        """:return: dict mapping histogram names to a dict of percentiles of their durations in seconds,
+            see enable_histograms() and LatencyHistogram.percentiles()"""
+        return dict((name, h.percentiles(ps)) for name, h in self.histograms().items())
+
+    def num_maps(self):
+        """:return: total amount of regions we mapped since we were created"""
+        return self._num_maps
 
     def num_file_handles(self):
         """:return: amount of file handles in use. Each mapped region uses one file handle"""
@@ -428,6 +2101,30 @@ class StaticWindowMapManager(object):
         """:return: amount of bytes currently mapped in total"""
         return self._memory_size
 
+    def block_memory_size(self):
+        """:return: amount of bytes of all blocks in our block cache, see get_or_compute()"""
+        return self._block_memory_size
+
+    def num_blocks(self):
+        """:return: amount of blocks in our block cache"""
+        return len(self._blocks)
+
+    def resident_memory_size(self):
+        """:return: amount of mapped bytes which are currently resident in memory. Regions whose residency
+            cannot be determined count with their full size"""
+        return sum(region.resident_size() for regions in self._fdict.values() for region in regions)
+
+    def residency(self):
+        """:return: dict mapping each path or file descriptor with mapped regions to a tuple of
+            (resident bytes, mapped bytes)"""
+        res = dict()
+        for path_or_fd, regions in self._fdict.items():
+            if regions:
+                res[path_or_fd] = (sum(r.resident_size() for r in regions), sum(r.size() for r in regions))
+            # END skip unmapped files
+        # END for each file
+        return res
+
     def max_file_handles(self):
         """:return: maximium amount of handles we may have opened"""
         return self._max_handle_count
@@ -486,11 +2183,27 @@ class SlidingWindowMapManager(StaticWindowMapManager):
 
     __slots__ = tuple()
 
-    def __init__(self, window_size=-1, max_memory_size=0, max_open_handles=sys.maxsize):
-        """Adjusts the default window size to -1"""
-        super(SlidingWindowMapManager, self).__init__(window_size, max_memory_size, max_open_handles)
+    def __init__(self, window_size=-1, max_memory_size=0, max_open_handles=sys.maxsize,
+                 residency_interval=None, validate_interval=None, collect_budget=None, collect_time_budget=None,
+                 populate_size=0, overlap=0):
+        """Adjusts the default window size to -1
+        :param overlap: if not 0, new windows overlap their neighbours by this amount of bytes, which makes
+            sure that accesses of at most overlap bytes always fit into a single window. This prevents remapping
+            windows back and forth for small records crossing window boundaries. It must not be larger than
+            half the window size
+        :raise ValueError: if the overlap is too large"""
+        super(SlidingWindowMapManager, self).__init__(window_size, max_memory_size, max_open_handles,
+                                                      residency_interval, validate_interval, collect_budget,
+                                                      collect_time_budget, populate_size)
+        if self._window_size and overlap * 2 > self._window_size:
+            raise ValueError("Overlap of %i bytes is larger than half the window size" % overlap)
+        # END check overlap
+        self._overlap = overlap
 
     def _obtain_region(self, a, offset, size, flags, is_recursive):
+        # amount of bytes which must fit into the region, if windows overlap
+        need = min(size, self._overlap, a.file_size() - offset)
+
         # bisect to find an existing region. The c++ implementation cannot
         # do that as it uses a linked list for regions.
         r = None
@@ -502,6 +2215,17 @@ class SlidingWindowMapManager(StaticWindowMapManager):
             if ofs <= offset:
                 if a[mid].includes_ofs(offset):
                     r = a[mid]
+                    if need > 1:
+                        # prefer overlapping regions on our right which include all bytes we need
+                        while not r.includes_ofs(offset + need - 1):
+                            mid += 1
+                            if mid == len(a) or a[mid]._b > offset:
+                                r = None
+                                break
+                            # END handle no such region
+                            r = a[mid]
+                        # END while region is too short
+                    # END handle overlap
                     break
                 # END have region
                 lo = mid + 1
@@ -515,12 +2239,13 @@ class SlidingWindowMapManager(StaticWindowMapManager):
             left = self.MapWindowCls(0, 0)
             mid = self.MapWindowCls(offset, size)
             right = self.MapWindowCls(a.file_size(), 0)
+            overlap = self._overlap
 
             # we want to honor the max memory size, and assure we have anough
             # memory available
             # Save calls !
-            if self._memory_size + window_size > self._max_memory_size:
-                self._collect_lru_region(window_size)
+            if self._memory_size + self._block_memory_size + window_size > self._max_memory_size:
+                self._collect_lru_region(window_size, True)
             # END handle collection
 
             # we assume the list remains sorted by offset
@@ -554,6 +2279,16 @@ class SlidingWindowMapManager(StaticWindowMapManager):
                 left = self.MapWindowCls.from_region(a[insert_pos - 1])
             # END adjust surrounding windows
 
+            if overlap:
+                # reach into our neighbours, but never beyond them to keep the ends of all regions sorted.
+                # The left one may include our offset already if it didn't have all the bytes we need
+                left.size = max(0, min(left.size - overlap, offset - left.ofs))
+                if right.size:
+                    right.ofs = min(right.ofs + overlap, right.ofs_end() - 1)
+                    right.size = 0
+                # END shrink right
+            # END handle overlap
+
             mid.extend_left_to(left, window_size)
             mid.extend_right_to(right, window_size)
             mid.align()
@@ -568,7 +2303,7 @@ class SlidingWindowMapManager(StaticWindowMapManager):
                 if self._handle_count >= self._max_handle_count:
                     raise Exception
                 # END assert own imposed max file handles
-                r = self.MapRegionCls(a.path_or_fd(), mid.ofs, mid.size, flags)
+                r = self._make_region(a, mid.ofs, mid.size, flags)
             except Exception:
                 # apparently we are out of system resources or hit a limit
                 # As many more operations are likely to fail in that condition (
@@ -579,12 +2314,143 @@ class SlidingWindowMapManager(StaticWindowMapManager):
                     # a mapping. This is an exception, so we propagate it
                     raise
                 # END handle existing recursion
-                self._collect_lru_region(0)
+                self._collect_lru_region(0, True)
                 return self._obtain_region(a, offset, size, flags, True)
             # END handle exceptions
 
             self._handle_count += 1
+            self._num_maps += 1
             self._memory_size += r.size()
             a.insert(insert_pos, r)
         # END create new region
         return r
+
+
+class GridWindowMapManager(SlidingWindowMapManager):
+
+    """A sliding window manager whose windows lie on a fixed grid of window-size-aligned slots, instead of
+    being placed to fill the gaps between existing windows.
+
+    Windows don't depend on the access history, which is why nearby accesses of different cursors always
+    share the same region, and why an existing region is found with a single dictionary lookup instead
+    of a bisection. The downside is that windows are never enlarged to fill gaps, which is why accesses
+    crossing slot boundaries always require two windows.
+
+    The window size is rounded up to a multiple of the allocation granularity, or of the huge page size
+    if huge pages are requested."""
+
+    __slots__ = (
+        '_huge_pages',      # if True, windows are aligned to huge pages, and advised to use them
+    )
+
+    #{ Configuration
+    MapRegionListCls = GridRegionList
+    #} END configuration
+
+    _huge_page_size = 2 * 1024 * 1024
+
+    def __init__(self, window_size=-1, max_memory_size=0, max_open_handles=sys.maxsize,
+                 residency_interval=None, validate_interval=None, collect_budget=None, collect_time_budget=None,
+                 populate_size=0, huge_pages=False):
+        """See SlidingWindowMapManager for all parameters
+        :param window_size: size of each slot of the grid. It may not be 0
+        :param huge_pages: if True, align the window size to 2 MiB and advise the system to back our
+            windows with transparent huge pages, which reduces page table size and TLB misses for large
+            windows on systems supporting huge pages for file mappings
+        :raise ValueError: if the window size is 0"""
+        if window_size == 0:
+            raise ValueError("Grid windows require a window size")
+        # END handle window size
+        super(GridWindowMapManager, self).__init__(window_size, max_memory_size, max_open_handles,
+                                                   residency_interval, validate_interval, collect_budget,
+                                                   collect_time_budget, populate_size)
+        self._huge_pages = huge_pages
+        if huge_pages:
+            self._window_size = -(-self._window_size // self._huge_page_size) * self._huge_page_size
+        else:
+            self._window_size = align_to_mmap(self._window_size, True)
+        # END align window size
+
+    def _obtain_region(self, a, offset, size, flags, is_recursive):
+        window_size = self._window_size
+        ofs = offset - offset % window_size
+        r = a.region_at(ofs)
+        if r is not None:
+            return r
+        # END handle existing region
+
+        if self._memory_size + self._block_memory_size + window_size > self._max_memory_size:
+            self._collect_lru_region(window_size, True)
+        # END handle collection
+
+        try:
+            if self._handle_count >= self._max_handle_count:
+                raise Exception
+            # END assert own imposed max file handles
+            r = self._make_region(a, ofs, window_size, flags)
+        except Exception:
+            # we are out of system resources or hit a limit, free up as much as we may and try again
+            if is_recursive:
+                raise
+            # END handle existing recursion
+            self._collect_lru_region(0, True)
+            return self._obtain_region(a, offset, size, flags, True)
+        # END handle exceptions
+
+        self._handle_count += 1
+        self._num_maps += 1
+        self._memory_size += r.size()
+        a.append(r)
+        if self._huge_pages:
+            # the region is accounted for already, so a refused advice can't leak its mapping
+            try:
+                advise_map(r.map(), 0, r.size(), 'HUGEPAGE')
+            except OSError:
+                # many kernels don't support huge pages for file mappings, which only costs us the hint
+                pass
+            # END ignore unsupported advice
+        # END handle huge pages
+
+        assert r.includes_ofs(offset)
+        return r
+
+
+class HybridWindowMapManager(SlidingWindowMapManager):
+
+    """A sliding window manager which maps small files as a whole, like the StaticWindowMapManager does,
+    while it slides windows over large files.
+
+    The strategy is chosen per file, by comparing its size to the whole_file_size threshold. Regions of
+    small files are found without bisecting, and always serve an access with a single window. All files
+    share the memory budget, the handle limit and the queue of least recently used regions."""
+
+    __slots__ = (
+        '_whole_file_size',     # files of at most this amount of bytes are mapped as a whole
+    )
+
+    def __init__(self, window_size=-1, max_memory_size=0, max_open_handles=sys.maxsize,
+                 residency_interval=None, validate_interval=None, collect_budget=None, collect_time_budget=None,
+                 populate_size=0, overlap=0, whole_file_size=None):
+        """See SlidingWindowMapManager for all parameters
+        :param whole_file_size: files of at most this amount of bytes are mapped completely, larger ones are
+            accessed through sliding windows. If None, it is the window size"""
+        super(HybridWindowMapManager, self).__init__(window_size, max_memory_size, max_open_handles,
+                                                     residency_interval, validate_interval, collect_budget,
+                                                     collect_time_budget, populate_size, overlap)
+        if whole_file_size is None:
+            whole_file_size = self._window_size
+        # END handle default
+        self._whole_file_size = whole_file_size
+
+    def _obtain_region(self, a, offset, size, flags, is_recursive):
+        fsize = a.file_size()
+        if fsize > self._whole_file_size:
+            return super(HybridWindowMapManager, self)._obtain_region(a, offset, size, flags, is_recursive)
+        # END handle large files
+        # Regions of files which grew past the threshold were unmapped already, so a small file has at
+        # most its whole-file region. Make room for all of it
+        return StaticWindowMapManager._obtain_region(self, a, offset, fsize, flags, is_recursive)
+
+    def whole_file_size(self):
+        """:return: size in bytes up to which files are mapped as a whole"""
+        return self._whole_file_size
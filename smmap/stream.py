@@ -0,0 +1,306 @@
+"""Module with a file-like stream implementation using the memory manager"""
+import io
+import os
+import errno
+from mmap import mmap, PAGESIZE
+
+from .util import string_types, advise_file
+
+__all__ = ["SlidingWindowMapStream"]
+
+
+class _DirectReader(object):
+
+    """Reads a file chunk by chunk into a page-aligned buffer, bypassing the page cache using O_DIRECT.
+    Where O_DIRECT isn't supported, the file is read normally, and the pages of each chunk are dropped
+    from the page cache once we are done with them.
+
+    It provides the part of the WindowCursor interface the stream uses, its chunk being the window"""
+    __slots__ = (
+        '_fd',          # file descriptor we read from
+        '_close',       # if True, we opened _fd and have to close it
+        '_direct',      # True if _fd was opened with O_DIRECT
+        '_mf',          # anonymous, page-aligned memory map we read into
+        '_b',           # absolute offset of the first byte of the chunk
+        '_size',        # amount of valid bytes in the chunk, 0 if there is none
+        '_ofs',         # offset of the first byte of the chunk in the map, always 0
+    )
+
+    def __init__(self, path_or_fd, chunk_size):
+        self._fd = path_or_fd
+        self._close = False
+        self._direct = False
+        if isinstance(path_or_fd, string_types()):
+            flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+            direct = getattr(os, 'O_DIRECT', 0)
+            if direct and hasattr(os, 'preadv'):
+                try:
+                    self._fd = os.open(path_or_fd, flags | direct)
+                    self._direct = True
+                except OSError as e:
+                    # the file system doesn't support it
+                    if e.errno != errno.EINVAL:
+                        raise
+                # END handle unsupported O_DIRECT
+            # END try direct io
+            if not self._direct:
+                self._fd = os.open(path_or_fd, flags)
+            # END open normally
+            self._close = True
+        # END open file
+        self._mf = mmap(-1, max(PAGESIZE, chunk_size - chunk_size % PAGESIZE))
+        self._b = 0
+        self._size = 0
+        self._ofs = 0
+
+    def use_region(self, offset=0, size=0, flags=0):
+        begin = offset - offset % PAGESIZE
+        if self._direct:
+            count = os.preadv(self._fd, [self._mf], begin)
+        else:
+            data = os.pread(self._fd, len(self._mf), begin)
+            count = len(data)
+            self._mf[:count] = data
+        # END read chunk
+        self._b = begin
+        self._size = count
+        if not self.includes_ofs(offset):
+            self._size = 0
+        # END handle end of file
+        return self
+
+    def unuse_region(self):
+        self._size = 0
+
+    def discard_region(self):
+        if self._size and not self._direct:
+            advise_file(self._fd, self._b, self._size, 'DONTNEED')
+        # END drop cached pages
+        self.unuse_region()
+        return True
+
+    def is_valid(self):
+        return self._size > 0
+
+    def includes_ofs(self, ofs):
+        return self._b <= ofs < self._b + self._size
+
+    def ofs_begin(self):
+        return self._b
+
+    def ofs_end(self):
+        return self._b + self._size
+
+    def size(self):
+        return self._size
+
+    def buffer(self):
+        return memoryview(self._mf)[:self._size]
+
+    def map(self):
+        return self._mf
+
+    def is_direct(self):
+        return self._direct
+
+    def close(self):
+        self._size = 0
+        if self._close:
+            os.close(self._fd)
+        # END close our file
+        self._mf.close()
+
+
+class SlidingWindowMapStream(io.RawIOBase):
+
+    """A seekable, read-only raw stream on a range of a mapped file, which allows to hand mapped data
+    to consumers expecting a file object, like zlib, tarfile or pickle, without reading the whole file.
+
+    Data is copied from the windows of the provided cursor directly into the buffers of the caller.
+    The cursor moves its window along as the stream advances, which keeps memory bounded by the window size.
+
+    The stream is relative, that is position 0 maps to the offset used during initialization.
+    Wrap it into an io.BufferedReader if you need buffering, but note that peek() and readline()
+    are efficient already.
+
+    In scan mode, each window is unmapped as soon as we are done with it, and the system is advised to drop
+    its pages from the page cache. One-time passes over large files, like a backup or a full verification,
+    then don't evict the data other processes on the system work with."""
+
+    #{ Configuration
+    direct_chunk_size = 1024 * 1024     # amount of bytes read at once in direct mode
+    #} END configuration
+
+    def __init__(self, cursor, offset=0, size=None, scan=False, direct=False):
+        """Initialize the instance to read from the given cursor
+        :param cursor: an associated cursor of the file to read. The stream uses it exclusively from now on
+        :param offset: absolute offset in bytes of our first byte
+        :param size: amount of bytes we may read. If None, we read until the end of the file
+        :param scan: if True, drop each window once we read past it, see the class docs
+        :param direct: if True, don't map the file, but read it chunk by chunk using O_DIRECT, bypassing the
+            page cache altogether. Where O_DIRECT isn't supported, chunks are read normally and dropped from
+            the page cache afterwards. Implies scan. Cursors of concatenated files are not supported
+        :raise ValueError: if the cursor is not associated with a file, if the offset is out of bounds, or if
+            direct reads are requested for concatenated files"""
+        super(SlidingWindowMapStream, self).__init__()
+        self._c = None
+        self._src = None
+        if cursor is None or not cursor.is_associated():
+            raise ValueError("Require a cursor associated with a file")
+        # END check cursor
+        fsize = cursor.file_size()
+        if not 0 <= offset <= fsize:
+            raise ValueError("Offset %i is out of bounds of file with size %i" % (offset, fsize))
+        # END check offset
+        if size is None or offset + size > fsize:
+            size = fsize - offset
+        # END clamp size
+        if direct and isinstance(cursor.path_or_fd(), tuple):
+            raise ValueError("Direct reads require a cursor of a single file")
+        # END check direct reads
+        self._scan = scan or direct
+        self._c = cursor
+        self._src = cursor
+        if direct:
+            self._src = _DirectReader(cursor.path_or_fd(), self.direct_chunk_size)
+        # END handle direct io
+        self._begin = offset
+        self._size = size
+        self._pos = 0
+
+    def _window(self, ofs):
+        """Point our cursor to the window containing the absolute offset ofs
+        :return: the cursor, or None if there is no such window"""
+        c = self._src
+        if not c.is_valid() or not c.includes_ofs(ofs):
+            if self._scan and c.is_valid():
+                c.discard_region()
+            # END drop previous window
+            if not c.use_region(ofs).is_valid():
+                return None
+            # END handle end of file
+        # END obtain window
+        return c
+
+    #{ RawIOBase Interface
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        self._checkClosed()
+        dst = memoryview(b)
+        if dst.format != 'B':
+            dst = dst.cast('B')
+        # END handle typed buffers
+        nbytes = min(len(dst), self._size - self._pos)
+        pos = 0
+        while pos < nbytes:
+            ofs = self._begin + self._pos + pos
+            c = self._window(ofs)
+            if c is None:
+                break
+            # END handle end of file
+            rofs = ofs - c.ofs_begin()
+            count = min(nbytes - pos, c.size() - rofs)
+            dst[pos:pos + count] = c.buffer()[rofs:rofs + count]
+            pos += count
+            if self._scan and rofs + count == c.size():
+                c.discard_region()
+            # END drop consumed window
+        # END while there is data to copy
+        self._pos += pos
+        return pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence: %r" % whence)
+        # END handle whence
+        if pos < 0:
+            raise ValueError("Negative seek position %i" % pos)
+        # END handle position
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def readline(self, size=-1):
+        self._checkClosed()
+        remaining = self._size - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        # END clamp size
+        chunks = list()
+        while size > 0:
+            ofs = self._begin + self._pos
+            c = self._window(ofs)
+            if c is None:
+                break
+            # END handle end of file
+            # search the raw map to prevent creating a copy of the window
+            begin = c._ofs + ofs - c.ofs_begin()
+            end = begin + min(size, c.ofs_end() - ofs)
+            mf = c.map()
+            nl = mf.find(b'\n', begin, end)
+            if nl > -1:
+                end = nl + 1
+            # END handle newline
+            chunks.append(mf[begin:end])
+            self._pos += end - begin
+            size -= end - begin
+            if nl > -1:
+                break
+            # END handle end of line
+        # END while there is data
+        return bytes().join(chunks)
+
+    def close(self):
+        if not self.closed and self._src is not None:
+            if self._scan:
+                self._src.discard_region()
+            else:
+                self._src.unuse_region()
+            # END release the window
+            if self._src is not self._c:
+                self._src.close()
+            # END close direct reader
+        # END release the window
+        super(SlidingWindowMapStream, self).close()
+
+    #} END RawIOBase interface
+
+    #{ Interface
+
+    def peek(self, size=1):
+        """:return: at least one and up to size bytes at the current position without advancing it, or no bytes at
+            the end of the stream. Like the peek() of buffered streams, it returns at most what the current window
+            has to offer"""
+        self._checkClosed()
+        size = max(0, min(max(size, 1), self._size - self._pos))
+        ofs = self._begin + self._pos
+        c = size and self._window(ofs)
+        if not c:
+            return bytes()
+        # END handle end of file
+        rofs = ofs - c.ofs_begin()
+        return c.buffer()[rofs:rofs + size].tobytes()
+
+    def cursor(self):
+        """:return: the cursor providing access to the data"""
+        return self._c
+
+    def is_direct(self):
+        """:return: True if we read the file using O_DIRECT, bypassing the page cache"""
+        return self._src is not self._c and self._src.is_direct()
+
+    #} END interface
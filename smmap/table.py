@@ -0,0 +1,186 @@
+"""Module with a binary search implementation on sorted tables in mapped files"""
+import struct
+
+__all__ = ["SortedTableReader"]
+
+
+class SortedTableReader(object):
+
+    """Provides lookups in a table of fixed-width records sorted by a key, stored in a mapped file.
+    A typical example is the table of SHA1 hashes in git pack index files, which is accompanied by a
+    fan-out table of 256 big endian 32 bit integers, the nth entry containing the amount of records
+    whose key begins with a byte smaller or equal to n.
+
+    Keys are compared directly in the mapped windows of the cursor. Once the searched part of the table
+    fits into a window, which is the common case, a lookup doesn't require any further window changes.
+
+    Keys given to the lookup methods may be shorter than the keys in the table, in which case only their
+    first bytes are compared. This allows to look up abbreviated hashes, for instance."""
+    __slots__ = (
+        '_c',           # cursor into the file with the table
+        '_ofs',         # absolute offset of the first record
+        '_count',       # amount of records
+        '_rsize',       # size of each record in bytes
+        '_kofs',        # offset of the key within a record
+        '_ksize',       # size of the key in bytes
+        '_fanout',      # tuple of 256 fan-out entries, or None
+    )
+
+    def __init__(self, cursor, offset, record_size, count=None, key_offset=0, key_size=None, fanout_offset=None):
+        """Initialize the instance to read the table from the given cursor
+        :param cursor: an associated cursor of the file containing the table. It is used exclusively by us
+        :param offset: absolute offset in bytes of the first record in the file
+        :param record_size: size of each record in bytes
+        :param count: amount of records in the table. It may only be None if a fan-out table is given,
+            whose last entry is the amount of records
+        :param key_offset: offset of the key within each record
+        :param key_size: size of the key in bytes. If None, the key spans the rest of the record
+        :param fanout_offset: if not None, absolute offset of a fan-out table as described in the class docs
+        :raise ValueError: if the table doesn't fit into the file, or the count is unknown"""
+        self._c = cursor
+        self._ofs = offset
+        self._rsize = record_size
+        self._kofs = key_offset
+        self._ksize = key_size or (record_size - key_offset)
+        self._fanout = None
+
+        if fanout_offset is not None:
+            data = cursor.read_at(fanout_offset, 256 * 4)
+            if len(data) != 256 * 4:
+                raise ValueError("Fan-out table at offset %i is out of bounds" % fanout_offset)
+            # END check size
+            self._fanout = struct.unpack('>256L', data)
+            if count is None:
+                count = self._fanout[-1]
+            # END handle count
+        # END read fan-out table
+        if count is None:
+            raise ValueError("Require either the amount of records, or a fan-out table")
+        # END check count
+        if offset + count * record_size > cursor.file_size():
+            raise ValueError("Table with %i records at offset %i is larger than the file" % (count, offset))
+        # END check bounds
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _bounds(self, key):
+        """:return: tuple of (lo, hi) indices of records which may contain the given key"""
+        if self._fanout is None or not key:
+            # empty keys are a prefix of all keys
+            return 0, self._count
+        # END handle fan-out
+        first = bytearray(key[:1])[0]
+        if first:
+            return self._fanout[first - 1], self._fanout[first]
+        return 0, self._fanout[0]
+
+    def _lower_bound(self, key, lo, hi):
+        """:return: index of the first record in [lo, hi) whose key is not smaller than key, or hi"""
+        c = self._c
+        rsize = self._rsize
+        ksize = min(len(key), self._ksize)
+        key = key[:ksize]
+        base = self._ofs + self._kofs       # absolute offset of the key of the first record
+
+        while lo < hi:
+            begin = base + lo * rsize
+            end = base + (hi - 1) * rsize + ksize
+            if not c.is_valid() or not c.includes_ofs(begin) or not c.includes_ofs(end - 1):
+                c.use_region(begin, end - begin)
+            # END assure window
+            if c.is_valid() and c.includes_ofs(end - 1):
+                # all remaining keys are in our window - search the map directly
+                mf = c.map()
+                mbase = c._ofs - c.ofs_begin() + base
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    pos = mbase + mid * rsize
+                    if mf[pos:pos + ksize] < key:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                    # END narrow range
+                # END while bisecting
+                break
+            # END fast path
+
+            # the range spans multiple windows, narrow it down using individual reads
+            mid = (lo + hi) // 2
+            if c.read_at(base + mid * rsize, ksize) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+            # END narrow range
+        # END while bisecting
+        return lo
+
+    def _matches(self, index, key):
+        """:return: True if the record at index exists and its key starts with key"""
+        if index >= self._count:
+            return False
+        return self.key(index)[:len(key)] == key
+
+    #{ Interface
+
+    def cursor(self):
+        """:return: the cursor we use to access the table"""
+        return self._c
+
+    def record(self, index):
+        """:return: bytes of the record at the given index"""
+        if not 0 <= index < self._count:
+            raise IndexError("Record index %i out of range" % index)
+        # END check index
+        return self._c.read_at(self._ofs + index * self._rsize, self._rsize)
+
+    def key(self, index):
+        """:return: bytes of the key of the record at the given index"""
+        if not 0 <= index < self._count:
+            raise IndexError("Record index %i out of range" % index)
+        # END check index
+        return self._c.read_at(self._ofs + index * self._rsize + self._kofs, self._ksize)
+
+    def find(self, key):
+        """:return: index of the first record whose key starts with the given key, or None if there is none"""
+        lo, hi = self._bounds(key)
+        index = self._lower_bound(key, lo, hi)
+        if self._matches(index, key):
+            return index
+        return None
+
+    def find_range(self, lo_key=None, hi_key=None):
+        """:return: range of the indices of all records whose keys are between lo_key (inclusive) and hi_key
+            (exclusive). If lo_key or hi_key are None, the range is unbounded on the respective side"""
+        begin = 0
+        if lo_key is not None:
+            lo, hi = self._bounds(lo_key)
+            begin = self._lower_bound(lo_key, lo, hi)
+        # END handle lower key
+        end = self._count
+        if hi_key is not None:
+            lo, hi = self._bounds(hi_key)
+            end = max(begin, self._lower_bound(hi_key, max(lo, begin), hi))
+        # END handle upper key
+        return range(begin, end)
+
+    def find_many(self, keys):
+        """Look up many keys at once. They are searched in sorted order, which allows successive lookups
+        to share windows and narrow down the searched range.
+        :return: list with the index or None for each of the given keys, see find()"""
+        keys = list(keys)
+        result = [None] * len(keys)
+        prev = 0
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            key = keys[i]
+            lo, hi = self._bounds(key)
+            index = self._lower_bound(key, max(lo, min(prev, hi)), hi)
+            prev = index
+            if self._matches(index, key):
+                result[i] = index
+            # END handle match
+        # END for each key in order
+        return result
+
+    #} END interface
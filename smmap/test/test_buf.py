@@ -4,9 +4,10 @@ from .lib import TestBase, FileCreator
 
 from smmap.mman import (
     SlidingWindowMapManager,
-    StaticWindowMapManager
+    StaticWindowMapManager,
+    GridWindowMapManager
 )
-from smmap.buf import SlidingWindowMapBuffer
+from smmap.buf import SlidingWindowMapBuffer, ChainedView
 
 from random import randint
 from time import time
@@ -20,6 +21,15 @@ man_worst_case = SlidingWindowMapManager(
     max_memory_size=TestBase.k_window_test_size // 3,
     max_open_handles=15)
 static_man = StaticWindowMapManager()
+man_grid = GridWindowMapManager(
+    window_size=TestBase.k_window_test_size // 100,
+    max_memory_size=TestBase.k_window_test_size // 3,
+    max_open_handles=15)
+man_pread = SlidingWindowMapManager(
+    window_size=TestBase.k_window_test_size // 100,
+    max_memory_size=TestBase.k_window_test_size // 3,
+    max_open_handles=15)
+man_pread.set_backend('pread')
 
 
 class TestBuf(TestBase):
@@ -84,6 +94,8 @@ class TestBuf(TestBase):
             for item in (fc.path, fd):
                 for manager, man_id in ((man_optimal, 'optimal'),
                                         (man_worst_case, 'worst case'),
+                                        (man_grid, 'grid'),
+                                        (man_pread, 'worst case pread'),
                                         (static_man, 'static optimal')):
                     buf = SlidingWindowMapBuffer(manager.make_cursor(item))
                     assert manager.num_file_handles() == 1
@@ -126,3 +138,70 @@ class TestBuf(TestBase):
                 # END for each manager
             # END for each input
             os.close(fd)
+
+    def test_slice_copies(self):
+        with FileCreator(self.k_window_test_size, "slice_copy_test") as fc:
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END read data
+            window_size = fc.size // 10
+            for man in (SlidingWindowMapManager(window_size=window_size),
+                        SlidingWindowMapManager(window_size=window_size, overlap=4096)):
+                buf = SlidingWindowMapBuffer(man.make_cursor(fc.path))
+                # slices outside of the current window are copies, which don't keep windows from being unmapped
+                ofs = man.window_size() * 5 - 10
+                d = buf[ofs:ofs + 20]
+                assert isinstance(d, bytes) and d == data[ofs:ofs + 20]
+                buf.end_access()
+                assert man.collect() and man.num_file_handles() == 0
+                del(d)
+            # END for each manager
+        # END with file
+
+    def test_chained_view(self):
+        with FileCreator(self.k_window_test_size, "chained_view_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(os.urandom(fc.size))
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END prepare data
+
+            man = SlidingWindowMapManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+            buf = SlidingWindowMapBuffer(man.make_cursor(fc.path), chained=True)
+            ws = man.window_size()
+
+            # slices within a window are plain views
+            assert bytes(buf[10:20]) == data[10:20]
+
+            # slices across windows are chained
+            ofs_begin, ofs_end = ws - 10, ws * 3 + 10
+            view = buf[ofs_begin:ofs_end]
+            assert isinstance(view, ChainedView)
+            assert len(view) == ofs_end - ofs_begin
+            num_segments = len(view.segments())
+            num_regions = len(set(id(r) for r in view._regions))
+            assert num_segments >= num_regions >= 3
+            assert bytes().join(bytes(s) for s in view) == data[ofs_begin:ofs_end]
+            assert view.tobytes() == data[ofs_begin:ofs_end]
+
+            out = bytearray(ws)
+            assert view.readinto(out) == ws
+            assert bytes(out) == data[ofs_begin:ofs_begin + ws]
+
+            # the windows are kept alive, even if the manager collects
+            buf.end_access()
+            man.collect()
+            assert man.num_file_handles() == num_regions
+            view.release()
+            view.release()
+            assert len(view) == 0 and not view.segments()
+            assert man.collect() == num_regions
+
+            # context manager use
+            assert buf.begin_access()
+            with buf[ofs_begin:ofs_end] as view:
+                assert view.tobytes() == data[ofs_begin:ofs_end]
+            # END with view
+            buf.end_access()
+            assert man.collect()
+        # END with file
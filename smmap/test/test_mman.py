@@ -4,15 +4,25 @@ from .lib import TestBase, FileCreator
 
 from smmap.mman import (
     WindowCursor,
+    ConcatWindowCursor,
+    MultiWindowCursor,
     SlidingWindowMapManager,
-    StaticWindowMapManager
+    StaticWindowMapManager,
+    GridWindowMapManager,
+    HybridWindowMapManager
 )
-from smmap.util import align_to_mmap
+from smmap.buf import SlidingWindowMapBuffer
+from smmap.util import align_to_mmap, MapRegion, PreadRegion
 
 from random import randint
 from time import time
+import io
+import mmap
 import os
+import socket
+import threading
 import sys
+import zlib
 from copy import copy
 
 
@@ -224,3 +234,1234 @@ class TestMMan(TestBase):
                 # END for each manager type
             finally:
                 os.close(fd)
+
+    def test_warm(self):
+        with FileCreator(self.k_window_test_size, "warm_test") as fc:
+            man = SlidingWindowMapManager(window_size=fc.size // 4, max_memory_size=fc.size // 2)
+            self.assertRaises(ValueError, man.warm, [fc.path], mode='foo')
+
+            # hints map nothing, but respect the memory budget
+            progress = list()
+            nbytes = man.warm([fc.path], progress=lambda done, total: progress.append((done, total)))
+            assert nbytes in (0, man.max_mapped_memory_size())
+            assert man.mapped_memory_size() == 0
+            if nbytes:
+                assert progress[-1] == (nbytes, nbytes)
+            # END handle systems without posix_fadvise
+
+            # nothing is mapped yet, so there is nothing to advise
+            assert man.warm([(fc.path, 0, 1000)], mode='madvise') == 0
+
+            # touching maps the ranges, and leaves them mapped but unused
+            assert man.warm([(fc.path, 100, 1000), (fc.path, fc.size - 10, 0)], mode='touch') == 1010
+            assert man.num_file_handles() == 2
+            for region in man._fdict[fc.path]:
+                assert region.client_count() == 1
+            # END for each region
+
+            # the budget is respected
+            assert man.warm([fc.path], mode='touch', num_threads=3) == man.max_mapped_memory_size()
+
+            nbytes = man.warm([(fc.path, 0, 1000)], mode='madvise')
+            assert nbytes in (0, 1000)
+            assert man.collect()
+
+            # files used copy-on-write are warmed in their mode
+            cc = man.make_cursor(fc.path, access='copy')
+            for mode in ('fadvise', 'madvise', 'touch'):
+                man.warm([(fc.path, 0, 1000)], mode=mode)
+            # END for each mode
+            assert man.num_file_handles() == 1 and man._fdict[fc.path].access() == mmap.ACCESS_COPY
+            del(cc)
+            assert man.collect() == 0 and man.num_file_handles() == 0
+        # END with file
+
+    def test_residency(self):
+        with FileCreator(self.k_window_test_size, "residency_test") as fc:
+            window_size = fc.size // 8
+            man = SlidingWindowMapManager(window_size=window_size, max_memory_size=window_size * 2,
+                                          residency_interval=0)
+            c = man.make_cursor(fc.path)
+            assert man.residency() == dict()
+            assert man.resident_memory_size() == 0
+
+            # touch only a single byte of each window
+            for ofs in range(0, fc.size, window_size):
+                assert c.use_region(ofs, 1).is_valid()
+                c.buffer()[0]
+            # END for each window
+            c.unuse_region()
+
+            resident, mapped = man.residency()[fc.path]
+            assert resident <= mapped
+            assert resident == man.resident_memory_size()
+            assert mapped == man.mapped_memory_size()
+            if resident < mapped:
+                # mincore is supported, which allows us to keep way more windows than the budget would suggest
+                assert man.mapped_memory_size() > man.max_mapped_memory_size()
+            # END handle mincore support
+            assert man.collect()
+            assert man.mapped_memory_size() == 0
+        # END with file
+
+    def test_profile(self):
+        with FileCreator(self.k_window_test_size, "profile_test") as fc:
+            with FileCreator(1000, "profile_changed_test") as fc2:
+                window_size = fc.size // 8
+                man = SlidingWindowMapManager(window_size=window_size, max_memory_size=window_size * 5)
+                c = man.make_cursor(fc.path)
+                for ofs in (0, 0, 0, window_size * 4, window_size * 4, fc.size - 1):
+                    assert c.use_region(ofs, 1).is_valid()
+                # END for each access
+                c2 = man.make_cursor(fc2.path)
+                assert c2.use_region(0, 1).is_valid()
+                hits = sorted(r.hit_count() for r in man._fdict[fc.path])
+                assert hits == [1, 2, 3]
+                budget = sum(r.size() for r in man._fdict[fc.path] if r.hit_count() > 1)
+
+                profile = FileCreator(1, "profile")
+                man.save_profile(profile.path)
+                del(c, c2)
+
+                # change the second file, and restore into a new manager with a smaller budget
+                with open(fc2.path, 'ab') as fp:
+                    fp.write(b'more')
+                # END change file
+                man = SlidingWindowMapManager(window_size=window_size, max_memory_size=budget)
+                assert man.load_profile(profile.path, prefault=True) == 2
+                regions = man._fdict[fc.path]
+                assert fc2.path not in man._fdict
+                assert sorted(r.hit_count() for r in regions) == [3, 4]
+                assert [r.client_count() for r in regions] == [1, 1]
+                assert man.collect() == 2
+
+                # profiles restore files used copy-on-write as well
+                cc = man.make_cursor(fc.path, access='copy')
+                assert man.load_profile(profile.path) == 2
+                del(cc)
+                man.collect()
+                del(profile)
+            # END with changed file
+        # END with file
+
+    def test_gather(self):
+        class CountingManager(SlidingWindowMapManager):
+            __slots__ = ('num_obtained', )
+
+            def _obtain_region(self, *args):
+                self.num_obtained += 1
+                return super(CountingManager, self)._obtain_region(*args)
+
+        with FileCreator(self.k_window_test_size, "gather_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(os.urandom(fc.size))
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END prepare data
+
+            man = CountingManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+            man.num_obtained = 0
+            c = man.make_cursor(fc.path)
+            record_size = 20
+            ranges = [(randint(0, fc.size - record_size), record_size) for _ in range(5000)]
+            ranges.append((man.window_size() - 3, 10))     # crosses windows
+            ranges.append((fc.size - 1, 1))
+            ranges.append((0, 0))
+
+            views = c.gather(ranges)
+            assert len(views) == len(ranges)
+            for (ofs, size), view in zip(ranges, views):
+                assert view.tobytes() == data[ofs:ofs + size]
+            # END for each range
+            # each window was obtained at most once
+            assert man.num_obtained <= 11
+
+            out = bytearray(sum(r[1] for r in ranges) + 1)
+            assert c.gather(ranges, out) is out
+            assert bytes(out[:record_size]) == data[ranges[0][0]:ranges[0][0] + record_size]
+
+            self.assertRaises(ValueError, c.gather, ranges, bytearray(1))
+            self.assertRaises(ValueError, c.gather, [(fc.size - 1, 2)])
+
+            # in comparison, individual accesses have to remap windows all the time
+            man.num_obtained = 0
+            for ofs, size in ranges:
+                c.use_region(ofs, size)
+            # END for each range
+            assert man.num_obtained > 11
+            c.unuse_region()
+            assert man.collect()
+        # END with file
+
+    def test_read_at(self):
+        with FileCreator(self.k_window_test_size, "read_at_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(os.urandom(fc.size))
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END prepare data
+
+            man = SlidingWindowMapManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+            c = man.make_cursor(fc.path)
+            ws = man.window_size()
+            for ofs, size in ((0, 10), (5, 10), (ws - 5, 10), (ws * 2 - 5, ws + 10), (fc.size - 5, 10),
+                              (fc.size, 10), (fc.size + 10, 10), (0, 0)):
+                assert c.read_at(ofs, size) == data[ofs:ofs + size]
+                view = c.view_at(ofs, size)
+                assert isinstance(view, memoryview)
+                assert view.tobytes() == data[ofs:ofs + size]
+                del(view)
+            # END for each read
+            self.assertRaises(ValueError, c.read_at, -1, 1)
+
+            # PERFORMANCE
+            # compare the per-read overhead of reads within the same window
+            num_reads = 20000
+            offsets = [randint(0, ws - 100) for _ in range(num_reads)]
+            for mode in ('use_region', 'read_at', 'view_at'):
+                st = time()
+                if mode == 'use_region':
+                    for ofs in offsets:
+                        c.use_region(ofs, 20)
+                        assert c.is_valid()
+                        c.buffer()[:20]
+                    # END for each read
+                elif mode == 'read_at':
+                    read_at = c.read_at
+                    for ofs in offsets:
+                        read_at(ofs, 20)
+                    # END for each read
+                else:
+                    view_at = c.view_at
+                    for ofs in offsets:
+                        view_at(ofs, 20)
+                    # END for each read
+                # END handle mode
+                elapsed = max(time() - st, 0.001)
+                print("%s: %i reads of 20 bytes in %fs (%f us per read)"
+                      % (mode, num_reads, elapsed, elapsed * 1e6 / num_reads), file=sys.stderr)
+            # END for each mode
+            c.unuse_region()
+            assert man.collect()
+        # END with file
+
+    def test_send_range(self):
+        with FileCreator(self.k_window_test_size, "send_range_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(os.urandom(fc.size))
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END prepare data
+
+            man = SlidingWindowMapManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+            c = man.make_cursor(fc.path)
+            ofs = man.window_size() - 100
+            size = man.window_size() * 2
+
+            # sockets
+            a, b = socket.socketpair()
+            try:
+                received = list()
+                reader = threading.Thread(target=lambda: received.append(b.makefile('rb').read(size)))
+                reader.start()
+                assert c.send_range(a, ofs, size) == size
+                reader.join()
+                assert received[0] == data[ofs:ofs + size]
+            finally:
+                a.close()
+                b.close()
+            # END handle sockets
+
+            # sockets with a timeout are non-blocking, and may accept only parts of the data at once
+            a, b = socket.socketpair()
+            try:
+                a.settimeout(10)
+                received = list()
+                reader = threading.Thread(target=lambda: received.append(b.makefile('rb').read(fc.size)))
+                reader.start()
+                assert c.send_range(a, 0, fc.size) == fc.size
+                reader.join()
+                assert received[0] == data
+            finally:
+                a.close()
+                b.close()
+            # END handle sockets with timeout
+
+            # files and file descriptors, and objects without file descriptor
+            with FileCreator(1, "send_range_out") as out:
+                with open(out.path, 'wb') as fp:
+                    fp.write(b'x')
+                    assert c.send_range(fp, ofs, size) == size
+                    assert c.send_range(fp.fileno(), fc.size - 10, size) == 10
+                    fp.write(b'y')
+                # END with file
+                with open(out.path, 'rb') as fp:
+                    assert fp.read() == b'x' + data[ofs:ofs + size] + data[-10:] + b'y'
+                # END check output
+            # END with output file
+            bio = io.BytesIO()
+            assert c.send_range(bio, ofs, size) == size
+            assert bio.getvalue() == data[ofs:ofs + size]
+            assert c.send_range(bio, fc.size, size) == 0
+
+            c.unuse_region()
+            man.collect()
+            del(c)
+
+            # modifications the kernel can't see in the file are sent from our windows
+            for backend, access in (('mmap', 'copy'), ('pread', 'write')):
+                c = man.make_cursor(fc.path, access=access, backend=backend)
+                c.write_at(ofs, b'HELLO')
+                with FileCreator(1, "send_range_out") as out:
+                    with open(out.path, 'wb') as fp:
+                        assert c.send_range(fp, ofs, size) == size
+                    # END with file
+                    with open(out.path, 'rb') as fp:
+                        assert fp.read(5) == b'HELLO'
+                    # END check output
+                # END with output file
+                c.write_at(ofs, data[ofs:ofs + 5])
+                c.flush()
+                c.unuse_region()
+                del(c)
+                man.collect()
+            # END for each configuration
+        # END with file
+
+    def test_concat_cursor(self):
+        sizes = (self.k_window_test_size // 3, 100, self.k_window_test_size // 2)
+        files = [FileCreator(size, "concat_test_%i" % i) for i, size in enumerate(sizes)]
+        try:
+            data = list()
+            for fc in files:
+                chunk = os.urandom(fc.size)
+                with open(fc.path, 'wb') as fp:
+                    fp.write(chunk)
+                data.append(chunk)
+            # END for each part
+            data = bytes().join(data)
+            paths = [fc.path for fc in files]
+
+            man = SlidingWindowMapManager(window_size=sizes[0] // 4, max_memory_size=sizes[0])
+            c = man.make_cursor(paths)
+            assert isinstance(c, ConcatWindowCursor)
+            assert c.is_associated() and not c.is_valid()
+            assert c.file_size() == len(data)
+            assert c.path_or_fd() == c.path() == tuple(paths)
+            assert c.parts() == [(paths[0], 0), (paths[1], sizes[0]), (paths[2], sizes[0] + 100)]
+            self.assertRaises(ValueError, c.fd)
+
+            # windows use absolute offsets
+            ofs = sizes[0] + 10
+            assert c.use_region(ofs, 1000).is_valid()
+            assert c.ofs_begin() == ofs and c.ofs_end() == sizes[0] + 100
+            assert c.includes_ofs(ofs) and not c.includes_ofs(ofs - 11)
+            assert c.buffer()[:].tobytes() == data[ofs:sizes[0] + 100]
+            assert not c.use_region(len(data)).is_valid()
+
+            # reads crossing part boundaries
+            for ofs, size in ((0, 10), (sizes[0] - 5, 110), (sizes[0] + 50, 100), (len(data) - 5, 10)):
+                assert c.read_at(ofs, size) == data[ofs:ofs + size]
+                assert c.view_at(ofs, size).tobytes() == data[ofs:ofs + size]
+            # END for each read
+            ranges = [(randint(0, len(data) - 200), 200) for _ in range(1000)] + [(sizes[0] - 1, 102)]
+            for (ofs, size), view in zip(ranges, c.gather(ranges)):
+                assert view.tobytes() == data[ofs:ofs + size]
+            # END for each range
+            buf = SlidingWindowMapBuffer(c)
+            assert buf[sizes[0] - 10:sizes[0] + 110] == data[sizes[0] - 10:sizes[0] + 110]
+            bio = io.BytesIO()
+            assert c.send_range(bio, sizes[0] - 10, 200) == 200
+            assert bio.getvalue() == data[sizes[0] - 10:sizes[0] + 190]
+
+            # memory is accounted per part, with one shared budget
+            assert set(man._fdict) == set(paths)
+            assert man.mapped_memory_size() <= man.max_mapped_memory_size()
+            buf.end_access()
+            c2 = copy(c)
+            del(c, buf)
+            c2._destroy()
+            assert man.collect()
+            assert man.num_open_files() == 0
+
+            # parts replaced on disk move all parts following them once they were validated
+            man = SlidingWindowMapManager(window_size=sizes[0] // 4, validate_interval=0)
+            c = man.make_cursor(paths)
+            assert c.read_at(sizes[0] + 90, 20) == data[sizes[0] + 90:sizes[0] + 110]
+            middle = os.urandom(300)
+            tmp = paths[1] + '.new'
+            with open(tmp, 'wb') as fp:
+                fp.write(middle)
+            # END write replacement
+            os.rename(tmp, paths[1])
+            data = data[:sizes[0]] + middle + data[sizes[0] + 100:]
+            assert c.read_at(sizes[0] + 10, 10) == middle[10:20]
+            assert c.file_size() == len(data)
+            assert c.parts()[2] == (paths[2], sizes[0] + 300)
+            assert c.read_at(len(data) - 10, 10) == data[-10:]
+            assert c.read_at(sizes[0] + 290, 20) == data[sizes[0] + 290:sizes[0] + 310]
+            c.unuse_region()
+            del(c)
+        finally:
+            for fc in files:
+                fc.__del__()
+        # END remove files
+
+    def test_histograms(self):
+        with FileCreator(self.k_window_test_size, "histogram_test") as fc:
+            man = SlidingWindowMapManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+            assert man.histograms() == dict() and man.latency_percentiles() == dict()
+            man.enable_histograms()
+            c = man.make_cursor(fc.path)
+            for _ in range(1000):
+                assert c.use_region(randint(0, fc.size - 1), 100).is_valid()
+            # END for each access
+            c.unuse_region()
+            man.collect()
+
+            hists = man.histograms()
+            assert sorted(hists) == ['collect', 'first_touch', 'map_region', 'use_region_hit', 'use_region_miss']
+            assert hists['use_region_hit'].count() + hists['use_region_miss'].count() == 1000
+            assert hists['use_region_miss'].count() == man.num_maps()
+            assert hists['map_region'].count() == hists['first_touch'].count() == man.num_maps()
+            assert hists['collect'].count()
+            percentiles = man.latency_percentiles((50, 99))
+            for name, ps in percentiles.items():
+                assert ps[50] <= ps[99] <= hists[name].max()
+            # END for each histogram
+
+            # enabling again keeps the values, disabling drops them
+            man.enable_histograms()
+            assert man.histograms()['collect'] is hists['collect']
+            man.enable_histograms(False)
+            assert man.histograms() == dict()
+        # END with file
+
+    def test_validate(self):
+        with FileCreator(self.k_window_test_size, "validate_test") as fc:
+            with FileCreator(self.k_window_test_size, "validate_other") as other:
+                for man in (StaticWindowMapManager(validate_interval=0),
+                            SlidingWindowMapManager(window_size=fc.size // 4, validate_interval=0)):
+                    c = man.make_cursor(fc.path)
+                    oc = man.make_cursor(other.path)
+                    rc = man.make_cursor(fc.path)
+                    assert c.use_region(0, 100).is_valid() and oc.use_region(0, 100).is_valid()
+                    assert rc.use_region(0, 100).region() is c.region()
+                    original = rc.read_at(0, 10)
+                    stale = c.region()
+                    rlist = man._fdict[fc.path]
+                    identity = rlist.identity()
+                    assert identity[2] == fc.size and not rlist.is_stale()
+
+                    # replace the file at the same path, like git gc does with packs
+                    tmp = fc.path + '.new'
+                    with open(tmp, 'wb') as fp:
+                        fp.write(b'x' * 5000)
+                    # END write replacement
+                    os.rename(tmp, fc.path)
+                    assert rlist.is_stale()
+
+                    # the cursor notices the change, drops its stale region and sees the new size
+                    assert c.use_region(0, 100).is_valid()
+                    assert stale.is_stale() and c.region() is not stale
+                    assert c.file_size() == 5000 and rlist.identity() != identity
+                    assert c.buffer()[:1] == b'x'
+                    # cursors still pointing to the stale region leave it on their next read
+                    assert rc.region() is stale and original != b'x' * 10
+                    assert rc.read_at(0, 10) == b'x' * 10 and rc.region() is c.region()
+                    assert bytes(rc.view_at(4990, 20)) == b'x' * 10
+                    rc.unuse_region()
+                    assert stale.client_count() == 0
+                    # the other file stays mapped
+                    assert oc.is_valid() and oc.region().client_count() == 2
+                    assert man.num_file_handles() == 2
+
+                    # unchanged files are not invalidated
+                    region = c.region()
+                    assert c.use_region(10, 10).region() is region and not region.is_stale()
+
+                    # the interval throttles the checks
+                    man._validate_interval = 3600
+                    rlist._checked = time()
+                    with open(fc.path, 'ab') as fp:
+                        fp.write(b'y')
+                    # END grow file
+                    assert c.use_region(0, 100).region() is region
+                    assert c.file_size() == 5000
+                    man._validate_interval = 0
+                    # END with throttled validation
+
+                    c.unuse_region()
+                    oc.unuse_region()
+                    del(rc)
+                    man.collect()
+                    with open(fc.path, 'wb') as fp:
+                        fp.seek(fc.size - 1)
+                        fp.write(b'1')
+                    # END restore file
+                # END for each manager type
+            # END with other file
+        # END with file
+
+    def test_aliases(self):
+        with FileCreator(self.k_window_test_size, "alias_test") as fc:
+            link = fc.path + '.link'
+            os.symlink(fc.path, link)
+            fd = os.open(fc.path, os.O_RDONLY)
+            try:
+                for man in (StaticWindowMapManager(), SlidingWindowMapManager(window_size=fc.size // 4)):
+                    relpath = os.path.relpath(fc.path)
+                    items = (fc.path, relpath, link, fd)
+                    cursors = [man.make_cursor(item) for item in items]
+                    for item, c in zip(items, cursors):
+                        assert c.path_or_fd() is item
+                        assert c.use_region(0, 100).is_valid()
+                    # END for each alias
+
+                    # all aliases share one region list, and thus their regions
+                    assert man.num_open_files() == 1 and len(man._fdict) == 1
+                    rlist = man._fdict[fc.path]
+                    assert sorted(map(str, rlist.aliases())) == sorted(map(str, items[1:]))
+                    assert len(set(id(c.region()) for c in cursors)) == 1
+                    assert man.num_file_handles() == 1 and man.mapped_memory_size() == cursors[0].region().size()
+
+                    # dropping all cursors removes the aliases as well
+                    for c in cursors:
+                        c.unuse_region()
+                    # END for each cursor
+                    man.collect()
+                    del(c)
+                    del(cursors[:])
+                    assert not man._fdict and not man._aliases and not man._idict
+
+                    # a reused file descriptor number doesn't resolve to the previous file
+                    with FileCreator(1000, "alias_other") as other:
+                        c = man.make_cursor(fd)
+                        assert c.use_region(0, 100).is_valid()
+                        ofd = os.open(other.path, os.O_RDONLY)
+                        os.dup2(ofd, fd)
+                        os.close(ofd)
+                        oc = man.make_cursor(fd)
+                        assert oc.file_size() == 1000 and oc._rlist is not c._rlist
+                        assert oc.use_region(0, 10).is_valid() and c.is_valid()
+                        assert man.num_file_handles() == 1
+                        del(c)
+                        del(oc)
+                        os.dup2(os.open(fc.path, os.O_RDONLY), fd)
+                    # END with other file
+                    man.collect()
+
+                    # paths become the key of files first seen through a descriptor, as these may be closed
+                    dfd = os.dup(fd)
+                    dc = man.make_cursor(dfd)
+                    assert dc.use_region(0, 10).is_valid()
+                    pc = man.make_cursor(fc.path)
+                    rlist = man._fdict[fc.path]
+                    assert rlist is dc._rlist and rlist.path_or_fd() == fc.path and dfd in rlist.aliases()
+                    dc.unuse_region()
+                    man.collect()
+                    with FileCreator(1000, "alias_other") as other:
+                        os.close(dfd)
+                        ofd = os.open(other.path, os.O_RDONLY)
+                        try:
+                            assert pc.use_region(fc.size - 10, 10).is_valid()
+                            with open(fc.path, 'rb') as fp:
+                                fp.seek(fc.size - 10)
+                                assert pc.buffer()[:] == fp.read(10)
+                            # END check data
+                        finally:
+                            os.close(ofd)
+                        # END close other file
+                    # END with other file
+                    del(dc)
+                    del(pc)
+                    man.collect()
+
+                    # descriptors keep reading the file they refer to, even if its path was replaced
+                    with FileCreator(fc.size, "alias_replaced") as other:
+                        dfd = os.open(fc.path, os.O_RDONLY)
+                        pc = man.make_cursor(fc.path)
+                        dc = man.make_cursor(dfd)
+                        assert pc._rlist is dc._rlist
+                        with open(other.path, 'r+b') as fp:
+                            fp.write(b'\xff' * 10)
+                        # END change other file
+                        os.rename(fc.path, fc.path + '.old')
+                        os.rename(other.path, fc.path)
+                        try:
+                            assert dc.use_region(0, 10).is_valid()
+                            os.lseek(dfd, 0, os.SEEK_SET)
+                            assert dc.buffer()[:] == os.read(dfd, 10) != b'\xff' * 10
+                        finally:
+                            dc.unuse_region()
+                            os.rename(fc.path, other.path)
+                            os.rename(fc.path + '.old', fc.path)
+                            os.close(dfd)
+                        # END restore files
+                    # END with other file
+                    del(dc)
+                    del(pc)
+                    man.collect()
+
+                    # descriptors are checked before mapping through them
+                    dfd = os.dup(fd)
+                    dc = type(man)().make_cursor(dfd)
+                    assert dc.file_size() == fc.size
+                    with FileCreator(1000, "alias_other") as other:
+                        ofd = os.open(other.path, os.O_RDONLY)
+                        os.dup2(ofd, dfd)
+                        os.close(ofd)
+                        self.assertRaises(OSError, dc.use_region, 0, 10)
+                        os.close(dfd)
+                    # END with other file
+                    del(dc)
+                # END for each manager type
+            finally:
+                os.close(fd)
+                os.remove(link)
+            # END cleanup
+        # END with file
+
+    def test_reaper(self):
+        with FileCreator(self.k_window_test_size, "reaper_test") as fc:
+            window_size = align_to_mmap(fc.size // 8, False)
+            man = SlidingWindowMapManager(window_size=window_size)
+            c = man.make_cursor(fc.path)
+            for ofs in range(0, fc.size, window_size):
+                assert c.use_region(ofs, 1).is_valid()
+            # END for each window
+            num_regions = man.num_file_handles()
+            assert num_regions > 4
+
+            # the first pass only notices idle regions, unless they expire right away
+            assert man.reap(3600) == 0
+            assert man.reap(0) == num_regions - 1
+            assert man.num_file_handles() == 1 and c.is_valid()
+
+            # regions which are used again are considered idle from then on
+            for ofs in range(0, fc.size, window_size):
+                assert c.use_region(ofs, 1).is_valid()
+            # END for each window
+            c.unuse_region()
+            man.reap(3600)
+            region = man._fdict[fc.path][0]
+            c.use_region(0, 1)
+            c.unuse_region()
+            man._idle = dict((r, (hc, since - 7200)) for r, (hc, since) in man._idle.items())
+            assert man.reap(3600) == num_regions - 1
+            assert man._fdict[fc.path][:] == [region]
+
+            # shrink to the idle target, starting with the longest idle regions
+            for ofs in range(0, fc.size, window_size):
+                assert c.use_region(ofs, 1).is_valid()
+            # END for each window
+            c.unuse_region()
+            target = window_size * 2
+            assert man.reap(3600, target) > 0
+            assert 0 < man.mapped_memory_size() <= target
+
+            # the idle target works with the sampled resident size as well
+            rman = SlidingWindowMapManager(window_size=window_size, residency_interval=3600)
+            rc = rman.make_cursor(fc.path)
+            for ofs in range(0, fc.size, window_size):
+                assert len(bytes(rc.use_region(ofs, window_size).buffer())) == rc.size()
+            # END for each resident window
+            rc.unuse_region()
+            num_regions = rman.num_file_handles()
+            assert rman.reap(3600) == 0
+            assert 0 < rman.reap(3600, window_size * 4) < num_regions
+            assert 0 < rman.mapped_memory_size() <= window_size * 4
+
+            # the background thread does the same periodically
+            man.stop_reaper()   # does nothing if it is not running
+            man.start_reaper(0.01)
+            try:
+                self.assertRaises(ValueError, man.start_reaper, 0.01)
+                for ofs in range(0, fc.size, window_size):
+                    assert c.use_region(ofs, 1).is_valid()
+                # END for each window
+                c.unuse_region()
+                deadline = time() + 10
+                while man.num_file_handles() and time() < deadline:
+                    threading.Event().wait(0.01)
+                # END wait for reaper
+                assert man.num_file_handles() == 0 and man.mapped_memory_size() == 0
+            finally:
+                man.stop_reaper()
+            # END stop reaper
+            assert man._reaper is None
+        # END with file
+
+    def test_collect_budget(self):
+        with FileCreator(self.k_window_test_size, "budget_test") as fc:
+            window_size = align_to_mmap(fc.size // 16, False)
+            for kwargs in (dict(collect_budget=2), dict(collect_time_budget=0)):
+                max_found = kwargs.get('collect_budget', 1)
+                man = SlidingWindowMapManager(window_size=window_size, max_memory_size=fc.size * 2, **kwargs)
+                c = man.make_cursor(fc.path)
+                for ofs in range(0, fc.size, window_size):
+                    assert c.use_region(ofs, 1).is_valid()
+                # END for each window
+                c.unuse_region()
+                num_regions = man.num_file_handles()
+                assert num_regions > 8
+
+                # a new mapping only unmaps as many regions as the budget allows, and over-allocates
+                man._max_memory_size = window_size * 2
+                rlist = man._fdict[fc.path]
+                region = rlist[-1]
+                man._unmap_region(rlist, region)
+                assert c.use_region(region.ofs_begin(), 1).is_valid()
+                assert man.num_file_handles() == num_regions - max_found
+                assert man.mapped_memory_size() > man.max_mapped_memory_size()
+
+                # later mappings catch up, and so does the reaper
+                c.use_region(0, 1)
+                assert man.num_file_handles() <= num_regions - max_found
+                c.unuse_region()
+                assert man.reap(3600) > 0
+                assert man.mapped_memory_size() <= man.max_mapped_memory_size()
+
+                # explicit collections are not bounded
+                for ofs in range(0, fc.size, window_size):
+                    assert c.use_region(ofs, 1).is_valid()
+                # END for each window
+                c.unuse_region()
+                num_regions = man.num_file_handles()
+                assert man.collect() == num_regions and man.num_file_handles() == 0
+            # END for each budget
+        # END with file
+
+    def test_grid(self):
+        with FileCreator(self.k_window_test_size, "grid_test") as fc:
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END read data
+            self.assertRaises(ValueError, GridWindowMapManager, window_size=0)
+            assert GridWindowMapManager(window_size=1).window_size() == align_to_mmap(1, True)
+            assert GridWindowMapManager(window_size=1, huge_pages=True).window_size() == 2 * 1024 * 1024
+
+            # a refused huge page advice neither fails the access nor leaks the mapping
+            hman = GridWindowMapManager(window_size=1, huge_pages=True)
+            hc = hman.make_cursor(fc.path)
+            assert hc.use_region(10, 100).buffer()[:] == data[10:110]
+            assert hman.num_file_handles() == 1 and hman.mapped_memory_size() == hc.region().size()
+            hc.unuse_region()
+            assert hman.collect() == 1 and hman.num_file_handles() == 0
+
+            window_size = align_to_mmap(fc.size // 10, True)
+            man = GridWindowMapManager(window_size=window_size, max_memory_size=window_size * 3)
+            assert man.window_size() == window_size
+            c = man.make_cursor(fc.path)
+            oc = man.make_cursor(fc.path)
+
+            # windows are placed on the grid, regardless of the access history
+            assert c.use_region(window_size + 10, 100).is_valid()
+            assert c.region().ofs_begin() == window_size and c.region().size() == window_size
+            assert oc.use_region(window_size * 2 - 100, 200).is_valid()
+            assert oc.region() is c.region() and oc.size() == 100
+            assert oc.use_region(window_size * 2, 10).region().ofs_begin() == window_size * 2
+            assert man.num_file_handles() == 2
+            assert man._fdict[fc.path].region_at(window_size * 2) is oc.region()
+
+            # the last window is truncated to the file
+            assert c.use_region(fc.size - 1, 1).is_valid()
+            assert c.region().ofs_end() == fc.size and c.region().ofs_begin() % window_size == 0
+
+            # collected regions are dropped from the index
+            c.unuse_region()
+            oc.unuse_region()
+            assert man.collect() == 3
+            assert not man._fdict[fc.path]._index
+
+            for _ in range(1000):
+                ofs = randint(0, fc.size - 1)
+                assert c.use_region(ofs, 100).is_valid()
+                assert c.ofs_begin() == ofs and c.region().ofs_begin() == ofs - ofs % window_size
+                assert c.buffer()[:] == data[ofs:ofs + c.size()]
+                assert man.mapped_memory_size() <= man.max_mapped_memory_size()
+            # END for each access
+        # END with file
+
+    def test_overlap(self):
+        with FileCreator(self.k_window_test_size, "overlap_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(os.urandom(fc.size))
+            # END randomize data
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END read data
+            window_size = align_to_mmap(fc.size // 10, True)
+            overlap = 4096
+            self.assertRaises(ValueError, SlidingWindowMapManager, window_size=window_size, overlap=window_size)
+
+            record_size = 300
+            for man in (SlidingWindowMapManager(window_size=window_size),
+                        SlidingWindowMapManager(window_size=window_size, overlap=overlap)):
+                c = man.make_cursor(fc.path)
+                num_truncated = 0
+                for scan in range(2):
+                    for ofs in range(0, fc.size, record_size - 1):
+                        size = min(record_size, fc.size - ofs)
+                        assert c.use_region(ofs, size).is_valid()
+                        num_truncated += c.size() < size
+                        assert c.buffer()[:] == data[ofs:ofs + c.size()]
+                    # END for each record
+                    if scan == 0:
+                        num_maps = man.num_maps()
+                    # END remember maps of first scan
+                # END for each scan
+                # once all windows exist, scanning again doesn't map anything
+                assert man.num_maps() == num_maps
+
+                regions = man._fdict[fc.path]
+                assert [r.ofs_end() for r in regions] == sorted(r.ofs_end() for r in regions)
+                if man._overlap:
+                    assert num_truncated == 0
+                    for left, right in zip(regions, regions[1:]):
+                        assert left.ofs_end() - right.ofs_begin() >= overlap
+                    # END for each pair of neighbours
+
+                    # random small accesses always fit into a window, and a read within the margin
+                    # of the current window doesn't switch it
+                    for _ in range(1000):
+                        ofs = randint(0, fc.size - 1)
+                        size = min(randint(1, overlap), fc.size - ofs)
+                        assert c.use_region(ofs, size).size() == size
+                        assert c.buffer()[:] == data[ofs:ofs + size]
+                    # END for each access
+                    assert man.num_maps() == num_maps
+                else:
+                    assert num_truncated
+                # END handle overlap
+            # END for each manager
+
+            # buffers serve small slices crossing window boundaries from a single window
+            man = SlidingWindowMapManager(window_size=window_size, overlap=overlap)
+            buf = SlidingWindowMapBuffer(man.make_cursor(fc.path))
+            for boundary in range(window_size, fc.size, window_size):
+                assert buf[boundary - 100:boundary + 100] == data[boundary - 100:boundary + 100]
+            # END for each boundary
+            assert buf[window_size - 100:window_size + 100] == data[window_size - 100:window_size + 100]
+            num_maps = man.num_maps()
+            for boundary in range(window_size, fc.size, window_size):
+                assert buf[boundary - 100:boundary + 100] == data[boundary - 100:boundary + 100]
+            # END for each boundary
+            assert man.num_maps() == num_maps
+            buf.end_access()
+        # END with file
+
+    def test_multi_window_cursor(self):
+        with FileCreator(self.k_window_test_size, "multi_window_test") as fc:
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END read data
+            window_size = align_to_mmap(fc.size // 20, True)
+            man = SlidingWindowMapManager(window_size=window_size)
+            self.assertRaises(ValueError, man.make_cursor, (fc.path, fc.path), 2)
+            c = man.make_cursor(fc.path, num_windows=3)
+            assert isinstance(c, MultiWindowCursor)
+            assert type(SlidingWindowMapManager().make_cursor(fc.path)) is WindowCursor
+
+            # alternating between two distant ranges, like a delta and its base, maps each of them once
+            delta, base = fc.size - window_size // 2, window_size // 2
+            for i in range(100):
+                ofs = (i % 2 and delta or base) + i
+                assert c.use_region(ofs, 100).is_valid()
+                assert c.buffer()[:] == data[ofs:ofs + 100]
+                assert c.read_at(ofs + 1, 10) == data[ofs + 1:ofs + 11]
+            # END for each access
+            assert man.num_maps() == 2
+            assert len(c.active_regions()) == 2
+            assert all(r.client_count() == 2 for r in c.active_regions())
+
+            # when memory is tight, a plain cursor remaps its window on each switch, unlike ours
+            for num_windows, num_maps in ((1, 10), (2, 2)):
+                tight = SlidingWindowMapManager(window_size=window_size, max_memory_size=window_size)
+                tc = tight.make_cursor(fc.path, num_windows)
+                for i in range(10):
+                    assert tc.use_region(i % 2 and delta or base, 100).is_valid()
+                # END for each access
+                assert tight.num_maps() == num_maps
+                del(tc)
+            # END for each cursor type
+
+            # the least recently used window is evicted once all slots are taken
+            third = fc.size // 2
+            c.use_region(base, 10)
+            c.use_region(third, 10)
+            assert [r.includes_ofs(o) for r, o in zip(c.active_regions(), (third, base, delta))] == [True] * 3
+            c.use_region(third + window_size * 2, 10)
+            active = c.active_regions()
+            assert len(active) == 3 and not any(r.includes_ofs(delta) for r in active)
+            assert man.num_maps() == 4
+
+            # copies pin the same regions, unusing releases all of them
+            cc = copy(c)
+            assert all(r.client_count() == 3 for r in active)
+            cc.unuse_region()
+            c.unuse_region()
+            assert not c.is_valid() and c.active_regions() == []
+            assert all(r.client_count() == 1 for r in active)
+            assert man.collect() == 4
+        # END with file
+
+    def test_write(self):
+        with FileCreator(self.k_window_test_size, "write_test") as fc:
+            with open(fc.path, 'rb') as fp:
+                data = bytearray(fp.read())
+            # END read data
+            window_size = align_to_mmap(fc.size // 10, True)
+            for man in (StaticWindowMapManager(), SlidingWindowMapManager(window_size=window_size)):
+                self.assertRaises(ValueError, man.make_cursor, fc.path, access='append')
+                self.assertRaises(ValueError, man.make_cursor, (fc.path, fc.path), access='write')
+                rc = man.make_cursor(fc.path)
+                assert rc.use_region(0, 100).is_valid()
+                self.assertRaises(ValueError, rc.write_at, 0, b'x')
+
+                # writable cursors replace the read-only regions, and may cross windows
+                c = man.make_cursor(fc.path, access='write')
+                assert rc.region().is_stale()
+                ofs = window_size - 50
+                payload = os.urandom(100)
+                assert c.write_at(ofs, payload) == len(payload)
+                data[ofs:ofs + len(payload)] = payload
+                assert c.region().is_dirty() and not c.region().is_stale()
+                assert rc.read_at(ofs, 100) == payload
+
+                # flushing writes back all modified regions at once
+                assert c.flush() >= 1
+                assert not any(r.is_dirty() for r in man._fdict[fc.path])
+                assert c.flush() == 0
+                with open(fc.path, 'rb') as fp:
+                    assert fp.read() == data
+                # END check file
+
+                # modifications are flushed once regions are unmapped
+                c.write_at(10, b'hello')
+                data[10:15] = b'hello'
+                assert man.flush(fc.path) == 1 and man.flush() == 0
+                c.write_at(20, b'world')
+                data[20:25] = b'world'
+                c.unuse_region()
+                rc.unuse_region()
+                assert man.collect()
+                with open(fc.path, 'rb') as fp:
+                    assert fp.read() == data
+                # END check file
+
+                # files grow as needed
+                tail = os.urandom(5000)
+                ofs = len(data) - 1000
+                assert c.write_at(ofs, tail) == len(tail)
+                data[ofs:] = tail
+                assert c.file_size() == len(data) == os.path.getsize(fc.path)
+                assert c.read_at(ofs, len(tail)) == tail
+                c.flush()
+                with open(fc.path, 'rb') as fp:
+                    assert fp.read() == data
+                # END check file
+
+                # copy-on-write mappings keep their modifications private, and can't be shared with live
+                # cursors of other modes, even if they have no mapped regions
+                self.assertRaises(ValueError, man.make_cursor, fc.path, access='copy')
+                c.unuse_region()
+                rc.unuse_region()
+                man.collect()
+                assert not man._fdict[fc.path]
+                self.assertRaises(ValueError, man.make_cursor, fc.path, access='copy')
+                del(c)
+                self.assertRaises(ValueError, man.make_cursor, fc.path, access='copy')
+                del(rc)
+                cc = man.make_cursor(fc.path, access='copy')
+                assert cc.write_at(0, b'private') == 7
+                assert cc.read_at(0, 7) == b'private'
+                self.assertRaises(ValueError, cc.write_at, len(data), b'x')
+                self.assertRaises(ValueError, man.make_cursor, fc.path, access='write')
+                self.assertRaises(ValueError, man.make_cursor, fc.path)
+                self.assertRaises(ValueError, man.make_cursor, (fc.path, fc.path))
+                assert cc.flush() == 0 and man.flush() == 0
+                cc.unuse_region()
+                man.collect()
+                man.reap(0, 0)
+                assert cc.read_at(0, 7) == b'private'
+                with open(fc.path, 'rb') as fp:
+                    assert fp.read() == data
+                # END check file
+
+                # private modifications are dropped with the last copy-on-write cursor
+                ccc = copy(cc)
+                cc.unuse_region()
+                del(cc)
+                assert ccc.read_at(0, 7) == b'private'
+                ccc.unuse_region()
+                assert man.num_file_handles() == 1
+                del(ccc)
+                assert man.num_file_handles() == 0 and fc.path not in man._fdict
+
+                # restore the original size for the next manager
+                with open(fc.path, 'r+b') as fp:
+                    fp.truncate(fc.size)
+                # END truncate file
+                del(data[fc.size:])
+            # END for each manager type
+        # END with file
+
+    def test_hybrid(self):
+        with FileCreator(self.k_window_test_size, "hybrid_large") as lfc:
+            window_size = align_to_mmap(lfc.size // 10, True)
+            with FileCreator(window_size + 5000, "hybrid_small") as sfc:
+                assert HybridWindowMapManager(window_size=window_size).whole_file_size() == window_size
+                man = HybridWindowMapManager(window_size=window_size, max_memory_size=window_size * 4,
+                                             whole_file_size=window_size * 2)
+                assert man.whole_file_size() == window_size * 2
+                sc = man.make_cursor(sfc.path)
+                lc = man.make_cursor(lfc.path)
+
+                # small files are mapped as a whole, even for accesses crossing window boundaries
+                assert sc.use_region(window_size - 50, 100).is_valid()
+                assert sc.region().ofs_begin() == 0 and sc.region().size() == sfc.size
+                assert sc.size() == 100
+                assert sc.use_region(sfc.size - 10, 10).region().size() == sfc.size
+                assert len(man._fdict[sfc.path]) == 1
+
+                # large files slide
+                assert lc.use_region(window_size * 5, 100).is_valid()
+                assert lc.region().ofs_begin() > 0 and lc.region().size() < window_size * 2
+                with open(lfc.path, 'rb') as fp:
+                    fp.seek(window_size * 5)
+                    assert lc.buffer()[:] == fp.read(100)
+                # END check data
+
+                # both share the memory budget and the queue of least recently used regions
+                sc.unuse_region()
+                for i in range(4):
+                    assert lc.use_region(window_size * i, 1).is_valid()
+                    assert man.mapped_memory_size() <= man.max_mapped_memory_size()
+                # END for each window
+                assert not man._fdict[sfc.path]
+                assert sc.use_region(0, 1).region().size() == sfc.size
+                assert man.mapped_memory_size() <= man.max_mapped_memory_size()
+            # END with small file
+        # END with large file
+
+    def test_pread(self):
+        with FileCreator(self.k_window_test_size, "pread_test") as fc:
+            with open(fc.path, 'rb') as fp:
+                data = bytearray(fp.read())
+            # END read data
+            window_size = align_to_mmap(fc.size // 10, True)
+            man = SlidingWindowMapManager(window_size=window_size, max_memory_size=window_size * 3)
+            self.assertRaises(ValueError, man.make_cursor, fc.path, backend='aio')
+            self.assertRaises(ValueError, man.set_backend, 'aio')
+
+            # the backend is chosen per file
+            c = man.make_cursor(fc.path, backend='pread')
+            assert man._fdict[fc.path].backend() == 'pread'
+            assert type(c.use_region(window_size - 10, 100).region()) is PreadRegion
+            assert c.buffer()[:] == data[window_size - 10:window_size - 10 + c.size()]
+            for _ in range(100):
+                ofs = randint(0, fc.size - 1)
+                assert c.read_at(ofs, 1000) == data[ofs:ofs + 1000]
+                # regions are accounted for like mapped ones, which may exceed the limit by some alignment
+                assert man.mapped_memory_size() <= man.max_mapped_memory_size() + window_size
+            # END for each access
+
+            # cursors without a preference use the file's backend
+            oc = man.make_cursor(fc.path)
+            assert type(oc.use_region(0, 10).region()) is PreadRegion
+
+            # switching the backend replaces all regions
+            rc = man.make_cursor(fc.path, backend='mmap')
+            assert oc.region().is_stale()
+            assert type(rc.use_region(0, 10).region()) is MapRegion
+            del(c)
+            del(oc)
+            del(rc)
+
+            # modifications are written back with pwrite
+            wc = man.make_cursor(fc.path, access='write', backend='pread')
+            assert wc.write_at(window_size - 5, b'0123456789') == 10
+            data[window_size - 5:window_size + 5] = b'0123456789'
+            assert wc.flush() >= 1
+            wc.unuse_region()
+            man.collect()
+            with open(fc.path, 'rb') as fp:
+                assert fp.read() == data
+            # END check file
+            del(wc)
+            man.collect()
+
+            # truncating the file doesn't affect the bytes we read already
+            man.set_backend('pread')
+            with open(fc.path, 'rb') as fp:
+                fd = os.dup(fp.fileno())
+            # END get descriptor
+            try:
+                c = man.make_cursor(fd)
+                assert man.set_backend('mmap') == 'pread'
+                assert type(c.use_region(fc.size - 100, 100).region()) is PreadRegion
+                with open(fc.path, 'r+b') as fp:
+                    fp.truncate(fc.size - 1000)
+                # END truncate file
+                assert c.buffer()[:] == data[fc.size - 100:]
+                c.unuse_region()
+                man.collect()
+            finally:
+                os.close(fd)
+            # END close descriptor
+        # END with file
+
+    def test_blocks(self):
+        with FileCreator(self.k_window_test_size, "blocks_test") as fc, FileCreator(1, "blocks_zlib_test") as zfc:
+            raw = os.urandom(1000) * (fc.size // 4000)
+            zdata = zlib.compress(raw)
+            with open(zfc.path, 'wb') as fp:
+                fp.write(zdata)
+            # END write compressed data
+            window_size = align_to_mmap(fc.size // 10, True)
+            man = SlidingWindowMapManager(window_size=window_size, max_memory_size=len(raw) + window_size * 2)
+            zc = man.make_cursor(zfc.path)
+            c = man.make_cursor(fc.path)
+            calls = list()
+
+            def inflate():
+                calls.append(1)
+                return zlib.decompress(zc.read_at(0, len(zdata)))
+
+            # blocks are computed once, and handed out from the cache afterwards
+            st = time()
+            block = man.get_or_compute(zfc.path, 0, inflate)
+            elapsed = time() - st
+            assert block == raw and len(calls) == 1
+            st = time()
+            for _ in range(100):
+                assert man.get_or_compute(zfc.path, 0, inflate) is block
+            # END for each lookup
+            print("Inflated %i bytes in %f s, 100 cached lookups took %f s" % (len(raw), elapsed, time() - st),
+                  file=sys.stderr)
+            assert len(calls) == 1
+            assert man.num_blocks() == 1 and man.block_memory_size() == len(raw)
+            assert man.get_or_compute(fc.path, 0, lambda: b'x', kind='other') == b'x'
+            assert man.get_or_compute(fc.path, 1, lambda: b'y') == b'y'
+            assert man.num_blocks() == 3
+
+            # all paths and descriptors of a file share its blocks
+            with open(zfc.path, 'rb') as fp:
+                assert man.get_or_compute(fp.fileno(), 0, inflate) is block
+            # END with descriptor
+            assert len(calls) == 1
+
+            # blocks share the memory budget with mapped regions. Idle regions go first
+            zc.unuse_region()
+            assert c.use_region(0, 1).is_valid() and c.use_region(window_size * 2, 1).is_valid()
+            c.unuse_region()
+            num_handles = man.num_file_handles()
+            assert num_handles
+            assert man.get_or_compute(fc.path, 2, lambda: b'z' * window_size) == b'z' * window_size
+            assert man.num_file_handles() < num_handles and man.num_blocks() == 4
+            # then the least recently used blocks
+            assert c.use_region(window_size * 4, 1).is_valid() and c.use_region(0, 1).is_valid()
+            assert man.num_blocks() < 4
+            assert man.mapped_memory_size() + man.block_memory_size() <= man.max_mapped_memory_size() + window_size
+
+            # reaping only looks at mapped regions
+            c.unuse_region()
+            assert man.num_blocks() and c.use_region(0, 1).is_valid()
+            c.unuse_region()
+            assert man.reap(3600, man.mapped_memory_size()) == 0 and man.num_file_handles()
+            assert man.reap(3600, 0) and not man.num_file_handles()
+
+            # blocks exceeding the budget aren't cached
+            man.get_or_compute(fc.path, 3, lambda: b'0' * (man.max_mapped_memory_size() + 1))
+            assert man.block_memory_size() <= man.max_mapped_memory_size()
+
+            # files are only checked for changes as often as their windows are
+            def rewrite(content):
+                tmp = zfc.path + '.new'
+                with open(tmp, 'wb') as fp:
+                    fp.write(content)
+                # END write replacement
+                os.rename(tmp, zfc.path)
+
+            assert man.get_or_compute(zfc.path, 0, lambda: b'old', kind='rewrite') == b'old'
+            rewrite(b'changed')
+            assert man.get_or_compute(zfc.path, 0, lambda: b'new', kind='rewrite') == b'old'
+            vman = SlidingWindowMapManager(window_size=window_size, validate_interval=0)
+            for kind, cursor in (('untracked', None), ('tracked', vman.make_cursor(zfc.path))):
+                assert vman.get_or_compute(zfc.path, 0, lambda: b'old', kind=kind) == b'old'
+                rewrite(b'changed ' + kind.encode('ascii'))
+                assert vman.get_or_compute(zfc.path, 0, lambda: b'new', kind=kind) == b'new'
+            # END for each tracked state
+            del(cursor)
+        # END with file
+
+    def test_populate(self):
+        try:
+            import resource
+        except ImportError:
+            return
+        # END skip on systems without rusage
+
+        class ThreadedManager(StaticWindowMapManager):
+            __slots__ = tuple()
+            _prefault_threaded = True
+
+        def faults():
+            return resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+
+        with FileCreator(self.k_window_test_size, "populate_test") as fc:
+            page_size = 4096
+            results = dict()
+            for name, man in (('lazy', StaticWindowMapManager()),
+                              ('populated', StaticWindowMapManager(populate_size=fc.size)),
+                              ('threaded', ThreadedManager(populate_size=fc.size))):
+                c = man.make_cursor(fc.path).use_region()
+                assert c.is_valid() and c.size() == fc.size
+                if man._prefault_queue is not None:
+                    man._prefault_queue.join()
+                # END wait for prefault thread
+                assert (man._prefault_queue is not None) == (name == 'threaded')
+
+                mf = c.map()
+                num_faults = faults()
+                st = time()
+                for ofs in range(0, fc.size, page_size):
+                    mf[ofs]
+                # END for each page
+                elapsed = time() - st
+                results[name] = faults() - num_faults
+                print("%s: read %i pages with %i faults in %f s" % (name, fc.size // page_size, results[name], elapsed),
+                      file=sys.stderr)
+                c.unuse_region()
+                man.collect()
+            # END for each manager
+            assert results['populated'] < results['lazy']
+            assert results['threaded'] < results['lazy']
+
+            # windows larger than the populate size stay lazy
+            man = StaticWindowMapManager(populate_size=fc.size - 1)
+            c = man.make_cursor(fc.path).use_region()
+            mf = c.map()
+            num_faults = faults()
+            for ofs in range(0, fc.size, page_size):
+                mf[ofs]
+            # END for each page
+            assert faults() - num_faults > results['populated']
+            assert man._prefault_queue is None
+
+            # descriptors are read through a copy of our own, which the prefault thread closes again
+            fd = os.open(fc.path, os.O_RDONLY)
+            try:
+                man = ThreadedManager(populate_size=fc.size)
+                num_fds = os.path.isdir('/proc/self/fd') and len(os.listdir('/proc/self/fd'))
+                c = man.make_cursor(fd).use_region()
+                man._prefault_queue.join()
+                assert c.is_valid() and c.size() == fc.size
+                c.unuse_region()
+                assert man.collect() == 1
+                assert not num_fds or len(os.listdir('/proc/self/fd')) == num_fds
+            finally:
+                os.close(fd)
+            # END handle fd
+        # END with file
@@ -0,0 +1,141 @@
+from .lib import TestBase, FileCreator
+
+from smmap.mman import SlidingWindowMapManager
+from smmap.stream import SlidingWindowMapStream
+
+import io
+import zlib
+
+
+class TestStream(TestBase):
+
+    def test_basics(self):
+        with FileCreator(self.k_window_test_size, "stream_test") as fc:
+            lines = [("line %i\n" % i).encode('ascii') * (i % 7 + 1) for i in range(200000)]
+            data = bytes().join(lines)[:fc.size]
+            with open(fc.path, 'wb') as fp:
+                fp.write(data)
+            # END prepare data
+
+            man = SlidingWindowMapManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+            self.assertRaises(ValueError, SlidingWindowMapStream, None)
+            self.assertRaises(ValueError, SlidingWindowMapStream, man.make_cursor(fc.path), fc.size + 1)
+
+            stream = SlidingWindowMapStream(man.make_cursor(fc.path))
+            assert stream.readable() and stream.seekable() and not stream.writable()
+
+            # reads cross windows transparently
+            ws = man.window_size()
+            assert stream.read(10) == data[:10]
+            assert stream.seek(ws - 5) == ws - 5
+            assert stream.read(10) == data[ws - 5:ws + 5]
+            assert stream.tell() == ws + 5
+            b = bytearray(ws * 2)
+            assert stream.readinto(b) == len(b)
+            assert bytes(b) == data[ws + 5:ws * 3 + 5]
+
+            # peek doesn't advance
+            pos = stream.tell()
+            assert stream.peek(5) == data[pos:pos + 5]
+            assert stream.peek(0) == data[pos:pos + 1]
+            assert stream.tell() == pos
+
+            # seeking
+            assert stream.seek(-10, io.SEEK_END) == fc.size - 10
+            assert stream.read() == data[-10:]
+            assert stream.read(10) == b''
+            assert stream.peek() == b''
+            assert stream.seek(-10, io.SEEK_CUR) == fc.size - 10
+            self.assertRaises(ValueError, stream.seek, -1)
+
+            # lines, also across windows
+            stream.seek(0)
+            fp = io.BytesIO(data)
+            for line in stream:
+                assert line == fp.readline()
+                if stream.tell() > ws * 2:
+                    break
+                # END stop after crossing windows
+            # END for each line
+            assert stream.tell() == fp.tell()
+            stream.seek(ws - 3)
+            fp.seek(ws - 3)
+            assert stream.readline(2) == fp.readline(2)
+            assert stream.readline() == fp.readline()
+
+            # ranges of the file, with buffered streams
+            stream.close()
+            assert stream.closed
+            self.assertRaises(ValueError, stream.read)
+            stream = io.BufferedReader(SlidingWindowMapStream(man.make_cursor(fc.path), 100, ws * 2))
+            assert stream.read() == data[100:ws * 2 + 100]
+            stream.close()
+
+            # consumers using the file interface
+            zfc = FileCreator(1, "stream_zlib_test")
+            with open(zfc.path, 'wb') as fp:
+                fp.write(zlib.compress(data))
+            # END write compressed data
+            man.collect()
+            with SlidingWindowMapStream(man.make_cursor(zfc.path)) as stream:
+                d = zlib.decompressobj()
+                out = list()
+                while True:
+                    chunk = stream.read(64 * 1024)
+                    if not chunk:
+                        break
+                    out.append(d.decompress(chunk))
+                # END while there is data
+                assert bytes().join(out) == data
+            # END with stream
+            # closing the stream released its window
+            assert man.collect() == 1
+            del(zfc)
+        # END with file
+
+    def test_scan(self):
+        with FileCreator(self.k_window_test_size, "stream_scan_test") as fc:
+            data = bytes().join(("line %i\n" % i).encode('ascii') for i in range(fc.size // 6))[:fc.size]
+            with open(fc.path, 'wb') as fp:
+                fp.write(data)
+            # END prepare data
+            man = SlidingWindowMapManager(window_size=fc.size // 10)
+            ws = man.window_size()
+
+            # windows are unmapped as soon as we read past them
+            with SlidingWindowMapStream(man.make_cursor(fc.path), scan=True) as stream:
+                assert not stream.is_direct()
+                assert stream.read(ws // 2) == data[:ws // 2]
+                assert man.num_file_handles() == 1
+                assert stream.read(ws) == data[ws // 2:ws // 2 + ws]
+                assert man.num_file_handles() == 1
+                assert stream.read() == data[ws // 2 + ws:]
+                assert man.num_file_handles() == 0
+            # END with stream
+
+            # windows used by other cursors stay mapped
+            c = man.make_cursor(fc.path).use_region(ws // 2, 1)
+            assert c.is_valid()
+            with SlidingWindowMapStream(man.make_cursor(fc.path), scan=True) as stream:
+                assert stream.read(ws * 2) == data[:ws * 2]
+            # END with stream
+            assert man.num_file_handles() == 1 and c.region().client_count() == 2
+            assert c.discard_region() and man.num_file_handles() == 0
+            assert not c.discard_region()
+
+            self.assertRaises(ValueError, SlidingWindowMapStream, man.make_cursor((fc.path, fc.path)), direct=True)
+
+            # direct reads don't map anything, and support the whole stream interface
+            num_maps = man.num_maps()
+            with SlidingWindowMapStream(man.make_cursor(fc.path), 10, direct=True) as stream:
+                assert stream.read(5) == data[10:15]
+                assert stream.readline() == data[15:data.index(b'\n', 15) + 1]
+                stream.seek(SlidingWindowMapStream.direct_chunk_size - 3)
+                pos = stream.tell() + 10
+                assert stream.read(6) == data[pos:pos + 6]
+                assert stream.peek(3) == data[pos + 6:pos + 9]
+                stream.seek(0)
+                assert stream.read() == data[10:]
+                assert man.num_maps() == num_maps and man.num_file_handles() == 0
+            # END with stream
+        # END with file
@@ -0,0 +1,100 @@
+from .lib import TestBase, FileCreator
+
+from smmap.mman import SlidingWindowMapManager, StaticWindowMapManager
+from smmap.table import SortedTableReader
+
+import os
+import struct
+from random import randint
+
+
+class TestTable(TestBase):
+
+    def test_index(self):
+        # a table of sha1s with fan-out, like git pack index files (version 2)
+        num_records = 50000
+        shas = sorted(set(os.urandom(20) for _ in range(num_records)))
+        indices = dict((sha, i) for i, sha in enumerate(shas))
+        fanout = [0] * 256
+        for sha in shas:
+            fanout[bytearray(sha)[0]] += 1
+        # END for each sha
+        for i in range(1, 256):
+            fanout[i] += fanout[i - 1]
+        # END accumulate fan-out
+        header = b'\xfftOc' + struct.pack('>L', 2)
+        fanout_offset = len(header)
+        table_offset = fanout_offset + 256 * 4
+
+        with FileCreator(1, "table_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(header + struct.pack('>256L', *fanout) + bytes().join(shas))
+            # END write index
+
+            for man in (StaticWindowMapManager(),
+                        SlidingWindowMapManager(window_size=len(shas) * 20 // 50, max_memory_size=len(shas) * 10)):
+                self.assertRaises(ValueError, SortedTableReader, man.make_cursor(fc.path), table_offset, 20)
+                self.assertRaises(ValueError, SortedTableReader, man.make_cursor(fc.path), table_offset, 20,
+                                  count=len(shas) + 1)
+
+                for table in (SortedTableReader(man.make_cursor(fc.path), table_offset, 20,
+                                                fanout_offset=fanout_offset),
+                              SortedTableReader(man.make_cursor(fc.path), table_offset, 20, count=len(shas))):
+                    assert len(table) == len(shas)
+                    assert table.cursor().is_associated()
+                    assert table.record(0) == table.key(0) == shas[0]
+                    self.assertRaises(IndexError, table.record, len(shas))
+                    self.assertRaises(IndexError, table.key, -1)
+
+                    # single lookups
+                    for _ in range(500):
+                        i = randint(0, len(shas) - 1)
+                        assert table.find(shas[i]) == i
+                        # abbreviated keys
+                        assert table.key(table.find(shas[i][:8]))[:8] == shas[i][:8]
+                    # END for each lookup
+                    # empty keys are a prefix of all keys
+                    assert table.find(b'') == 0
+                    assert table.find(shas[-1]) == len(shas) - 1
+                    missing = [sha for sha in (os.urandom(20) for _ in range(100)) if sha not in indices]
+                    for sha in missing:
+                        assert table.find(sha) is None
+                    # END for each missing sha
+                    assert table.find(b'\xff' * 20) is None
+                    assert table.find(b'\0' * 20) is None
+
+                    # batched lookups preserve the order of keys
+                    keys = [shas[randint(0, len(shas) - 1)] for _ in range(1000)] + missing
+                    expected = [indices.get(k) for k in keys]
+                    assert table.find_many(keys) == expected
+
+                    # range scans
+                    lo, hi = sorted((shas[randint(0, len(shas) - 1)], shas[randint(0, len(shas) - 1)]))
+                    r = table.find_range(lo, hi)
+                    assert [table.key(i) for i in r] == [sha for sha in shas if lo <= sha < hi]
+                    assert len(table.find_range()) == len(shas)
+                    assert not len(table.find_range(hi, lo))
+                    assert [table.key(i) for i in table.find_range(None, shas[10])] == shas[:10]
+                    assert [table.key(i) for i in table.find_range(b'', shas[10])] == shas[:10]
+                    assert len(table.find_range(b'\x80')) == len([sha for sha in shas if sha >= b'\x80'])
+                # END for each table
+                man.collect()
+            # END for each manager
+        # END with file
+
+    def test_records(self):
+        # records with keys in their middle, and without fan-out
+        records = sorted((struct.pack('>HQH', randint(0, 1000), i * 7, 0) for i in range(5000)),
+                         key=lambda r: r[2:10])
+        with FileCreator(1, "table_records_test") as fc:
+            with open(fc.path, 'wb') as fp:
+                fp.write(b'head' + bytes().join(records))
+            # END write table
+            man = SlidingWindowMapManager(window_size=12 * 100, max_memory_size=12 * 1000)
+            table = SortedTableReader(man.make_cursor(fc.path), 4, 12, count=len(records), key_offset=2, key_size=8)
+            for i in range(0, len(records), 37):
+                assert table.find(struct.pack('>Q', i * 7)) == i
+                assert table.find(struct.pack('>Q', i * 7 + 1)) is None
+                assert table.record(i) == records[i]
+            # END for each record
+        # END with file
@@ -0,0 +1,72 @@
+from .lib import TestBase, FileCreator
+
+from smmap.mman import SlidingWindowMapManager, StaticWindowMapManager, GridWindowMapManager
+from smmap.trace import AccessTracer, read_trace, replay, main
+
+from random import randint
+import os
+
+
+class TestTrace(TestBase):
+
+    def test_record_and_replay(self):
+        with FileCreator(self.k_window_test_size, "trace_test") as fc:
+            with FileCreator(1, "trace_log") as log, FileCreator(fc.size, "trace_other") as other:
+                man = SlidingWindowMapManager(window_size=fc.size // 10, max_memory_size=fc.size // 3)
+                assert man.set_tracer(AccessTracer(log.path)) is None
+                fd = os.open(other.path, os.O_RDONLY)
+                try:
+                    offsets = [randint(0, fc.size - 1) for _ in range(1000)]
+                    cursors = [man.make_cursor(item) for item in (fc.path, fd)]
+                    for ofs in offsets:
+                        for c in cursors:
+                            assert c.use_region(ofs, 100).is_valid()
+                        # END for each cursor
+                    # END for each access
+                finally:
+                    os.close(fd)
+                # END close fd
+                assert not c.use_region(fc.size).is_valid()   # invalid accesses are not recorded
+                tracer = man.set_tracer(None)
+                tracer.close()
+
+                accesses = list(read_trace(log.path))
+                assert len(accesses) == len(offsets) * 2
+                assert set(a[0] for a in accesses) == set((fc.path, "fd:%i" % fd))
+                assert all(a[1] == fc.size for a in accesses)
+                assert [a[2] for a in accesses[::2]] == offsets
+                assert accesses[0][4] is False
+                recorded_misses = len([a for a in accesses if not a[4]])
+                assert recorded_misses == man.num_maps()
+
+                # replaying the same configuration yields the same results
+                stats = replay(log.path, SlidingWindowMapManager, window_size=fc.size // 10,
+                               max_memory_size=fc.size // 3)
+                assert stats['accesses'] == len(accesses)
+                assert stats['recorded_hits'] == len(accesses) - recorded_misses
+                assert stats['misses'] == stats['num_maps'] == recorded_misses
+                assert stats['hits'] + stats['misses'] == stats['accesses']
+                assert stats['num_collected'] > 0
+                assert stats['peak_memory_size'] <= fc.size // 3 * 2
+                assert stats['latency'] > 0
+
+                # a larger budget requires fewer maps
+                large_stats = replay(log.path, SlidingWindowMapManager, window_size=fc.size // 10,
+                                     max_memory_size=fc.size * 4)
+                assert large_stats['num_maps'] < stats['num_maps']
+                assert large_stats['num_collected'] == 0
+                assert large_stats['latency'] < stats['latency']
+
+                # whole files are mapped once
+                static_stats = replay(log.path, StaticWindowMapManager)
+                assert static_stats['num_maps'] == 2
+                assert static_stats['peak_memory_size'] == fc.size * 2
+
+                # grid windows are simulated as well
+                grid_stats = replay(log.path, GridWindowMapManager, window_size=fc.size // 10)
+                assert grid_stats['num_maps'] == grid_stats['misses'] <= 2 * 11
+
+                assert main([log.path, '--window-size', str(fc.size // 10)]) == 0
+                assert main([log.path, '--manager', 'GridWindowMapManager', '--window-size', str(fc.size // 10)]) == 0
+            # END with log
+        # END with file
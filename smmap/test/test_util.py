@@ -4,9 +4,11 @@ from smmap.util import (
     MapWindow,
     MapRegion,
     MapRegionList,
+    LatencyHistogram,
     ALLOCATIONGRANULARITY,
     is_64_bit,
-    align_to_mmap
+    align_to_mmap,
+    read_pages
 )
 
 import os
@@ -103,3 +105,53 @@ class TestMMan(TestBase):
         assert isinstance(is_64_bit(), bool)    # just call it
         assert align_to_mmap(1, False) == 0
         assert align_to_mmap(1, True) == ALLOCATIONGRANULARITY
+
+    def test_read_pages(self):
+        if not hasattr(os, 'pread'):
+            return
+        # END skip unsupported systems
+        with FileCreator(self.k_window_test_size, "read_pages_test") as fc:
+            with open(fc.path, 'rb') as fp:
+                data = fp.read()
+            # END read data
+            fd = os.open(fc.path, os.O_RDONLY)
+            try:
+                # the scratch buffer is reused for every chunk, and holds the last one
+                scratch = bytearray(1000)
+                assert read_pages(fd, 10, 2500, scratch) == 2500
+                assert scratch[:500] == data[2010:2510]
+                assert read_pages(fd, fc.size - 10, 100, scratch) == 10
+                assert read_pages(fd, fc.size, 100, scratch) == 0
+            finally:
+                os.close(fd)
+
+    def test_latency_histogram(self):
+        h = LatencyHistogram()
+        assert h.count() == 0 and h.mean() == 0 and h.max() == 0
+        assert h.percentile(99) == 0
+
+        for us in range(1, 1001):
+            h.record(us * 1e-6)
+        # END for each value
+        h.record(10.0)
+        assert h.count() == 1001
+        assert h.max() == 10.0
+        assert 0.0104 < h.mean() < 0.0105
+        # percentiles are exact to 12.5 percent
+        for p, value in ((50, 500e-6), (90, 900e-6), (99, 990e-6)):
+            assert value <= h.percentile(p) <= value * 1.125
+        # END for each percentile
+        assert h.percentile(100) == 10.0
+        assert sorted(h.percentiles()) == [50, 90, 99, 99.9]
+        assert repr(h).startswith("LatencyHistogram")
+
+        # the bucket boundaries are consistent
+        for ns in (0, 1, 15, 16, 17, 100, 12345, 10 ** 9, 2 ** 63):
+            index = h._bucket(ns)
+            assert h._bucket_end(index) > ns
+            assert index == 0 or h._bucket_end(index - 1) <= ns
+        # END for each value
+        assert h._bucket(2 ** 64 - 1) < h._num_buckets
+
+        h.reset()
+        assert h.count() == 0
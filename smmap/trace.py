@@ -0,0 +1,232 @@
+"""Module to record the region accesses of a memory manager, and to replay them against differently
+configured managers to tune their window size, memory limit and collection behaviour offline.
+
+Traces are recorded with an AccessTracer::
+
+    tracer = AccessTracer('/tmp/smmap.trace')
+    mman.set_tracer(tracer)
+    ...
+    mman.set_tracer(None)
+    tracer.close()
+
+and replayed using replay(), or from the command line::
+
+    python -m smmap.trace /tmp/smmap.trace --window-size 1048576 --max-memory-size 67108864
+"""
+import os
+import sys
+import time
+import struct
+
+from .util import MapRegion, MapRegionList, string_types
+
+__all__ = ["AccessTracer", "read_trace", "replay"]
+
+#{ Trace Format
+
+# Each record starts with a single byte identifying its type.
+# A file record assigns an id to a file key, and is written before its first access
+_file_record = struct.Struct('<cIQH')          # b'F', file id, file size, length of the utf-8 name following
+# An access record is written for each use_region() call
+_access_record = struct.Struct('<cIQQ?d')       # b'A', file id, offset, size, hit, timestamp
+
+#} END trace format
+
+
+class AccessTracer(object):
+
+    """Records region accesses of a memory manager into a compact binary log.
+    Set it on a manager using set_tracer(), and close it once you are done."""
+    __slots__ = (
+        '_fp',          # file we write to
+        '_ids',         # mapping of path_or_fd -> file id
+    )
+
+    def __init__(self, path, buffer_size=1024 * 1024):
+        """Initialize the instance to write to the file at the given path, which is truncated"""
+        self._fp = open(path, 'wb', buffer_size)
+        self._ids = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #{ Interface
+
+    def record(self, path_or_fd, file_size, offset, size, hit):
+        """Record a single access. Called by WindowCursor.use_region() of managers we are set on
+        :param hit: True if no new region had to be mapped for the access"""
+        fid = self._ids.get(path_or_fd)
+        if fid is None:
+            fid = len(self._ids)
+            self._ids[path_or_fd] = fid
+            if isinstance(path_or_fd, string_types()):
+                name = path_or_fd
+            else:
+                name = "fd:%i" % path_or_fd
+            # END handle file descriptors
+            name = name.encode('utf-8')
+            self._fp.write(_file_record.pack(b'F', fid, file_size, len(name)) + name)
+        # END write file record
+        self._fp.write(_access_record.pack(b'A', fid, offset, size, hit, time.time()))
+
+    def close(self):
+        """Flush all records and close our file"""
+        self._fp.close()
+
+    #} END interface
+
+
+def read_trace(path):
+    """:return: generator of (name, file_size, offset, size, hit, timestamp) tuples, one for each access
+        recorded in the trace at the given path"""
+    files = dict()
+    with open(path, 'rb') as fp:
+        while True:
+            kind = fp.read(1)
+            if not kind:
+                break
+            elif kind == b'F':
+                _, fid, file_size, name_len = _file_record.unpack(kind + fp.read(_file_record.size - 1))
+                files[fid] = (fp.read(name_len).decode('utf-8'), file_size)
+            elif kind == b'A':
+                _, fid, offset, size, hit, ts = _access_record.unpack(kind + fp.read(_access_record.size - 1))
+                name, file_size = files[fid]
+                yield name, file_size, offset, size, hit, ts
+            else:
+                raise ValueError("Invalid record type %r in trace %s" % (kind, path))
+            # END handle record type
+        # END while there are records
+    # END with file
+
+
+#{ Simulation
+
+class _SimulatedFile(object):
+
+    """Key for a file which exists only in a trace"""
+    __slots__ = ('name', 'size')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+class _SimulatedRegion(MapRegion):
+
+    """A region which doesn't map anything, but otherwise behaves like a real one"""
+    __slots__ = tuple()
+
+    def __init__(self, path_or_fd, ofs, size, flags=0, access=None, populate=False):
+        self._b = ofs
+        self._mf = None
+        self._uc = 0
+        self._hc = 0
+        self._stale = False
+        self._dirty = None
+        self._size = max(0, min(path_or_fd.size - ofs, size))
+        self.increment_client_count()
+
+    def resident_size(self):
+        return self._size
+
+    def release(self):
+        pass
+
+
+class _SimulatedRegionList(MapRegionList):
+
+    """A region list for simulated files"""
+    __slots__ = tuple()
+
+    def file_size(self):
+        return self._path_or_fd.size
+
+    def identity(self):
+        return None
+
+#} END simulation
+
+
+def replay(path, manager_type, hit_cost=2e-7, map_cost=5e-5, byte_cost=2.5e-10, **kwargs):
+    """Replay a trace against a manager of the given type, configured with the given keyword arguments.
+    Nothing gets actually mapped, which allows to try configurations which wouldn't fit into memory.
+
+    Each file of the trace is accessed through a single cursor. The simulated latency of the replay
+    is computed from the costs of accesses served by existing regions, and of creating new regions.
+
+    :param manager_type: the type of manager to replay with, like SlidingWindowMapManager
+    :param hit_cost: simulated seconds an access costs if no new region had to be mapped
+    :param map_cost: simulated seconds it costs to create a new region
+    :param byte_cost: simulated seconds each byte of a newly mapped region costs
+    :param kwargs: keyword arguments to initialize the manager with
+    :return: dict with the amount of 'accesses', 'hits' and 'misses' of the replay, the amount of
+        'recorded_hits' in the trace, the amount of regions mapped ('num_maps') and collected
+        ('num_collected'), the 'peak_memory_size' in bytes, the 'peak_handle_count', and the simulated
+        'latency' in seconds"""
+    list_type = type('Simulated' + manager_type.MapRegionListCls.__name__,
+                     (_SimulatedRegionList, manager_type.MapRegionListCls), dict(__slots__=tuple()))
+    sim_type = type('Simulated' + manager_type.__name__, (manager_type, ),
+                    dict(__slots__=tuple(), MapRegionCls=_SimulatedRegion, MapRegionListCls=list_type))
+    man = sim_type(**kwargs)
+    cursors = dict()
+    stats = dict(accesses=0, hits=0, misses=0, recorded_hits=0, num_maps=0, num_collected=0,
+                 peak_memory_size=0, peak_handle_count=0, latency=0.0)
+
+    for name, file_size, offset, size, hit, _ in read_trace(path):
+        c = cursors.get(name)
+        if c is None:
+            c = cursors[name] = man.make_cursor(_SimulatedFile(name, file_size))
+        # END create cursor
+        num_maps = man.num_maps()
+        memory_size = man.mapped_memory_size()
+        num_handles = man.num_file_handles()
+        c.use_region(offset, size)
+
+        stats['accesses'] += 1
+        stats['recorded_hits'] += hit
+        mapped = man.num_maps() - num_maps
+        if mapped:
+            stats['misses'] += 1
+            stats['num_maps'] += mapped
+            mapped_bytes = c.region().size()
+            stats['num_collected'] += num_handles + mapped - man.num_file_handles()
+            stats['latency'] += map_cost * mapped + byte_cost * mapped_bytes
+        else:
+            stats['hits'] += 1
+            stats['latency'] += hit_cost
+        # END handle hit
+        stats['peak_memory_size'] = max(stats['peak_memory_size'], memory_size, man.mapped_memory_size())
+        stats['peak_handle_count'] = max(stats['peak_handle_count'], man.num_file_handles())
+    # END for each access
+    return stats
+
+
+def main(args=None):
+    """Command line interface to replay a trace against a manager configuration"""
+    from optparse import OptionParser
+    from . import mman
+
+    parser = OptionParser(usage="%prog [options] TRACE")
+    parser.add_option("--manager", default="SlidingWindowMapManager",
+                      help="name of the memory manager type in smmap.mman to replay with")
+    parser.add_option("--window-size", type="int", default=-1, help="window size in bytes")
+    parser.add_option("--max-memory-size", type="int", default=0, help="maximum mapped memory in bytes")
+    parser.add_option("--max-open-handles", type="int", default=sys.maxsize, help="maximum open handles")
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("Require exactly one trace file")
+    # END check arguments
+
+    stats = replay(args[0], getattr(mman, options.manager), window_size=options.window_size,
+                   max_memory_size=options.max_memory_size, max_open_handles=options.max_open_handles)
+    for key in sorted(stats):
+        sys.stdout.write("%s: %s%s" % (key, stats[key], os.linesep))
+    # END for each statistic
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
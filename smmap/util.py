@@ -1,8 +1,16 @@
 """Module containing a memory memory manager which provides a sliding window on a number of memory mapped files"""
 import os
 import sys
+import time
+import mmap as mmap_module
+from contextlib import contextmanager
 
-from mmap import mmap, ACCESS_READ
+from mmap import mmap, ACCESS_READ, ACCESS_WRITE, ACCESS_COPY, PAGESIZE
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+# END handle optional ctypes
 try:
     from mmap import ALLOCATIONGRANULARITY
 except ImportError:
@@ -11,11 +19,18 @@ except ImportError:
     from mmap import PAGESIZE as ALLOCATIONGRANULARITY
 # END handle pythons missing quality assurance
 
+# flag to populate memory maps when they are created, or 0 if the system or python doesn't support it
+MAP_POPULATE = getattr(mmap_module, 'MAP_POPULATE', 0)
+
 __all__ = ["align_to_mmap", "is_64_bit", "buffer",
-           "MapWindow", "MapRegion", "MapRegionList", "ALLOCATIONGRANULARITY"]
+           "MapWindow", "MapRegion", "PreadRegion", "MapRegionList", "GridRegionList", "LatencyHistogram",
+           "ALLOCATIONGRANULARITY", "PAGESIZE", "MAP_POPULATE"]
 
 #{ Utilities
 
+# the most precise clock to measure durations with
+clock = getattr(time, 'perf_counter', time.time)
+
 try:
     # Python 2
     buffer = buffer
@@ -53,6 +68,157 @@ def is_64_bit():
     """:return: True if the system is 64 bit. Otherwise it can be assumed to be 32 bit"""
     return sys.maxsize > (1 << 32) - 1
 
+
+@contextmanager
+def file_descriptor(path_or_fd, flags=0):
+    """Context manager yielding a file descriptor for the given path or file descriptor.
+    If a path was given, the file is opened with the given additional flags and closed once
+    the context is left. File descriptors are passed through and stay open."""
+    if isinstance(path_or_fd, int):
+        yield path_or_fd
+        return
+    # END handle fd
+    fd = os.open(path_or_fd, os.O_RDONLY | getattr(os, 'O_BINARY', 0) | flags)
+    try:
+        yield fd
+    finally:
+        os.close(fd)
+    # END assure file is closed
+
+
+def _pread_into(fd, view, offset):
+    """Read bytes of the file at the given offset into the writable memoryview, using a single call
+    :return: amount of bytes read, 0 at the end of the file"""
+    preadv = getattr(os, 'preadv', None)
+    if preadv is not None:
+        return preadv(fd, [view], offset)
+    # END fast path
+    data = os.pread(fd, len(view), offset)
+    view[:len(data)] = data
+    return len(data)
+
+
+def advise_file(fd, offset, size, advice):
+    """Tell the kernel how we are going to access the given range of an open file, using posix_fadvise
+    :param advice: name of the advice without prefix, like 'WILLNEED' or 'DONTNEED'
+    :return: True if the advice was given, False if the system doesn't support it"""
+    fadvise = getattr(os, 'posix_fadvise', None)
+    advice = getattr(os, 'POSIX_FADV_' + advice, None)
+    if fadvise is None or advice is None:
+        return False
+    # END handle unsupported system
+    fadvise(fd, offset, size, advice)
+    return True
+
+
+def advise_map(mf, offset, size, advice):
+    """Tell the kernel how we are going to access the given range of a memory map, using madvise
+    :param mf: the memory map, as returned by MapRegion.map()
+    :param offset: offset relative to the beginning of the map. It doesn't need to be aligned
+    :param advice: name of the advice without prefix, like 'WILLNEED' or 'DONTNEED'
+    :return: True if the advice was given, False if the system or python doesn't support it"""
+    madvise = getattr(mf, 'madvise', None)
+    advice = getattr(mmap_module, 'MADV_' + advice, None)
+    if madvise is None or advice is None or size <= 0:
+        return False
+    # END handle unsupported system
+    aligned = (offset // PAGESIZE) * PAGESIZE
+    madvise(advice, aligned, size + offset - aligned)
+    return True
+
+
+def touch_pages(mf, offset, size):
+    """Read one byte of each page in the given range of the memory map mf to fault it in
+    :return: amount of touched pages"""
+    return len(mf[offset:offset + size:PAGESIZE])
+
+
+def read_pages(fd, offset, size, scratch):
+    """Read the given range of an open file into the writable scratch buffer, chunk by chunk, to bring it
+    into the page cache. Unlike touch_pages(), which holds the GIL while the kernel waits for the disk,
+    pread releases it. Faulting in the cached pages of a memory map afterwards is cheap.
+    :return: amount of bytes read, which is 0 if the system doesn't support pread"""
+    if not hasattr(os, 'pread'):
+        return 0
+    # END handle unsupported system
+    view = memoryview(scratch)
+    done = 0
+    while done < size:
+        count = _pread_into(fd, view[:min(len(view), size - done)], offset + done)
+        if not count:
+            break
+        # END handle end of file
+        done += count
+    # END for each chunk
+    return done
+
+
+_mincore = None     # lazily loaded mincore function, or False if unavailable
+
+
+def _load_mincore():
+    """:return: tuple of (mincore, PyObject_GetBuffer, PyBuffer_Release, Py_buffer) ctypes functions,
+        or None if the system doesn't support it"""
+    global _mincore
+    if _mincore is None:
+        _mincore = False
+        if ctypes is not None and sys.platform.startswith('linux'):
+            try:
+                class Py_buffer(ctypes.Structure):
+                    _fields_ = [('buf', ctypes.c_void_p), ('obj', ctypes.c_void_p), ('len', ctypes.c_ssize_t),
+                                ('itemsize', ctypes.c_ssize_t), ('readonly', ctypes.c_int),
+                                ('ndim', ctypes.c_int), ('format', ctypes.c_char_p),
+                                ('shape', ctypes.c_void_p), ('strides', ctypes.c_void_p),
+                                ('suboffsets', ctypes.c_void_p), ('internal', ctypes.c_void_p)]
+
+                libc = ctypes.CDLL(None, use_errno=True)
+                mincore = libc.mincore
+                mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p)
+                mincore.restype = ctypes.c_int
+                get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+                get_buffer.argtypes = (ctypes.py_object, ctypes.POINTER(Py_buffer), ctypes.c_int)
+                get_buffer.restype = ctypes.c_int
+                release_buffer = ctypes.pythonapi.PyBuffer_Release
+                release_buffer.argtypes = (ctypes.POINTER(Py_buffer),)
+                release_buffer.restype = None
+                _mincore = (mincore, get_buffer, release_buffer, Py_buffer)
+            except (AttributeError, OSError):
+                pass
+            # END handle missing symbols
+        # END handle platform
+    # END load functions
+    return _mincore or None
+
+
+def resident_size(mf):
+    """:return: amount of bytes of the memory map mf which are currently resident in memory, as
+        reported by mincore, or None if this cannot be determined on the current system"""
+    funcs = _load_mincore()
+    size = len(mf)
+    if funcs is None or not size:
+        return None
+    # END handle unsupported system
+    mincore, get_buffer, release_buffer, Py_buffer = funcs
+
+    view = Py_buffer()
+    try:
+        get_buffer(mf, ctypes.byref(view), 0)
+    except (TypeError, ValueError, BufferError):
+        return None
+    # END handle objects without buffer interface
+    try:
+        vec = (ctypes.c_ubyte * ((size + PAGESIZE - 1) // PAGESIZE))()
+        if mincore(view.buf, size, vec) != 0:
+            return None
+        # END handle error
+    finally:
+        release_buffer(ctypes.byref(view))
+    # END release the buffer
+
+    # linux only ever sets the lowest bit, all others are reserved and zero
+    num_pages = len(vec) - bytearray(vec).count(b'\0')
+    return min(num_pages * PAGESIZE, size)
+
 #}END utilities
 
 
@@ -104,6 +270,97 @@ class MapWindow(object):
         self.size = min(self.size + (window.ofs - self.ofs_end()), max_size)
 
 
+class LatencyHistogram(object):
+
+    """A histogram of durations with a fixed amount of logarithmic buckets, similar to HDR histograms.
+    Recording a value is cheap and takes constant time and memory, which allows to keep it enabled in production.
+    Durations are recorded with a resolution of nanoseconds, and a relative error of at most 12.5 percent."""
+    __slots__ = (
+        '_counts',      # amount of recorded values per bucket
+        '_count',       # total amount of recorded values
+        '_sum',         # sum of all recorded values in seconds
+        '_max',         # largest recorded value in seconds
+    )
+
+    _num_buckets = 16 + 61 * 8
+
+    def __init__(self):
+        self.reset()
+
+    def __repr__(self):
+        return "LatencyHistogram(count=%i, p50=%g, p99=%g, max=%g)" % (
+            self._count, self.percentile(50), self.percentile(99), self._max)
+
+    @staticmethod
+    def _bucket(ns):
+        """:return: index of the bucket for the given amount of nanoseconds"""
+        if ns < 16:
+            return max(ns, 0)
+        shift = ns.bit_length() - 4
+        return 16 + (shift - 1) * 8 + (ns >> shift) - 8
+
+    @staticmethod
+    def _bucket_end(index):
+        """:return: the first amount of nanoseconds not contained in the bucket with the given index"""
+        if index < 16:
+            return index + 1
+        shift = (index - 16) // 8 + 1
+        return (8 + (index - 16) % 8 + 1) << shift
+
+    #{ Interface
+
+    def record(self, seconds):
+        """Record the given duration in seconds"""
+        self._counts[self._bucket(int(seconds * 1e9))] += 1
+        self._count += 1
+        self._sum += seconds
+        if seconds > self._max:
+            self._max = seconds
+        # END update maximum
+
+    def reset(self):
+        """Forget all recorded values"""
+        self._counts = [0] * self._num_buckets
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def count(self):
+        """:return: amount of recorded values"""
+        return self._count
+
+    def mean(self):
+        """:return: mean of all recorded durations in seconds, or 0 if there are none"""
+        return self._count and self._sum / self._count
+
+    def max(self):
+        """:return: largest recorded duration in seconds"""
+        return self._max
+
+    def percentile(self, p):
+        """:return: the duration in seconds which p percent of all recorded durations didn't exceed,
+            or 0 if nothing was recorded. It is the upper bound of the respective bucket, but never
+            larger than the largest recorded duration"""
+        if not self._count:
+            return 0.0
+        # END handle empty histogram
+        threshold = self._count * p / 100.0
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= threshold:
+                return min(self._bucket_end(index) / 1e9, self._max)
+            # END found bucket
+        # END for each bucket
+        return self._max
+
+    def percentiles(self, ps=(50, 90, 99, 99.9)):
+        """:return: dict mapping each of the given percentiles to its duration, see percentile()"""
+        return dict((p, self.percentile(p)) for p in ps)
+
+    #} END interface
+
+
 class MapRegion(object):
 
     """Defines a mapped region of memory, aligned to pagesizes
@@ -113,7 +370,10 @@ class MapRegion(object):
         '_b',   # beginning of mapping
         '_mf',  # mapped memory chunk (as returned by mmap)
         '_uc',  # total amount of usages
+        '_hc',  # amount of times a cursor used us
         '_size',  # cached size of our memory map
+        '_stale',  # True if the file changed since we were mapped
+        '_dirty',  # tuple of (begin, end) of the modified bytes of our map, or None
         '__weakref__'
     ]
     _need_compat_layer = sys.version_info[:2] < (2, 6)
@@ -125,26 +385,40 @@ class MapRegion(object):
     #{ Configuration
     #} END configuration
 
-    def __init__(self, path_or_fd, ofs, size, flags=0):
+    def __init__(self, path_or_fd, ofs, size, flags=0, access=ACCESS_READ, populate=False):
         """Initialize a region, allocate the memory map
         :param path_or_fd: path to the file to map, or the opened file descriptor
         :param ofs: **aligned** offset into the file to be mapped
         :param size: if size is larger then the file on disk, the whole file will be
             allocated the the size automatically adjusted
         :param flags: additional flags to be given when opening the file.
+        :param access: one of mmap.ACCESS_READ, ACCESS_WRITE or ACCESS_COPY. File descriptors must be
+            opened for writing if ACCESS_WRITE is used
+        :param populate: if True, all pages are faulted in while mapping them, using MAP_POPULATE. It is ignored
+            on systems which don't support it
         :raise Exception: if no memory can be allocated"""
         self._b = ofs
         self._size = 0
         self._uc = 0
+        self._hc = 0
+        self._stale = False
+        self._dirty = None
 
         if isinstance(path_or_fd, int):
             fd = path_or_fd
         else:
-            fd = os.open(path_or_fd, os.O_RDONLY | getattr(os, 'O_BINARY', 0) | flags)
+            mode = access == ACCESS_WRITE and os.O_RDWR or os.O_RDONLY
+            fd = os.open(path_or_fd, mode | getattr(os, 'O_BINARY', 0) | flags)
         # END handle fd
 
         try:
-            kwargs = dict(access=ACCESS_READ, offset=ofs)
+            kwargs = dict(access=access, offset=ofs)
+            if populate and MAP_POPULATE:
+                # access can't be combined with flags, so we have to translate it
+                prot = mmap_module.PROT_READ | (access != ACCESS_READ and mmap_module.PROT_WRITE or 0)
+                mflags = access == ACCESS_COPY and mmap_module.MAP_PRIVATE or mmap_module.MAP_SHARED
+                kwargs = dict(flags=mflags | MAP_POPULATE, prot=prot, offset=ofs)
+            # END handle populate
             corrected_size = size
             sizeofs = ofs
             if self._need_compat_layer:
@@ -202,10 +476,27 @@ class MapRegion(object):
         """:return: True if the given offset can be read in our mapped region"""
         return self._b <= ofs < self._b + self._size
 
+    def resident_size(self):
+        """:return: amount of bytes of our mapping which are actually resident in memory. If this
+            cannot be determined on this system, our size is returned as we have to assume the worst"""
+        rsize = resident_size(self._mf)
+        if rsize is None:
+            return self.size()
+        return rsize
+
     def client_count(self):
         """:return: number of clients currently using this region"""
         return self._uc
 
+    def hit_count(self):
+        """:return: amount of times a cursor was pointed to this region"""
+        return self._hc
+
+    def is_stale(self):
+        """:return: True if the mapped file was replaced or changed after we were mapped. Stale regions
+            are not handed out anymore, and released once their last client is done with them"""
+        return self._stale
+
     def increment_client_count(self, ofs = 1):
         """Adjust the usage count by the given positive or negative offset.
         If usage count equals 0, we will auto-release our resources
@@ -220,8 +511,43 @@ class MapRegion(object):
             return False
         # end handle release
 
+    def mark_dirty(self, ofs=0, size=None):
+        """Remember that the given range of our map was modified, so that flush() writes it back to the file.
+        Writes done by WindowCursor.write_at() are marked automatically
+        :param ofs: offset relative to the beginning of our map
+        :param size: amount of modified bytes. If None, everything from ofs to our end is marked"""
+        if size is None:
+            size = self._size - ofs
+        # END handle size
+        if self._dirty is None:
+            self._dirty = (ofs, ofs + size)
+        else:
+            self._dirty = (min(self._dirty[0], ofs), max(self._dirty[1], ofs + size))
+        # END merge ranges
+
+    def is_dirty(self):
+        """:return: True if our map was modified since it was flushed the last time"""
+        return self._dirty is not None
+
+    def flush(self):
+        """Write all modified bytes back to the file using a single msync call, and wait for it to finish.
+        Copy-on-write maps never write back
+        :return: amount of bytes which were flushed, starting at the first modified page"""
+        if self._dirty is None:
+            return 0
+        # END handle clean map
+        begin, end = self._dirty
+        begin -= begin % PAGESIZE
+        self._mf.flush(begin, end - begin)
+        self._dirty = None
+        return end - begin
+
     def release(self):
-        """Release all resources this instance might hold. Must only be called if there usage_count() is zero"""
+        """Release all resources this instance might hold. Must only be called if there usage_count() is zero.
+        Modified bytes are flushed beforehand"""
+        if self._dirty is not None:
+            self.flush()
+        # END flush modifications
         self._mf.close()
 
     # re-define all methods which need offset adjustments in compatibility mode
@@ -243,12 +569,91 @@ class MapRegion(object):
     #} END interface
 
 
+class PreadRegion(MapRegion):
+
+    """A region holding a copy of a range of the file in anonymous, page-aligned memory, which is filled
+    using pread instead of mapping the file.
+
+    Reading it never faults on the file, which makes it suitable for network file systems with slow
+    page faults. A file truncated while we use it doesn't raise SIGBUS either, we keep the bytes we read.
+    Modifications of writable regions are written back with pwrite when they are flushed, copy-on-write
+    regions keep them private.
+
+    **Note:** file descriptors must stay open for as long as writable regions of them may be flushed"""
+    __slots__ = (
+        '_path_or_fd',  # path or file descriptor of the file we read, to write back modifications
+        '_access',      # mmap access mode we emulate
+    )
+
+    def __init__(self, path_or_fd, ofs, size, flags=0, access=ACCESS_READ, populate=False):
+        """See MapRegion. All pages are populated anyway, which is why populate is ignored"""
+        self._b = ofs
+        self._size = 0
+        self._uc = 0
+        self._hc = 0
+        self._stale = False
+        self._dirty = None
+        self._path_or_fd = path_or_fd
+        self._access = access
+
+        with file_descriptor(path_or_fd, flags) as fd:
+            actual_size = max(0, min(os.fstat(fd).st_size - ofs, size))
+            # anonymous maps can't be empty
+            self._mf = mmap(-1, max(actual_size, 1))
+            view = memoryview(self._mf)
+            try:
+                pos = 0
+                while pos < actual_size:
+                    count = _pread_into(fd, view[pos:actual_size], ofs + pos)
+                    if not count:
+                        break
+                    # END handle end of file
+                    pos += count
+                # END while there is data to read
+            finally:
+                view.release()
+            # END release view
+            self._size = pos
+        # END with file
+        self.increment_client_count()
+
+    def __repr__(self):
+        return "PreadRegion<%i, %i>" % (self._b, self.size())
+
+    def resident_size(self):
+        return self._size
+
+    def flush(self):
+        """Write all modified bytes back to the file using pwrite. Copy-on-write regions never write back
+        :return: amount of modified bytes"""
+        if self._dirty is None:
+            return 0
+        # END handle clean region
+        begin, end = self._dirty
+        if self._access == ACCESS_WRITE:
+            with file_descriptor(self._path_or_fd, os.O_RDWR) as fd:
+                pos = begin
+                while pos < end:
+                    pos += os.pwrite(fd, self._mf[pos:end], self._b + pos)
+                # END while there is data to write
+            # END with file
+        # END handle writable region
+        self._dirty = None
+        return end - begin
+
+
 class MapRegionList(list):
 
     """List of MapRegion instances associating a path with a list of regions."""
     __slots__ = (
         '_path_or_fd',  # path or file descriptor which is mapped by all our regions
-        '_file_size'    # total size of the file we map
+        '_file_size',   # total size of the file we map
+        '_identity',    # tuple of (st_dev, st_ino, st_size, st_mtime_ns) of the file we map
+        '_checked',     # time at which our identity was last validated
+        '_aliases',     # other paths or file descriptors referring to the same file
+        '_access',      # mmap access mode of all our regions
+        '_backend',     # name of the backend creating our regions, like 'mmap', or None if it wasn't chosen yet
+        '_num_cursors',     # amount of live cursors using us
     )
 
     def __new__(cls, path):
@@ -257,20 +662,108 @@ class MapRegionList(list):
     def __init__(self, path_or_fd):
         self._path_or_fd = path_or_fd
         self._file_size = None
+        self._identity = None
+        self._checked = 0
+        self._aliases = list()
+        self._access = ACCESS_READ
+        self._backend = None
+        self._num_cursors = 0
+
+    def _stat(self):
+        """:return: tuple of (st_dev, st_ino, st_size, st_mtime_ns) of our file as it is now on disk"""
+        if isinstance(self._path_or_fd, string_types()):
+            st = os.stat(self._path_or_fd)
+        else:
+            st = os.fstat(self._path_or_fd)
+        # END handle path type
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1e9)
+        # END handle python without nanosecond precision
+        return (st.st_dev, st.st_ino, st.st_size, mtime_ns)
 
     def path_or_fd(self):
         """:return: path or file descriptor we are attached to"""
         return self._path_or_fd
 
+    def aliases(self):
+        """:return: list of other paths or file descriptors which refer to the file we map"""
+        return self._aliases
+
     def file_size(self):
         """:return: size of file we manager"""
         if self._file_size is None:
-            if isinstance(self._path_or_fd, string_types()):
-                self._file_size = os.stat(self._path_or_fd).st_size
-            else:
-                self._file_size = os.fstat(self._path_or_fd).st_size
-            # END handle path type
+            self._identity = self._stat()
+            self._file_size = self._identity[2]
+            self._checked = time.time()
         # END update file size
         return self._file_size
 
+    def identity(self):
+        """:return: tuple of (st_dev, st_ino, st_size, st_mtime_ns) identifying the file and the version of it
+            we map, or None if it is unknown. It is determined once and cached until reset() is called"""
+        if self._identity is None:
+            self.file_size()
+        # END handle uninitialized identity
+        return self._identity
+
+    def access(self):
+        """:return: mmap access mode of all our regions, like mmap.ACCESS_READ"""
+        return self._access
+
+    def backend(self):
+        """:return: name of the backend creating our regions, like 'mmap' or 'pread', or None if it wasn't
+            chosen yet"""
+        return self._backend
+
+    def is_stale(self):
+        """:return: True if the file on disk is not the one we map anymore, as it was replaced, changed or removed.
+            Files we didn't query yet are never stale. Files we map for writing are only stale if they were
+            replaced, as our own writes change them as well"""
+        if self._identity is None:
+            return False
+        # END handle unknown file
+        try:
+            if self._access == ACCESS_WRITE:
+                return self._stat()[:2] != self._identity[:2]
+            # END handle writable files
+            return self._stat() != self._identity
+        except OSError:
+            return True
+        # END handle removed files
+
+    def reset(self):
+        """Forget our cached file size and identity, they are queried from disk again when needed.
+        Must only be called if we don't contain any region"""
+        assert not len(self), "Cannot reset region list which still contains regions"
+        self._file_size = None
+        self._identity = None
+
+
+class GridRegionList(MapRegionList):
+
+    """List of MapRegion instances which additionally indexes its regions by their offset. This allows
+    finding regions in constant time if they are placed on a fixed grid."""
+    __slots__ = (
+        '_index',       # mapping of offset of the first byte -> region
+    )
+
+    def __init__(self, path_or_fd):
+        super(GridRegionList, self).__init__(path_or_fd)
+        self._index = dict()
+
+    def append(self, region):
+        super(GridRegionList, self).append(region)
+        self._index[region._b] = region
+
+    def remove(self, region):
+        super(GridRegionList, self).remove(region)
+        if self._index.get(region._b) is region:
+            del(self._index[region._b])
+        # END remove from index
+
+    def region_at(self, ofs):
+        """:return: the region whose first byte is at the given absolute offset, or None"""
+        return self._index.get(ofs)
+
 #} END utility classes